@@ -30,6 +30,22 @@ function ExperimentManager () {
     // Char separating multiple msg args:
     var ARGS_SEPARATOR    = '|';
 
+    // Compact binary protocol (see compact_protocol.py on the server).
+    // Offered to the server in our reply to its test message. Used
+    // only if the server confirms in its sendLogin message:
+    var COMPACT_PROTOCOL_VERSION = 1;
+    var COMPACT_OPCODES = {"test" : 1, "sendLogin" : 2, "login" : 3, "addWord" : 4,
+			   "goodGuessClicked" : 5, "parDone" : 6, "newPar" : 7, "showMsg" : 8,
+			   "waitForPlayer" : 9, "dyadComplete" : 10, "subscribeToTree" : 11,
+			   "newAssignment" : 12, "done" : 13, "pleaseClose" : 14};
+    var COMPACT_OPNAMES = {};
+    for (var opName in COMPACT_OPCODES)
+	COMPACT_OPNAMES[COMPACT_OPCODES[opName]] = opName;
+    var compactSupported = (typeof(ArrayBuffer)!=="undefined" && typeof(Uint8Array)!=="undefined");
+    var useCompact = false;
+    // Events waiting to go out together in one compact frame:
+    var pendingEvents = [];
+
     var currParID = -1;
     var myID    = undefined;
     var otherID = undefined;
@@ -41,6 +57,10 @@ function ExperimentManager () {
 
 	    // CONTACT_MACHINE and EXPERIMENT_CONTACT_PORT are set in echoTreeExperiment.js:
 	    wsExp = new WebSocket("ws://" + CONTACT_MACHINE + ":" + EXPERIMENT_CONTACT_PORT + "/echo_tree_experiment");
+	    if (compactSupported && ("binaryType" in wsExp))
+		wsExp.binaryType = "arraybuffer";
+	    else
+		compactSupported = false;
 
 	    wsExp.onopen = function () {
 	    };
@@ -50,6 +70,11 @@ function ExperimentManager () {
 	    };
 
 	    wsExp.onmessage = function (event) {
+		if (typeof(event.data) !== "string") {
+		    // Binary frame of the compact protocol:
+		    myExpManager.execCompactFrame(event.data);
+		    return;
+		}
 		if (event.data.length == 0)
 		    return;
 		myExpManager.execCmd(event.data);
@@ -87,12 +112,83 @@ function ExperimentManager () {
 	if (cmdStr.length == 0)
 	    return;
 	var cmdArr = cmdStr.split(OP_CODE_SEPARATOR);
-	cmdOp = cmdArr.shift();
+	var cmdOp = cmdArr.shift();
+	this.execOp(cmdOp, cmdArr);
+    }
+
+    this.execCompactFrame = function(frameBuffer) {
+	// Frame: version byte, then events of the form
+	// opCode byte, numFields byte, and per field a
+	// 16 bit big-endian length, followed by UTF-8 bytes:
+	var bytes = new Uint8Array(frameBuffer);
+	if (bytes.length == 0 || bytes[0] != COMPACT_PROTOCOL_VERSION) {
+	    this.logError("Unsupported compact frame from server.");
+	    return;
+	}
+	var pos = 1;
+	while (pos < bytes.length) {
+	    var opName = COMPACT_OPNAMES[bytes[pos]];
+	    var numFields = bytes[pos+1];
+	    pos += 2;
+	    var fields = [];
+	    for (var fieldNum = 0; fieldNum < numFields; fieldNum++) {
+		var fieldLen = (bytes[pos] << 8) | bytes[pos+1];
+		pos += 2;
+		var byteStr = "";
+		for (var i = pos; i < pos + fieldLen; i++)
+		    byteStr += String.fromCharCode(bytes[i]);
+		fields.push(decodeURIComponent(escape(byteStr)));
+		pos += fieldLen;
+	    }
+	    if (opName === undefined) {
+		this.logError("Unknown opcode in compact frame from server.");
+		return;
+	    }
+	    // Present the fields the way the text protocol does:
+	    this.execOp(opName, (fields.length == 0) ? [] : [fields.join(ARGS_SEPARATOR)]);
+	}
+    }
+
+    this.sendEvent = function(opName, fields) {
+	// Send one message to the server. With the compact protocol,
+	// events generated in one pass through the browser's event
+	// loop are sent together in one binary frame:
+	if (!useCompact) {
+	    wsExp.send(opName + OP_CODE_SEPARATOR + fields.join(ARGS_SEPARATOR));
+	    return;
+	}
+	if (pendingEvents.length == 0)
+	    setTimeout(function() { myExpManager.flushEvents(); }, 0);
+	pendingEvents.push([opName, fields]);
+    }
+
+    this.flushEvents = function() {
+	if (pendingEvents.length == 0)
+	    return;
+	var frameBytes = [COMPACT_PROTOCOL_VERSION];
+	for (var eventNum = 0; eventNum < pendingEvents.length; eventNum++) {
+	    var fields = pendingEvents[eventNum][1];
+	    frameBytes.push(COMPACT_OPCODES[pendingEvents[eventNum][0]], fields.length);
+	    for (var fieldNum = 0; fieldNum < fields.length; fieldNum++) {
+		var byteStr = unescape(encodeURIComponent(String(fields[fieldNum])));
+		frameBytes.push((byteStr.length >> 8) & 0xFF, byteStr.length & 0xFF);
+		for (var i = 0; i < byteStr.length; i++)
+		    frameBytes.push(byteStr.charCodeAt(i));
+	    }
+	}
+	pendingEvents = [];
+	wsExp.send(new Uint8Array(frameBytes).buffer);
+    }
+
+    this.execOp = function(cmdOp, cmdArr) {
 
 	switch (cmdOp) {
 	case "test":
 	    //alert("Got test message");
-	    wsExp.send("test" + OP_CODE_SEPARATOR + " " + whoami + " got it.");
+	    var testReply = "test" + OP_CODE_SEPARATOR + " " + whoami + " got it.";
+	    if (compactSupported)
+		testReply += ARGS_SEPARATOR + "protocols=" + COMPACT_PROTOCOL_VERSION;
+	    wsExp.send(testReply);
 
 	    break;
 	case "showMsg":
@@ -105,6 +201,8 @@ function ExperimentManager () {
 	    break;
 	case "sendLogin":
 	    //alert("Got login prompt.");
+	    // Server confirms the compact protocol with sendLogin>compact=<version>:
+	    useCompact = (cmdArr.shift() === "compact=" + COMPACT_PROTOCOL_VERSION);
 	    var disabledID;
 	    var partnerID;
 	    if (whoami == 'disabledRole') {
@@ -132,7 +230,7 @@ function ExperimentManager () {
 	    // If we are not logged into the server, then we don't
 	    // know yet what our own ID is. Punt if so:
 	    if (myID === undefined) {
-		this.logError("Received subscribeToTree before my own ID was known: " + cmdStr);
+		this.logError("Received subscribeToTree before my own ID was known: " + cmdArr.join(OP_CODE_SEPARATOR));
 		return;
 	    }
 	    // Get the part after the colon:
@@ -277,7 +375,7 @@ function ExperimentManager () {
     }
 
     this.onwordadded = function(word) {
-	wsExp.send("addWord" + OP_CODE_SEPARATOR + word);
+	this.sendEvent("addWord", [word]);
     }
 
     this.ontickertyped = function(evt) {
@@ -325,11 +423,11 @@ function ExperimentManager () {
     }
 
     this.onGoodGuessClicked = function () {
-	wsExp.send("goodGuessClicked" + OP_CODE_SEPARATOR);
+	expManager.sendEvent("goodGuessClicked", []);
     }
 
     this.onParCompleteClicked = function () {
-	wsExp.send("parDone" + OP_CODE_SEPARATOR + this.currParID);
+	expManager.sendEvent("parDone", [expManager.currParID]);
     }
 
     window.onunload = function() {
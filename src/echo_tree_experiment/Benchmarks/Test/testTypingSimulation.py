@@ -0,0 +1,20 @@
+import unittest;
+
+from echo_tree_experiment.Benchmarks.typing_simulation import percentile;
+
+
+class TestTypingSimulation(unittest.TestCase):
+
+    def test_percentile(self):
+        self.assertEqual(5, percentile(range(1, 11), 50));
+        self.assertEqual(10, percentile(range(1, 11), 95));
+        self.assertEqual(95, percentile(range(1, 101), 95));
+        self.assertEqual(99, percentile(range(1, 101), 99));
+        self.assertEqual(100, percentile(range(1, 101), 100));
+        # Small percentages still pick the smallest value:
+        self.assertEqual(1, percentile(range(1, 101), 0));
+        self.assertEqual(7, percentile([7], 50));
+        self.assertIsNone(percentile([], 50));
+
+if __name__ == '__main__':
+    unittest.main();
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+'''
+Micro-benchmarks of WordExplorer, for telling whether a database,
+index, or cache change helps. For each arity, over a workload of root
+words, it times:
+
+    <arity>.followers.cold   getSortedFollowers() of a new explorer, whose cache is empty
+    <arity>.followers.warm   getSortedFollowers() again, from the cache
+    <arity>.tree.cold        makeWordTree() of a new explorer
+    <arity>.tree.warm        makeWordTree() again, all followers cached
+    <arity>.json             makeJSONTree() of the trees
+
+The workload draws root words from the database with Zipf's law: the
+word with the k-th most followers is drawn with probability
+proportional to 1/k^exponent, so that common words recur, as they do
+when people type. A cold pass therefore hits the cache for repeated
+words, as a freshly started server would.
+
+Each benchmark runs numRepeats times; the fastest run counts, since
+the slower ones are slowed down by other processes. Results are kept
+in microseconds per operation.
+
+Run as a script, the module prints the results, optionally saves them
+as JSON, and compares them with the results of an earlier run. The
+exit status is 1 if any benchmark got slower than the threshold allows:
+
+    tree_benchmarks.py [dbPath] [-a {2,3}] [-n numWords] [-r numRepeats] [-z exponent]
+                       [-o results.json] [-b baseline.json] [-t threshold]
+'''
+
+import os;
+import sys;
+import json;
+import time;
+import bisect;
+import random;
+import sqlite3;
+import argparse;
+import platform;
+from timeit import default_timer;
+
+from echo_tree_experiment.echo_tree import WordExplorer, ARITY;
+
+scriptDir = os.path.realpath(os.path.dirname(__file__));
+
+DEFAULT_DB = os.path.normpath(os.path.join(scriptDir, '../Resources/henryBlog.db'));
+
+ARITY_NAMES = {ARITY.BIGRAM : 'bigram', ARITY.TRIGRAM : 'trigram'};
+
+DEFAULT_NUM_WORDS = 2000;
+DEFAULT_NUM_REPEATS = 5;
+DEFAULT_ZIPF_EXPONENT = 1.0;
+DEFAULT_SEED = 4711;
+# Fraction by which a benchmark may be slower than its baseline:
+DEFAULT_THRESHOLD = 0.1;
+
+# Version of the JSON result format:
+RESULTS_FORMAT_VERSION = 1;
+
+def zipfWorkload(dbPath, numWords, exponent=DEFAULT_ZIPF_EXPONENT, seed=DEFAULT_SEED):
+    '''
+    Draw root words with Zipf's law, ranking the database's words by
+    their number of bigram followers.
+    @param dbPath: the n-gram database
+    @type dbPath: string
+    @param numWords: number of words to draw
+    @type numWords: int
+    @param exponent: Zipf exponent; larger values draw the common words more often.
+    @type exponent: float
+    @param seed: random seed, so that runs time the same workload.
+    @type seed: int
+    @return: the drawn words
+    @rtype: [string]
+    '''
+    conn = sqlite3.connect(dbPath);
+    try:
+        # Ties are broken by the word, so that the ranks do not depend on the query plan:
+        rankedWords = [row[0] for row in conn.execute('SELECT word1, COUNT(*) AS numFollowers FROM Bigrams '
+                                                      'GROUP BY word1 ORDER BY numFollowers DESC, word1')];
+    finally:
+        conn.close();
+    if len(rankedWords) == 0:
+        raise ValueError("Database %s holds no bigrams." % dbPath);
+    cumulativeWeights = [];
+    totalWeight = 0.0;
+    for rank in xrange(1, len(rankedWords) + 1):
+        totalWeight += 1.0 / rank ** exponent;
+        cumulativeWeights.append(totalWeight);
+    rng = random.Random(seed);
+    return [rankedWords[min(bisect.bisect_left(cumulativeWeights, rng.random() * totalWeight), len(rankedWords) - 1)]
+            for i in xrange(numWords)];
+
+def timePass(operation, items):
+    '''
+    @return: seconds that calling the operation on each item takes.
+    @rtype: float
+    '''
+    startTime = default_timer();
+    for item in items:
+        operation(item);
+    return default_timer() - startTime;
+
+def runBenchmarks(dbPath, arities, words, numRepeats=DEFAULT_NUM_REPEATS, progressLogger=None):
+    '''
+    Run the benchmarks of the given arities.
+    @param dbPath: the n-gram database
+    @type dbPath: string
+    @param arities: ARITY.BIGRAM and/or ARITY.TRIGRAM
+    @type arities: [int]
+    @param words: the root word workload
+    @type words: [string]
+    @param numRepeats: runs of each benchmark; the fastest counts.
+    @type numRepeats: int
+    @param progressLogger: if provided, called with progress messages.
+    @type progressLogger: callable
+    @return: maps each benchmark name to the microseconds per operation of its fastest run.
+    @rtype: {string : float}
+    '''
+    log = progressLogger if progressLogger is not None else lambda msg: None;
+    timings = {};
+    def record(name, secs):
+        usPerOp = 1000000.0 * secs / len(words);
+        timings[name] = min(timings.get(name, usPerOp), usPerOp);
+    for arity in arities:
+        prefix = ARITY_NAMES[arity];
+        for repeat in xrange(numRepeats):
+            explorer = WordExplorer(dbPath);
+            record(prefix + '.followers.cold', timePass(lambda word: explorer.getSortedFollowers(word, arity), words));
+            record(prefix + '.followers.warm', timePass(lambda word: explorer.getSortedFollowers(word, arity), words));
+            explorer = WordExplorer(dbPath);
+            record(prefix + '.tree.cold', timePass(lambda word: explorer.makeWordTree(word, arity), words));
+            record(prefix + '.tree.warm', timePass(lambda word: explorer.makeWordTree(word, arity), words));
+            trees = [explorer.makeWordTree(word, arity) for word in words];
+            record(prefix + '.json', timePass(explorer.makeJSONTree, trees));
+        log("Ran the %s benchmarks %d times." % (prefix, numRepeats));
+    return timings;
+
+def makeResults(dbPath, words, numRepeats, exponent, seed, timings):
+    '''
+    @return: the timings, with what is needed to judge whether two runs are comparable.
+    @rtype: {string : <any>}
+    '''
+    conn = sqlite3.connect(dbPath);
+    try:
+        modelVersion = conn.execute('PRAGMA user_version').fetchone()[0];
+    finally:
+        conn.close();
+    return {'formatVersion' : RESULTS_FORMAT_VERSION,
+            'time'          : time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python'        : platform.python_version(),
+            'platform'      : platform.platform(),
+            'db'            : {'path' : os.path.realpath(dbPath), 'size' : os.path.getsize(dbPath), 'modelVersion' : modelVersion},
+            'workload'      : {'numWords' : len(words), 'distinctWords' : len(set(words)),
+                               'zipfExponent' : exponent, 'seed' : seed},
+            'numRepeats'    : numRepeats,
+            'usPerOp'       : timings};
+
+def compareResults(baseline, results, threshold=DEFAULT_THRESHOLD):
+    '''
+    Compare the timings of two runs.
+    @param baseline: results of the earlier run, as made by makeResults()
+    @type baseline: {string : <any>}
+    @param results: results of this run
+    @type results: {string : <any>}
+    @param threshold: fraction by which a benchmark may be slower than its baseline.
+    @type threshold: float
+    @return: for each benchmark in both runs, in name order: (name, baseline
+             microseconds, microseconds, ratio, True if slower than allowed).
+    @rtype: [(string, float, float, float, boolean)]
+    @raise ValueError: if the baseline has another format version.
+    '''
+    if baseline.get('formatVersion') != RESULTS_FORMAT_VERSION:
+        raise ValueError("Baseline has result format version %s; can only compare version %d." %
+                         (baseline.get('formatVersion'), RESULTS_FORMAT_VERSION));
+    comparisons = [];
+    for name in sorted(set(baseline['usPerOp'].keys()) & set(results['usPerOp'].keys())):
+        (baseUs, us) = (baseline['usPerOp'][name], results['usPerOp'][name]);
+        ratio = us / baseUs if baseUs > 0 else float('inf');
+        comparisons.append((name, baseUs, us, ratio, ratio > 1.0 + threshold));
+    return comparisons;
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog='tree_benchmarks');
+    parser.add_argument("dbPath", nargs='?', default=DEFAULT_DB,
+                        help="n-gram database. Default: %s." % os.path.relpath(DEFAULT_DB));
+    parser.add_argument("-a", "--arity", type=int, choices=sorted(ARITY_NAMES.keys()), action='append', dest='arities',
+                        help="arity to benchmark; may be repeated. Default: all.");
+    parser.add_argument("-n", "--numWords", type=int, default=DEFAULT_NUM_WORDS,
+                        help="root words in the workload. Default: %d." % DEFAULT_NUM_WORDS);
+    parser.add_argument("-r", "--repeats", type=int, dest='numRepeats', default=DEFAULT_NUM_REPEATS,
+                        help="runs of each benchmark; the fastest counts. Default: %d." % DEFAULT_NUM_REPEATS);
+    parser.add_argument("-z", "--zipf", type=float, dest='exponent', default=DEFAULT_ZIPF_EXPONENT,
+                        help="Zipf exponent of the workload. Default: %.1f." % DEFAULT_ZIPF_EXPONENT);
+    parser.add_argument("-s", "--seed", type=int, default=DEFAULT_SEED,
+                        help="seed of the workload. Default: %d." % DEFAULT_SEED);
+    parser.add_argument("-o", "--output", dest='outputPath', help="save the results to this JSON file.");
+    parser.add_argument("-b", "--baseline", dest='baselinePath', help="JSON results of an earlier run to compare with.");
+    parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="fraction by which a benchmark may be slower than its baseline. Default: %.2f." % DEFAULT_THRESHOLD);
+    args = parser.parse_args();
+
+    def printMsg(msg):
+        print msg;
+
+    if not os.path.exists(args.dbPath):
+        print("Error: database %s does not exist." % args.dbPath);
+        sys.exit(1);
+    if args.numWords < 1 or args.numRepeats < 1:
+        print("Error: need at least one word and one repeat.");
+        sys.exit(1);
+    arities = sorted(set(args.arities)) if args.arities is not None else sorted(ARITY_NAMES.keys());
+    baseline = None;
+    if args.baselinePath is not None:
+        with open(args.baselinePath) as fd:
+            baseline = json.load(fd);
+
+    words = zipfWorkload(args.dbPath, args.numWords, args.exponent, args.seed);
+    printMsg("Workload: %d root words, %d distinct." % (len(words), len(set(words))));
+    timings = runBenchmarks(args.dbPath, arities, words, args.numRepeats, progressLogger=printMsg);
+    results = makeResults(args.dbPath, words, args.numRepeats, args.exponent, args.seed, timings);
+    for name in sorted(timings.keys()):
+        print("%-24s %10.1f us/op" % (name, timings[name]));
+    if args.outputPath is not None:
+        with open(args.outputPath, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True);
+
+    if baseline is not None:
+        try:
+            comparisons = compareResults(baseline, results, args.threshold);
+        except ValueError as e:
+            print("Error: %s" % e);
+            sys.exit(1);
+        if baseline['workload'] != results['workload'] or baseline['db'] != results['db']:
+            print("Warning: the baseline ran another workload, or on another database.");
+        print("%-24s %10s %10s %7s" % ('Benchmark', 'Baseline', 'Now', 'Ratio'));
+        for (name, baseUs, us, ratio, regressed) in comparisons:
+            print("%-24s %10.1f %10.1f %6.2fx%s" % (name, baseUs, us, ratio, '  SLOWER' if regressed else ''));
+        regressions = [comparison[0] for comparison in comparisons if comparison[4]];
+        if len(regressions) > 0:
+            print("FAILED: %d benchmarks are more than %.0f%% slower than the baseline: %s." %
+                  (len(regressions), 100 * args.threshold, ', '.join(regressions)));
+            sys.exit(1);
@@ -0,0 +1,674 @@
+#!/usr/bin/env python
+
+'''
+Load test for echo_tree_server.py. Simulated typists each open a
+WebSocket connection to /subscribe_to_echo_trees, and replay sentences
+from a token file as newRootWord messages, one word whenever they
+would have finished typing it at the given words per minute. The
+server answers each word with the tree it built from it. Optionally,
+each typist also subscribes to the trees of some of the others, so
+that the server fans trees out.
+
+A run has three phases:
+
+   1. Each typist connects, submits its first word, and waits for the
+      tree. Not measured; the server must know a typist before
+      others can subscribe to its trees.
+   2. Each typist subscribes to the trees of the next numSubscriptions
+      typists.
+   3. The typists type their sentences, pausing SENTENCE_PAUSE seconds
+      between sentences. Afterwards, the trees still outstanding are
+      waited for, at most DRAIN_TIMEOUT seconds.
+
+Submit-to-tree latency is the time from sending a word to receiving
+the typist's tree for it. A tree belongs to the oldest outstanding
+word of the typist whose root word it has. The server keeps only the
+latest root word of each typist, so if a typist gets ahead of the
+server, the tree for a later word can arrive instead of those for
+the words before it. Those are counted as superseded, not lost.
+Trees whose root word the typist did not submit count as subscription
+deliveries. Words whose tree never arrived count as lost.
+
+The bundled Tornado has no WebSocket client, so WebSocketClient
+implements the little of RFC 6455 that the test needs. All typists
+run in one thread, driven by select().
+
+Usage, against a running server, or one started for the test with -S:
+
+    typing_simulation.py [-S] [--host host] [--port port] [-c numTypists] [-n numSentences]
+                         [-w wpm] [-k numSubscriptions] [-j results.json] [--maxP95 ms] [--maxP99 ms]
+
+The exit status is 1 if a typist could not connect, if a tree was
+lost, or if a latency percentile exceeds its maximum; for use in CI.
+'''
+
+import os;
+import sys;
+import json;
+import math;
+import time;
+import base64;
+import random;
+import select;
+import signal;
+import socket;
+import struct;
+import hashlib;
+import argparse;
+import subprocess;
+from collections import deque;
+
+from echo_tree_experiment.Evaluation.echo_tree_eval import Evaluator;
+
+scriptDir = os.path.realpath(os.path.dirname(__file__));
+
+# echo_tree_server.py's ECHO_TREE_GET_PORT, and the path of its EchoTreeService:
+DEFAULT_PORT = 5005;
+SUBSCRIBE_PATH = '/subscribe_to_echo_trees';
+SERVER_SCRIPT = os.path.join(scriptDir, '../echo_tree_server.py');
+
+# One of echo_tree_server.TreeTypes, and test sentences that suit it:
+DEFAULT_TREE_TYPE = 'henryBlog|Bigrams';
+DEFAULT_TOKEN_FILE = os.path.join(scriptDir, '../Resources/Henry/henryBlogFivePercent_Tokens.txt');
+
+DEFAULT_NUM_TYPISTS = 10;
+DEFAULT_NUM_SENTENCES = 5;
+DEFAULT_WPM = 40;
+# Typing speeds count five characters as one word:
+CHARS_PER_WORD = 5;
+# The time a typist takes for a word varies by up to this fraction:
+TYPING_JITTER = 0.5;
+# Seconds between a typist's sentences:
+SENTENCE_PAUSE = 1.0;
+
+# Seconds to wait for outstanding trees after typing ends, and for
+# the trees of the first words:
+DRAIN_TIMEOUT = 10.0;
+# Seconds to wait for a server started with -S to accept connections:
+SERVER_START_TIMEOUT = 30.0;
+
+# Latency percentiles that are reported:
+PERCENTILES = [50, 95, 99];
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11';
+
+class OPCODE:
+    CONTINUATION = 0x0;
+    TEXT         = 0x1;
+    CLOSE        = 0x8;
+    PING         = 0x9;
+    PONG         = 0xA;
+
+def percentile(sortedValues, percent):
+    '''
+    Nearest rank percentile.
+    @param sortedValues: the values, in ascending order.
+    @type sortedValues: [float]
+    @param percent: between 0 and 100
+    @type percent: float
+    @return: the value below which the given percent of the values fall, or None for no values.
+    @rtype: float
+    '''
+    if len(sortedValues) == 0:
+        return None;
+    rank = int(math.ceil(percent / 100.0 * len(sortedValues)));
+    return sortedValues[min(max(rank, 1), len(sortedValues)) - 1];
+
+def readWordSequences(tokenFilePath, numSequences, sentencesPerSequence):
+    '''
+    Split the sentences of a token file, in the evaluator's view, into
+    word sequences that start at different places in the file. Words
+    with non-ASCII characters are dropped, since WordFollower strips
+    those characters.
+    @param tokenFilePath: path of the token file
+    @type tokenFilePath: string
+    @param numSequences: number of word sequences
+    @type numSequences: int
+    @param sentencesPerSequence: number of sentences in each sequence
+    @type sentencesPerSequence: int
+    @return: for each sequence, its sentences, each a list of words.
+    @rtype: [[[string]]]
+    '''
+    sentences = [];
+    for sentence in Evaluator.readSentences(tokenFilePath):
+        words = [word for word in sentence.split(',') if len(word) > 0 and all(0 < ord(char) < 127 for char in word)];
+        if len(words) > 0:
+            sentences.append(words);
+    if len(sentences) == 0:
+        raise ValueError("Token file %s holds no sentences." % tokenFilePath);
+    # Spread the typists' starting points over the file:
+    stride = max(1, len(sentences) // numSequences);
+    return [[sentences[(seqNum * stride + sentenceNum) % len(sentences)] for sentenceNum in range(sentencesPerSequence)]
+            for seqNum in range(numSequences)];
+
+# ------------------------------- class WebSocketClient ---------------------
+
+class WebSocketClient(object):
+    '''
+    Client end of a WebSocket connection (RFC 6455), text messages only.
+    The handshake blocks; afterwards, receive() is to be called when
+    select() finds the connection readable.
+    '''
+
+    def __init__(self, host, port, path, timeout=DRAIN_TIMEOUT):
+        '''
+        Connect, and perform the opening handshake.
+        @param host: server host
+        @type host: string
+        @param port: server port
+        @type port: int
+        @param path: path of the WebSocket service, e.g. '/subscribe_to_echo_trees'
+        @type path: string
+        @param timeout: seconds to wait for the connection and the handshake.
+        @type timeout: float
+        @raise IOError: if the connection or the handshake fails.
+        '''
+        self.sock = socket.create_connection((host, port), timeout);
+        key = base64.b64encode(os.urandom(16));
+        self.sock.sendall('GET %s HTTP/1.1\r\n'
+                          'Host: %s:%d\r\n'
+                          'Upgrade: websocket\r\n'
+                          'Connection: Upgrade\r\n'
+                          'Sec-WebSocket-Key: %s\r\n'
+                          'Sec-WebSocket-Version: 13\r\n\r\n' % (path, host, port, key));
+        response = '';
+        while '\r\n\r\n' not in response:
+            data = self.sock.recv(4096);
+            if len(data) == 0:
+                raise IOError("Server at %s:%d closed the connection during the WebSocket handshake." % (host, port));
+            response += data;
+        (headers, self.buffer) = response.split('\r\n\r\n', 1);
+        expectedAccept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest());
+        if not headers.startswith('HTTP/1.1 101') or expectedAccept not in headers:
+            raise IOError("Server at %s:%d refused the WebSocket handshake: %s" % (host, port, headers.split('\r\n')[0]));
+        self.sock.setblocking(False);
+        self.fragments = [];
+        self.closed = False;
+
+    def fileno(self):
+        return self.sock.fileno();
+
+    def sendText(self, text):
+        '''
+        Send one text message.
+        @param text: the message
+        @type text: string
+        '''
+        self.sendFrame(OPCODE.TEXT, text);
+
+    def sendFrame(self, opcode, payload):
+        # Clients must mask their frames:
+        header = chr(0x80 | opcode);
+        if len(payload) < 126:
+            header += chr(0x80 | len(payload));
+        elif len(payload) < (1 << 16):
+            header += chr(0x80 | 126) + struct.pack('!H', len(payload));
+        else:
+            header += chr(0x80 | 127) + struct.pack('!Q', len(payload));
+        mask = os.urandom(4);
+        maskBytes = [ord(char) for char in mask];
+        masked = ''.join([chr(ord(char) ^ maskBytes[i % 4]) for (i, char) in enumerate(payload)]);
+        self.sock.setblocking(True);
+        try:
+            self.sock.sendall(header + mask + masked);
+        finally:
+            self.sock.setblocking(False);
+
+    def receive(self):
+        '''
+        Read what the server sent.
+        @return: the complete text messages that arrived, in order.
+        @rtype: [string]
+        @raise IOError: if the server closed the connection.
+        '''
+        try:
+            data = self.sock.recv(65536);
+        except socket.error:
+            data = '';
+        if len(data) == 0:
+            self.closed = True;
+            raise IOError("Server closed the connection.");
+        self.buffer += data;
+        messages = [];
+        while True:
+            frame = self.parseFrame();
+            if frame is None:
+                return messages;
+            (isFinal, opcode, payload) = frame;
+            if opcode == OPCODE.CLOSE:
+                self.closed = True;
+                raise IOError("Server closed the connection.");
+            elif opcode == OPCODE.PING:
+                self.sendFrame(OPCODE.PONG, payload);
+            elif opcode in (OPCODE.TEXT, OPCODE.CONTINUATION):
+                self.fragments.append(payload);
+                if isFinal:
+                    messages.append(''.join(self.fragments));
+                    self.fragments = [];
+
+    def parseFrame(self):
+        '''
+        Take the first complete frame off the receive buffer.
+        @return: (final fragment, opcode, payload), or None if no frame is complete yet.
+        @rtype: (boolean, int, string)
+        '''
+        if len(self.buffer) < 2:
+            return None;
+        (byte0, byte1) = (ord(self.buffer[0]), ord(self.buffer[1]));
+        payloadLen = byte1 & 0x7F;
+        pos = 2;
+        if payloadLen == 126:
+            if len(self.buffer) < 4:
+                return None;
+            payloadLen = struct.unpack('!H', self.buffer[2:4])[0];
+            pos = 4;
+        elif payloadLen == 127:
+            if len(self.buffer) < 10:
+                return None;
+            payloadLen = struct.unpack('!Q', self.buffer[2:10])[0];
+            pos = 10;
+        # Servers do not mask their frames:
+        if len(self.buffer) < pos + payloadLen:
+            return None;
+        payload = self.buffer[pos:pos + payloadLen];
+        self.buffer = self.buffer[pos + payloadLen:];
+        return (bool(byte0 & 0x80), byte0 & 0x0F, payload);
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.sendFrame(OPCODE.CLOSE, '');
+            except socket.error:
+                pass;
+            self.closed = True;
+        self.sock.close();
+
+# ------------------------------- class SimulatedTypist ---------------------
+
+class SimulatedTypist(object):
+    '''
+    One person typing sentences over one WebSocket connection.
+    '''
+
+    def __init__(self, name, client, sentences, treeType, secsPerChar, rng):
+        '''
+        @param name: submitter ID
+        @type name: string
+        @param client: open connection to the server
+        @type client: WebSocketClient
+        @param sentences: sentences to type, each a list of words.
+        @type sentences: [[string]]
+        @param treeType: one of echo_tree_server.TreeTypes
+        @type treeType: string
+        @param secsPerChar: average seconds to type one character
+        @type secsPerChar: float
+        @param rng: random number generator for the typing times.
+        @type rng: random.Random
+        '''
+        self.name = name;
+        self.client = client;
+        self.treeType = treeType;
+        self.secsPerChar = secsPerChar;
+        self.rng = rng;
+        # (word, pause after the word) for each word to type:
+        self.words = deque();
+        for sentence in sentences:
+            for wordNum, word in enumerate(sentence):
+                self.words.append((word, SENTENCE_PAUSE if wordNum == len(sentence) - 1 else 0.0));
+        self.nextSendTime = None;
+        # (word, send time) of each word whose tree has not arrived:
+        self.pending = deque();
+        self.latencies = [];
+        self.numSubmitted = 0;
+        self.numSuperseded = 0;
+        self.numSubscriptionTrees = 0;
+
+    def typingTime(self, word):
+        '''
+        @return: seconds this typist takes to type the given word and a space.
+        @rtype: float
+        '''
+        return (len(word) + 1) * self.secsPerChar * self.rng.uniform(1.0 - TYPING_JITTER, 1.0 + TYPING_JITTER);
+
+    def submit(self, word, now):
+        self.client.sendText(json.dumps({'command' : 'newRootWord', 'submitter' : self.name,
+                                         'word' : word, 'treeType' : self.treeType}));
+        self.pending.append((word, now));
+        self.numSubmitted += 1;
+
+    def subscribe(self, treeCreator):
+        self.client.sendText(json.dumps({'command' : 'subscribe', 'submitter' : self.name,
+                                         'treeCreator' : treeCreator, 'treeType' : self.treeType}));
+
+    def startTyping(self, now):
+        '''
+        Start the clock for the first word.
+        '''
+        if len(self.words) > 0:
+            self.nextSendTime = now + self.typingTime(self.words[0][0]);
+
+    def isTyping(self):
+        return self.nextSendTime is not None;
+
+    def typeNextWord(self, now):
+        '''
+        Submit the word that was just finished, and start the clock for the next.
+        '''
+        (word, pause) = self.words.popleft();
+        self.submit(word, now);
+        if len(self.words) > 0:
+            self.nextSendTime = now + pause + self.typingTime(self.words[0][0]);
+        else:
+            self.nextSendTime = None;
+
+    def receiveTrees(self, now):
+        '''
+        Read the trees that arrived, and match them with outstanding words.
+        @return: number of trees that arrived
+        @rtype: int
+        @raise IOError: if the server closed the connection.
+        '''
+        messages = self.client.receive();
+        for message in messages:
+            try:
+                rootWord = json.loads(message)['word'];
+            except (ValueError, KeyError, TypeError):
+                self.numSubscriptionTrees += 1;
+                continue;
+            for (pos, (word, sendTime)) in enumerate(self.pending):
+                if word == rootWord:
+                    self.latencies.append(now - sendTime);
+                    # Earlier words were overtaken by this one:
+                    self.numSuperseded += pos;
+                    for i in range(pos + 1):
+                        self.pending.popleft();
+                    break;
+            else:
+                self.numSubscriptionTrees += 1;
+        return len(messages);
+
+# ------------------------------- class TypingSimulation ---------------------
+
+class TypingSimulation(object):
+    '''
+    Runs simulated typists against an EchoTree server, and collects
+    their measurements.
+    '''
+
+    def __init__(self, host, port, numTypists=DEFAULT_NUM_TYPISTS, numSentences=DEFAULT_NUM_SENTENCES,
+                 wpm=DEFAULT_WPM, numSubscriptions=0, treeType=DEFAULT_TREE_TYPE,
+                 tokenFilePath=DEFAULT_TOKEN_FILE, seed=None, progressLogger=None):
+        '''
+        @param host: server host
+        @type host: string
+        @param port: port of the server's EchoTreeService
+        @type port: int
+        @param numTypists: number of simulated typists, each with its own connection.
+        @type numTypists: int
+        @param numSentences: sentences each typist types.
+        @type numSentences: int
+        @param wpm: average typing speed in words per minute.
+        @type wpm: float
+        @param numSubscriptions: number of other typists to whose trees each typist subscribes.
+        @type numSubscriptions: int
+        @param treeType: one of echo_tree_server.TreeTypes
+        @type treeType: string
+        @param tokenFilePath: token file from which the sentences are taken.
+        @type tokenFilePath: string
+        @param seed: if provided, seed for the typing times.
+        @type seed: int
+        @param progressLogger: if provided, called with progress messages.
+        @type progressLogger: callable
+        '''
+        if numTypists < 1 or numSentences < 1 or wpm <= 0:
+            raise ValueError("Need at least one typist and one sentence, and a positive typing speed.");
+        if not 0 <= numSubscriptions < numTypists:
+            raise ValueError("Typists can subscribe to the trees of at most the %d others; got %d." % (numTypists - 1, numSubscriptions));
+        self.host = host;
+        self.port = port;
+        self.numTypists = numTypists;
+        self.numSentences = numSentences;
+        self.wpm = wpm;
+        self.numSubscriptions = numSubscriptions;
+        self.treeType = treeType;
+        self.tokenFilePath = tokenFilePath;
+        self.rng = random.Random(seed);
+        self.log = progressLogger if progressLogger is not None else lambda msg: None;
+        self.typists = [];
+
+    def run(self):
+        '''
+        Connect the typists, run the three phases, and disconnect.
+        @return: the measurements; see getResults().
+        @rtype: {string : <any>}
+        @raise IOError: if a typist cannot connect.
+        '''
+        sentenceSeqs = readWordSequences(self.tokenFilePath, self.numTypists, self.numSentences);
+        secsPerChar = 60.0 / (self.wpm * CHARS_PER_WORD);
+        namePrefix = 'typist%d_' % os.getpid();
+        try:
+            for typistNum in range(self.numTypists):
+                client = WebSocketClient(self.host, self.port, SUBSCRIBE_PATH);
+                self.typists.append(SimulatedTypist(namePrefix + str(typistNum), client, sentenceSeqs[typistNum],
+                                                    self.treeType, secsPerChar, random.Random(self.rng.random())));
+            self.log("Connected %d typists." % self.numTypists);
+
+            # Phase 1: make each typist known to the server:
+            for typist in self.typists:
+                (word, pause) = typist.words.popleft();
+                typist.submit(word, time.time());
+            self.waitForTrees();
+            numUnanswered = sum([len(typist.pending) for typist in self.typists]);
+            if numUnanswered > 0:
+                raise IOError("Server did not answer the first words of %d typists within %.0f sec." % (numUnanswered, DRAIN_TIMEOUT));
+            for typist in self.typists:
+                typist.latencies = [];
+                typist.numSubmitted = 0;
+                typist.numSuperseded = 0;
+
+            # Phase 2:
+            for (typistNum, typist) in enumerate(self.typists):
+                for offset in range(1, self.numSubscriptions + 1):
+                    typist.subscribe(self.typists[(typistNum + offset) % self.numTypists].name);
+            if self.numSubscriptions > 0:
+                self.log("Each typist subscribed to the trees of %d others." % self.numSubscriptions);
+
+            # Phase 3:
+            startTime = time.time();
+            for typist in self.typists:
+                typist.numSubscriptionTrees = 0;
+                typist.startTyping(startTime);
+            self.type();
+            typingEndTime = time.time();
+            self.waitForTrees();
+            self.elapsed = typingEndTime - startTime;
+            self.drainTime = time.time() - typingEndTime;
+        finally:
+            for typist in self.typists:
+                typist.client.close();
+        return self.getResults();
+
+    def type(self):
+        '''
+        Submit each typist's words on time, and receive trees in between,
+        until all typists are done.
+        '''
+        typists = [typist for typist in self.typists if typist.isTyping()];
+        while len(typists) > 0:
+            now = time.time();
+            for typist in typists:
+                while typist.isTyping() and typist.nextSendTime <= now:
+                    typist.typeNextWord(now);
+            typists = [typist for typist in typists if typist.isTyping()];
+            if len(typists) == 0:
+                return;
+            timeout = max(0.0, min([typist.nextSendTime for typist in typists]) - time.time());
+            self.receive(timeout);
+
+    def waitForTrees(self):
+        '''
+        Receive trees until none are outstanding, for at most DRAIN_TIMEOUT seconds.
+        '''
+        deadline = time.time() + DRAIN_TIMEOUT;
+        while any([len(typist.pending) > 0 for typist in self.typists]):
+            timeout = deadline - time.time();
+            if timeout <= 0:
+                return;
+            self.receive(timeout);
+
+    def receive(self, timeout):
+        '''
+        Wait up to timeout seconds for trees, and hand them to their typists.
+        @raise IOError: if the server closed a connection.
+        '''
+        typistsByConnection = dict((typist.client.fileno(), typist) for typist in self.typists);
+        (readable, writable, failed) = select.select(typistsByConnection.keys(), [], [], timeout);
+        now = time.time();
+        for fileno in readable:
+            typistsByConnection[fileno].receiveTrees(now);
+
+    def getResults(self):
+        '''
+        @return: settings and measurements of the run: counts, throughput
+                 in trees per second, and latencies in milliseconds.
+        @rtype: {string : <any>}
+        '''
+        latencies = sorted([latency for typist in self.typists for latency in typist.latencies]);
+        numTrees = len(latencies);
+        numSubmitted = sum([typist.numSubmitted for typist in self.typists]);
+        results = {'numTypists'        : self.numTypists,
+                   'numSentences'      : self.numSentences,
+                   'wpm'               : self.wpm,
+                   'numSubscriptions'  : self.numSubscriptions,
+                   'treeType'          : self.treeType,
+                   'elapsedSecs'       : self.elapsed,
+                   'drainSecs'         : self.drainTime,
+                   'wordsSubmitted'    : numSubmitted,
+                   'treesReceived'     : numTrees,
+                   'superseded'        : sum([typist.numSuperseded for typist in self.typists]),
+                   'lost'              : sum([len(typist.pending) for typist in self.typists]),
+                   'subscriptionTrees' : sum([typist.numSubscriptionTrees for typist in self.typists]),
+                   'wordsPerSec'       : numSubmitted / self.elapsed if self.elapsed > 0 else 0.0,
+                   'treesPerSec'       : numTrees / (self.elapsed + self.drainTime) if self.elapsed + self.drainTime > 0 else 0.0,
+                   'meanLatencyMs'     : 1000.0 * sum(latencies) / numTrees if numTrees > 0 else None,
+                   'maxLatencyMs'      : 1000.0 * latencies[-1] if numTrees > 0 else None,
+                   };
+        for percent in PERCENTILES:
+            value = percentile(latencies, percent);
+            results['p%dLatencyMs' % percent] = 1000.0 * value if value is not None else None;
+        return results;
+
+def formatResults(results):
+    '''
+    @return: the results of TypingSimulation.run(), as lines of text.
+    @rtype: string
+    '''
+    def ms(value):
+        return 'n/a' if value is None else '%.1f ms' % value;
+    lines = ["%d typists, %d sentences each, at %s wpm; %d subscriptions per typist; tree type %s." %
+                 (results['numTypists'], results['numSentences'], results['wpm'], results['numSubscriptions'], results['treeType']),
+             "Typed for %.1f sec, then waited %.1f sec for outstanding trees." % (results['elapsedSecs'], results['drainSecs']),
+             "Words submitted: %d (%.1f/sec). Trees received: %d (%.1f/sec). Superseded: %d. Lost: %d. Subscription trees: %d." %
+                 (results['wordsSubmitted'], results['wordsPerSec'], results['treesReceived'], results['treesPerSec'],
+                  results['superseded'], results['lost'], results['subscriptionTrees']),
+             "Submit-to-tree latency: mean %s, %s, max %s." %
+                 (ms(results['meanLatencyMs']),
+                  ', '.join(['p%d %s' % (percent, ms(results['p%dLatencyMs' % percent])) for percent in PERCENTILES]),
+                  ms(results['maxLatencyMs']))];
+    return '\n'.join(lines);
+
+def startServer(port):
+    '''
+    Start echo_tree_server.py, and wait until it accepts connections.
+    @param port: the port the server listens on
+    @type port: int
+    @return: the server process
+    @rtype: subprocess.Popen
+    @raise IOError: if the server does not come up within SERVER_START_TIMEOUT seconds.
+    '''
+    with open(os.devnull, 'w') as devNull:
+        server = subprocess.Popen([sys.executable, os.path.basename(SERVER_SCRIPT)], cwd=os.path.dirname(SERVER_SCRIPT),
+                                  stdout=devNull, stderr=devNull);
+    deadline = time.time() + SERVER_START_TIMEOUT;
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise IOError("EchoTree server exited with status %d during startup." % server.returncode);
+        try:
+            socket.create_connection(('localhost', port), 1.0).close();
+            return server;
+        except socket.error:
+            time.sleep(0.2);
+    stopServer(server);
+    raise IOError("EchoTree server did not accept connections within %.0f sec." % SERVER_START_TIMEOUT);
+
+def stopServer(server):
+    '''
+    Stop a server started by startServer(). It shuts down on SIGINT.
+    '''
+    if server.poll() is None:
+        server.send_signal(signal.SIGINT);
+        deadline = time.time() + 5.0;
+        while server.poll() is None and time.time() < deadline:
+            time.sleep(0.1);
+        if server.poll() is None:
+            server.kill();
+            server.wait();
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog='typing_simulation');
+    parser.add_argument("-S", "--startServer", action='store_true', dest='startServer',
+                        help="start echo_tree_server.py for the test, and stop it afterwards.");
+    parser.add_argument("--host", default='localhost', help="EchoTree server host. Default: localhost.");
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="EchoTree server port. Default: %d." % DEFAULT_PORT);
+    parser.add_argument("-c", "--typists", type=int, dest='numTypists', default=DEFAULT_NUM_TYPISTS,
+                        help="number of simulated typists, each with its own connection. Default: %d." % DEFAULT_NUM_TYPISTS);
+    parser.add_argument("-n", "--sentences", type=int, dest='numSentences', default=DEFAULT_NUM_SENTENCES,
+                        help="sentences each typist types. Default: %d." % DEFAULT_NUM_SENTENCES);
+    parser.add_argument("-w", "--wpm", type=float, default=DEFAULT_WPM,
+                        help="average typing speed in words per minute. Default: %d." % DEFAULT_WPM);
+    parser.add_argument("-k", "--subscriptions", type=int, dest='numSubscriptions', default=0,
+                        help="number of other typists to whose trees each typist subscribes. Default: 0.");
+    parser.add_argument("-t", "--treeType", default=DEFAULT_TREE_TYPE,
+                        help="tree type to request. Default: %s." % DEFAULT_TREE_TYPE);
+    parser.add_argument("-f", "--tokenFile", dest='tokenFilePath', default=DEFAULT_TOKEN_FILE,
+                        help="token file from which sentences are taken. Default: %s." % os.path.relpath(DEFAULT_TOKEN_FILE));
+    parser.add_argument("--seed", type=int, help="seed for the typing times.");
+    parser.add_argument("-j", "--json", dest='jsonPath', help="also write the results to this JSON file.");
+    parser.add_argument("--maxP95", type=float, help="fail if the 95th latency percentile exceeds this many ms.");
+    parser.add_argument("--maxP99", type=float, help="fail if the 99th latency percentile exceeds this many ms.");
+    args = parser.parse_args();
+
+    def printMsg(msg):
+        print msg;
+
+    server = None;
+    try:
+        if args.startServer:
+            server = startServer(args.port);
+            printMsg("Started EchoTree server.");
+        simulation = TypingSimulation(args.host, args.port, numTypists=args.numTypists, numSentences=args.numSentences,
+                                      wpm=args.wpm, numSubscriptions=args.numSubscriptions, treeType=args.treeType,
+                                      tokenFilePath=args.tokenFilePath, seed=args.seed, progressLogger=printMsg);
+        results = simulation.run();
+    except (ValueError, IOError, socket.error) as e:
+        print("Error: %s" % e);
+        sys.exit(1);
+    finally:
+        if server is not None:
+            stopServer(server);
+    print(formatResults(results));
+    if args.jsonPath is not None:
+        with open(args.jsonPath, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True);
+
+    failures = [];
+    if results['lost'] > 0:
+        failures.append("%d trees were lost." % results['lost']);
+    for (percent, maxLatency) in ((95, args.maxP95), (99, args.maxP99)):
+        latency = results['p%dLatencyMs' % percent];
+        if maxLatency is not None and (latency is None or latency > maxLatency):
+            failures.append("p%d latency %s exceeds %.1f ms." % (percent, 'n/a' if latency is None else '%.1f ms' % latency, maxLatency));
+    if len(failures) > 0:
+        print("FAILED: " + ' '.join(failures));
+        sys.exit(1);
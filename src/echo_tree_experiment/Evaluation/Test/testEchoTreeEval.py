@@ -1,11 +1,31 @@
 import unittest;
 import os;
+import shutil;
+import tempfile;
 
+from echo_tree_experiment.Evaluation import echo_tree_eval;
 from echo_tree_experiment.Evaluation.echo_tree_eval import Evaluator;
+from echo_tree_experiment.Evaluation.echo_tree_eval import ResultCheckpointer;
 from echo_tree_experiment.Evaluation.echo_tree_eval import Verbosity;
 from unittest.case import skip, SkipTest
 
 
+class Interruption(Exception):
+    pass;
+
+# Sentence whose measurement is interrupted by interruptingTallyWordCapture();
+# it is inside a worker batch, and after the second checkpoint:
+INTERRUPTED_SENTENCE_ID = 26;
+
+originalTallyWordCapture = Evaluator.tallyWordCapture;
+
+def interruptingTallyWordCapture(self, tokenArray, emailID=-1, sentenceID=None, removeStopwords=False):
+    # Also runs in worker processes, so it must not depend on state of the test:
+    if sentenceID == INTERRUPTED_SENTENCE_ID:
+        raise Interruption("Interrupted at sentence %d." % sentenceID);
+    return originalTallyWordCapture(self, tokenArray, emailID=emailID, sentenceID=sentenceID, removeStopwords=removeStopwords);
+
+
 class TestEchoTreeEval(unittest.TestCase):
 
     def setUp(self):
@@ -58,6 +78,56 @@ class TestEchoTreeEval(unittest.TestCase):
             self.assertEquals('10639,1,15,8,0,18.8888888889,5,1,0.392857142857\n',
                               spreadsheet[2]);
         
+    def test_resumeAfterInterruption(self):
+        tokenFile = os.path.join(os.path.dirname(self.dbFileName), "Henry/henryBlogFivePercent_Tokens.txt");
+        tmpDir = tempfile.mkdtemp();
+        (checkpointRate, workerBatchSize) = (echo_tree_eval.CHECKPOINT_RATE, echo_tree_eval.WORKER_BATCH_SIZE);
+        originalCheckpoint = ResultCheckpointer.checkpoint;
+        try:
+            # Checkpoints every few batches of the 60 sentences:
+            echo_tree_eval.CHECKPOINT_RATE = 10;
+            echo_tree_eval.WORKER_BATCH_SIZE = 4;
+            referencePath = os.path.join(tmpDir, "reference.csv");
+            referenceScore = Evaluator(self.dbFileName).measurePerformance(referencePath, self.dbFileName, 2, [tokenFile]);
+            with open(referencePath) as fd:
+                referenceCSV = fd.read();
+                
+            def interruptAtSecondCheckpoint(checkpointer, *args):
+                originalCheckpoint(checkpointer, *args);
+                if checkpointer.numSentences >= 2 * echo_tree_eval.CHECKPOINT_RATE:
+                    raise Interruption("Interrupted after checkpoint of sentence %d." % checkpointer.numSentences);
+            interruptions = {'checkpoint' : (ResultCheckpointer, 'checkpoint', interruptAtSecondCheckpoint),
+                             'midBatch'   : (Evaluator, 'tallyWordCapture', interruptingTallyWordCapture)};
+            
+            for (interruptionName, (patchedClass, methodName, interruptingMethod)) in interruptions.items():
+                for interruptedWorkers in [None, 2]:
+                    for resumingWorkers in [None, 2]:
+                        csvPath = os.path.join(tmpDir, "%s_%s_%s.csv" % (interruptionName, interruptedWorkers, resumingWorkers));
+                        originalMethod = patchedClass.__dict__[methodName];
+                        setattr(patchedClass, methodName, interruptingMethod);
+                        try:
+                            self.assertRaises(Interruption, Evaluator(self.dbFileName).measurePerformance,
+                                              csvPath, self.dbFileName, 2, [tokenFile], numWorkers=interruptedWorkers, resumable=True);
+                        finally:
+                            setattr(patchedClass, methodName, originalMethod);
+                        self.assertTrue(os.path.exists(csvPath + '.checkpoint'));
+                        self.assertFalse(os.path.exists(csvPath));
+                        # As if the crash came while rows after the checkpoint were
+                        # written; more of them than the resumed run writes:
+                        with open(csvPath + '.partial', 'a') as fd:
+                            fd.write('10639,99,1,0,0,0.0,1,1.0\n' * 1000 + '10639,99,1,0');
+                        score = Evaluator(self.dbFileName).measurePerformance(csvPath, self.dbFileName, 2, [tokenFile],
+                                                                             numWorkers=resumingWorkers, resumable=True);
+                        case = "Interrupted at %s with %s workers, resumed with %s workers." % (interruptionName, interruptedWorkers, resumingWorkers);
+                        self.assertEqual(referenceScore, score, case);
+                        with open(csvPath) as fd:
+                            self.assertEqual(referenceCSV, fd.read(), case);
+                        self.assertFalse(os.path.exists(csvPath + '.partial'));
+                        self.assertFalse(os.path.exists(csvPath + '.checkpoint'));
+        finally:
+            (echo_tree_eval.CHECKPOINT_RATE, echo_tree_eval.WORKER_BATCH_SIZE) = (checkpointRate, workerBatchSize);
+            shutil.rmtree(tmpDir);
+        
 if __name__ == '__main__':
     unittest.main()
         
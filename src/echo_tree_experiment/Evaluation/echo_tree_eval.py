@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
+import os;
 import json;
-import copy;
+import multiprocessing;
+from array import array;
 from collections import deque;
 from collections import OrderedDict;
 import argparse;
@@ -9,11 +11,26 @@ import argparse;
 from echo_tree_experiment.echo_tree import WORD_TREE_BREADTH;
 from echo_tree_experiment.echo_tree import WORD_TREE_DEPTH;
 from echo_tree_experiment.echo_tree import WordExplorer;
-from echo_tree_experiment.echo_tree import STOPWORDS;
+from echo_tree_experiment.echo_tree import TokenCleaner;
+from echo_tree_experiment.token_corpus import iterBracketedSentences, iterBracketedSentencePositions;
+from echo_tree_experiment.binary_corpus import BinaryCorpusWriter, BinaryCorpus, EVALUATOR_VIEW;
 
 # Report progress every x sentences:
 PROGRESS_RATE = 100;
 
+# Sentences handed to a worker process at a time, when measuring in parallel:
+WORKER_BATCH_SIZE = 50;
+
+# Default maximum number of tree indexes an Evaluator keeps around:
+TREE_MEMO_SIZE = 20000;
+
+# Resumable runs write results and a checkpoint after this many sentences:
+CHECKPOINT_RATE = 1000;
+
+# Cleaners of test sentences, without and with stopword removal:
+TOKEN_CLEANERS = {False : TokenCleaner(removeStopwords=False),
+                  True  : TokenCleaner(removeStopwords=True)};
+
 # All of string.punctuation, except for comma, which is
 # the Stanford NLP token separator:
 PUNCTUATION = '!"#$%&\'()*+-./:;<=>?@[\\]^_`{|}~'
@@ -48,6 +65,8 @@ class SentencePerformance(object):
         self.failures    = 0;
         self.outOfSeqs   = 0;
         self.depths      = {};
+        # Depth of the trees the sentence is measured with:
+        self.maxDepth    = evaluator.maxDepth;
     
     def addFailure(self):
         '''
@@ -137,7 +156,7 @@ class SentencePerformance(object):
         if self.sentenceLen <= 1:
             return res;
         #maxDepth = self.evaluator.getMaxDepthAllSentences();
-        for depth in range(1, WORD_TREE_DEPTH):
+        for depth in range(1, self.maxDepth):
             res += 0.5**(depth-1) * self.getDepthCount(depth);
 
         # Subtract 1 from sentence len, b/c the last word had
@@ -201,41 +220,373 @@ class SentencePerformance(object):
         return row;
         
 
+class PerformanceTally(object):
+    '''
+    Measurement results of all sentences, kept column by column rather
+    than as SentencePerformance instances. Adding a sentence appends a
+    few numbers; the deepest depth is known at all times; and the CSV
+    rows are produced one at a time. So memory use and reporting stay
+    linear in the number of sentences. Columns:
+    
+       - emailIDs, sentenceIDs: as given to tallyWordCapture(); of any type.
+       - sentenceLens, failures, outOfSeqs: as in SentencePerformance.
+       - typingSavings: each sentence's getPercentTypeSavings().
+       - depthWeightedScores: each sentence's getDepthWeightedSuccessSentence().
+       - depthCounts: one column per depth, starting at depth 1: how many 
+                      of the sentence's words were found at that depth.
+    '''
+    
+    def __init__(self):
+        self.emailIDs            = [];
+        self.sentenceIDs         = [];
+        self.sentenceLens        = array('l');
+        self.failures            = array('l');
+        self.outOfSeqs           = array('l');
+        self.typingSavings       = array('d');
+        self.depthWeightedScores = array('d');
+        self.depthCounts         = [];
+        
+    def __len__(self):
+        return len(self.sentenceIDs);
+    
+    def getMaxDepth(self):
+        '''
+        @return: the deepest depth at which a word of any sentence was found.
+        @rtype: int
+        '''
+        return len(self.depthCounts);
+    
+    def addDepthColumns(self, maxDepth):
+        # Sentences tallied before a depth first occurred had no words there:
+        while len(self.depthCounts) < maxDepth:
+            self.depthCounts.append(array('l', [0]) * len(self));
+    
+    def add(self, sentencePerf):
+        '''
+        Append the results of one sentence.
+        @param sentencePerf: the sentence's measurements
+        @type sentencePerf: SentencePerformance
+        '''
+        self.addDepthColumns(sentencePerf.getDeepestDepth());
+        for (depthIndex, depthColumn) in enumerate(self.depthCounts):
+            depthColumn.append(sentencePerf.getDepthCount(depthIndex + 1));
+        self.emailIDs.append(sentencePerf.emailID);
+        self.sentenceIDs.append(sentencePerf.sentenceID);
+        self.sentenceLens.append(sentencePerf.sentenceLen);
+        self.failures.append(sentencePerf.failures);
+        self.outOfSeqs.append(sentencePerf.outOfSeqs);
+        self.typingSavings.append(sentencePerf.getPercentTypeSavings());
+        self.depthWeightedScores.append(sentencePerf.getDepthWeightedSuccessSentence());
+        
+    def extend(self, otherTally):
+        '''
+        Append the results of all sentences in another tally.
+        @param otherTally: results to append
+        @type otherTally: PerformanceTally
+        '''
+        self.addDepthColumns(otherTally.getMaxDepth());
+        for (depthIndex, depthColumn) in enumerate(self.depthCounts):
+            if depthIndex < otherTally.getMaxDepth():
+                depthColumn.extend(otherTally.depthCounts[depthIndex]);
+            else:
+                depthColumn.extend(array('l', [0]) * len(otherTally));
+        self.emailIDs.extend(otherTally.emailIDs);
+        self.sentenceIDs.extend(otherTally.sentenceIDs);
+        self.sentenceLens.extend(otherTally.sentenceLens);
+        self.failures.extend(otherTally.failures);
+        self.outOfSeqs.extend(otherTally.outOfSeqs);
+        self.typingSavings.extend(otherTally.typingSavings);
+        self.depthWeightedScores.extend(otherTally.depthWeightedScores);
+        
+    def getMeanDepthWeightedScore(self):
+        '''
+        @return: average of the depth-weighted scores of all sentences.
+        @rtype: float
+        @raise ZeroDivisionError: if no sentences were tallied.
+        '''
+        return sum(self.depthWeightedScores) / len(self);
+    
+    def iterCSVRows(self):
+        '''
+        Iterate over the CSV rows, one per sentence, in the columns of
+        Evaluator.getCSVHeader(). Same as SentencePerformance.toCSV().
+        @return: iterator over rows, without line ends.
+        @rtype: iterator
+        '''
+        for sentenceIndex in xrange(len(self)):
+            row = [str(self.emailIDs[sentenceIndex]),
+                   str(self.sentenceIDs[sentenceIndex]),
+                   str(self.sentenceLens[sentenceIndex]),
+                   str(self.failures[sentenceIndex]),
+                   str(self.outOfSeqs[sentenceIndex]),
+                   str(self.typingSavings[sentenceIndex])];
+            for depthColumn in self.depthCounts:
+                row.append(str(depthColumn[sentenceIndex]));
+            row.append(str(self.depthWeightedScores[sentenceIndex]));
+            yield ','.join(row);
+
+class ResultCheckpointer(object):
+    '''
+    Streams the results of a resumable measurePerformance() run to disk.
+    Next to the CSV file, it keeps two files:
+    
+       <csvFile>.partial     CSV rows of the sentences measured so far, without
+                             header. Rows have only as many depth columns as 
+                             their chunk of sentences needed; finish() pads them.
+       <csvFile>.checkpoint  JSON: the run's settings; the file index, byte offset, 
+                             and sentence ID of the last sentence whose results are
+                             in the partial file; the partial file's length up to
+                             there; and running totals.
+    
+    Results are written in chunks of CHECKPOINT_RATE sentences, after which
+    the tally is emptied, so memory use does not grow with the corpus. If
+    the checkpoint file exists when a run starts, the run continues after
+    its sentence; rows written after the checkpoint are dropped. finish()
+    turns the partial file into the CSV file, and removes both files.
+    '''
+    
+    def __init__(self, csvFilePath, runSettings):
+        '''
+        @param csvFilePath: path of the run's CSV file
+        @type csvFilePath: string
+        @param runSettings: everything that determines the results. A checkpoint
+                            is only resumed by a run with the same settings.
+        @type runSettings: {string : <JSON serializable>}
+        @raise ValueError: if a checkpoint of a run with other settings exists.
+        '''
+        self.csvFilePath = csvFilePath;
+        self.partialPath = csvFilePath + '.partial';
+        self.checkpointPath = csvFilePath + '.checkpoint';
+        # Compare settings the way they come back from JSON:
+        self.runSettings = json.loads(json.dumps(runSettings));
+        # (file index, byte offset, sentence ID) of the last sentence written:
+        self.resumePoint = None;
+        self.numSentences = 0;
+        self.sumScores = 0.0;
+        self.maxDepth = 0;
+        self.allWordsLen = 0;
+        self.numCharsSaved = 0;
+        partialBytes = 0;
+        if os.path.exists(self.checkpointPath) and os.path.exists(self.partialPath):
+            with open(self.checkpointPath) as fd:
+                checkpoint = json.load(fd);
+            if checkpoint['runSettings'] != self.runSettings:
+                raise ValueError("Checkpoint %s is of a run with other settings. Remove it to start over." % self.checkpointPath);
+            self.resumePoint = (checkpoint['fileIndex'], checkpoint['offset'], checkpoint['sentenceID']);
+            self.numSentences = checkpoint['numSentences'];
+            self.sumScores = checkpoint['sumScores'];
+            self.maxDepth = checkpoint['maxDepth'];
+            self.allWordsLen = checkpoint['allWordsLen'];
+            self.numCharsSaved = checkpoint['numCharsSaved'];
+            partialBytes = checkpoint['partialBytes'];
+        self.partialFD = open(self.partialPath, 'r+b' if partialBytes > 0 else 'wb');
+        self.partialFD.truncate(partialBytes);
+        self.partialFD.seek(partialBytes);
+        
+    def writeRows(self, tally):
+        for row in tally.iterCSVRows():
+            self.partialFD.write(row + '\n');
+        self.numSentences += len(tally);
+        # Sentence by sentence, so that the sum is the one a run in one go gets:
+        for score in tally.depthWeightedScores:
+            self.sumScores += score;
+        self.maxDepth = max(self.maxDepth, tally.getMaxDepth());
+    
+    def checkpoint(self, tally, position, sentenceID, allWordsLen, numCharsSaved):
+        '''
+        Append the tallied results to the partial file, and record a checkpoint.
+        @param tally: results of all sentences since the previous checkpoint, up to 
+                      and including the given sentence.
+        @type tally: PerformanceTally
+        @param position: the sentence's position, as given by Evaluator.testSentences()
+        @type position: (int, int)
+        @param sentenceID: the sentence's ID within its file
+        @type sentenceID: int
+        @param allWordsLen: length of all words in all sentences so far
+        @type allWordsLen: int
+        @param numCharsSaved: length of all words predicted so far
+        @type numCharsSaved: int
+        '''
+        self.writeRows(tally);
+        self.partialFD.flush();
+        os.fsync(self.partialFD.fileno());
+        (self.allWordsLen, self.numCharsSaved) = (allWordsLen, numCharsSaved);
+        checkpoint = {'runSettings'   : self.runSettings,
+                      'fileIndex'     : position[0],
+                      'offset'        : position[1],
+                      'sentenceID'    : sentenceID,
+                      'partialBytes'  : self.partialFD.tell(),
+                      'numSentences'  : self.numSentences,
+                      'sumScores'     : self.sumScores,
+                      'maxDepth'      : self.maxDepth,
+                      'allWordsLen'   : allWordsLen,
+                      'numCharsSaved' : numCharsSaved};
+        # Replace the checkpoint in one step, so that a crash
+        # leaves either the old or the new one:
+        with open(self.checkpointPath + '.tmp', 'w') as fd:
+            json.dump(checkpoint, fd);
+        os.rename(self.checkpointPath + '.tmp', self.checkpointPath);
+        
+    def finish(self, tally):
+        '''
+        Append the last results, and write the CSV file: the header, and
+        the partial file's rows, padded to the same number of depth columns.
+        Then remove the partial and checkpoint files.
+        @param tally: results of all sentences since the last checkpoint.
+        @type tally: PerformanceTally
+        @return: average of depth-weighted performance of all sentences of the run.
+        @rtype: float
+        '''
+        self.writeRows(tally);
+        self.partialFD.close();
+        with open(self.csvFilePath, 'w') as csvFd:
+            csvFd.write(csvHeader(self.maxDepth) + '\n');
+            with open(self.partialPath) as partialFd:
+                for row in partialFd:
+                    cells = row.rstrip('\n').split(',');
+                    # Email ID through InputSavings, depth counts, and the score:
+                    depthCells = cells[6:-1];
+                    depthCells.extend(['0'] * (self.maxDepth - len(depthCells)));
+                    csvFd.write(','.join(cells[:6] + depthCells + cells[-1:]) + '\n');
+        os.remove(self.partialPath);
+        if os.path.exists(self.checkpointPath):
+            os.remove(self.checkpointPath);
+        return self.sumScores / self.numSentences;
+
+class TreeIndex(object):
+    '''
+    Lookup structure for one echo tree, built in a single walk over
+    the Python tree that WordExplorer.makeWordTree() returns. Gives the
+    same answers as getDepthFromWord() and extractWordSet(), without
+    the round trip through JSON:
+    
+       - depths: each word to the smallest depth of a node that contains
+                 it, as split by getDepthFromWord(). The root is at depth 0.
+       - wordSet: the flattened tree's words in lower case, as in extractWordSet().
+       
+    An index can also cover just the part of the tree that a smaller
+    tree, of lower depth or breadth, would have. See subIndex().
+    '''
+    
+    def __init__(self, wordTree, maxDepth=None, maxBranch=None):
+        '''
+        @param wordTree: tree made by WordExplorer.makeWordTree()
+        @type wordTree: {}
+        @param maxDepth: if provided, index only nodes that a tree of this depth has.
+        @type maxDepth: int
+        @param maxBranch: if provided, index only nodes that a tree of this breadth has.
+        @type maxBranch: int
+        '''
+        self.wordTree = wordTree;
+        self.depths  = {};
+        self.wordSet = set();
+        # Each node with its depth, and the highest position among its 
+        # siblings of any node on its path from the root. The node is
+        # in the tree of breadth b if that position is below b:
+        nodes = [(wordTree, 0, 0)];
+        while len(nodes) > 0:
+            (node, depth, branchPos) = nodes.pop();
+            if (maxDepth is not None and depth >= maxDepth) or \
+               (maxBranch is not None and branchPos >= maxBranch):
+                continue;
+            nodeWords = node['word'];
+            for word in nodeWords.split():
+                if depth < self.depths.get(word, depth + 1):
+                    self.depths[word] = depth;
+            if isinstance(nodeWords, str):
+                # The root word, as typed. JSON turned it into unicode:
+                nodeWords = nodeWords.decode('utf-8', 'replace');
+            for word in nodeWords.split(' '):
+                self.wordSet.add(word.lower());
+            for (siblingPos, subtree) in enumerate(node['followWordObjs']):
+                nodes.append((subtree, depth + 1, max(branchPos, siblingPos)));
+        # What extractWordSet() returns: the flattened tree starts
+        # with a space, so its root word is the empty string:
+        self.extractedWordSet = (u'', self.wordSet);
+        
+    def getDepth(self, word):
+        '''
+        @return: the depth at which the word occurs in the tree, or None if not present.
+        @rtype: {int | None}
+        '''
+        return self.depths.get(word);
+    
+    def subIndex(self, maxDepth, maxBranch):
+        '''
+        Index of the tree with the same root and arity, but of the given
+        depth and breadth, which must not exceed this tree's. Since
+        makeWordTree() picks the followers of each node independently of
+        the tree's shape, that tree is part of this one.
+        @param maxDepth: depth of the smaller tree
+        @type maxDepth: int
+        @param maxBranch: breadth of the smaller tree
+        @type maxBranch: int
+        @rtype: TreeIndex
+        '''
+        return TreeIndex(self.wordTree, maxDepth, maxBranch);
+
 class Evaluator(object):
     
-    def __init__(self, dbPath):
+    def __init__(self, dbPath, treeMemoSize=TREE_MEMO_SIZE):
+        '''
+        @param dbPath: path to the Bigram/Trigram probabilities table Sqlite3 db to use
+        @type dbPath: string
+        @param treeMemoSize: maximum number of tree indexes to keep, so that
+                             repeated words need not have their trees rebuilt.
+        @type treeMemoSize: int
+        '''
         self.wordExplorer = WordExplorer(dbPath);
         self.initWordCaptureTally();
         self.verbosity = Verbosity.NONE;
+        # Set by measurePerformance():
+        self.arity = None;
+        # Shape of the trees to measure with:
+        self.maxDepth  = WORD_TREE_DEPTH;
+        self.maxBranch = WORD_TREE_BREADTH;
+        # Shape of the trees to build. Trees of other shapes are derived
+        # from these. Larger than the above only during sweeps:
+        self.treeDepth  = self.maxDepth;
+        self.treeBranch = self.maxBranch;
+        # Least recently used tree indexes, oldest first:
+        self.treeMemo = OrderedDict();
+        self.treeMemoSize = treeMemoSize;
+        self.treeMemoModelVersion = self.wordExplorer.modelVersionInCache;
+        self.initTreeMemoStats();
         
     def getMaxDepthAllSentences(self):
         '''
-        Runs through all sentences this Evaluator instance has
-        measured, and returns the deepest depth of all sentences:
+        Returns the deepest depth of all sentences this Evaluator
+        instance has measured. The tally keeps track of it as it grows.
         '''
-        maxDepth = 0;
-        for sentencePerf in self.performanceTally:
-            maxDepth = max(sentencePerf.getDeepestDepth(), maxDepth);
-        return maxDepth;
+        return self.performanceTally.getMaxDepth();
         
     def toCSV(self, outFileFD=None):
-        csv = self.getCSVHeader() + '\n';
-        for sentencePerf in self.performanceTally:
-            csv += sentencePerf.toCSV() + '\n';
+        csv = self.getCSVHeader() + '\n' + ''.join([row + '\n' for row in self.performanceTally.iterCSVRows()]);
         if outFileFD is not None:
             try:
                 outFileFD.write(csv);
                 outFileFD.flush();
             except IOError:
-                print "Warning: could not write to outfile FD: %s" + str(outFileFD);
+                print "Warning: could not write to outfile FD: %s" % str(outFileFD);
         return csv;
+    
+    def writeCSV(self, outFileFD):
+        '''
+        Like toCSV(), but writes the rows one by one, without 
+        building the whole CSV in memory.
+        @param outFileFD: file to write to
+        @type outFileFD: file
+        '''
+        try:
+            outFileFD.write(self.getCSVHeader() + '\n');
+            for row in self.performanceTally.iterCSVRows():
+                outFileFD.write(row + '\n');
+            outFileFD.flush();
+        except IOError:
+            print "Warning: could not write to outfile FD: %s" % str(outFileFD);
             
     def getCSVHeader(self):
-        header = 'EmailID,SentenceID,SentenceLen,Failures,OutofSeq,InputSavings';        
-        for depthIndex in range(1,self.getMaxDepthAllSentences() + 1):
-            header += ',Depth_' + str(depthIndex);
-        header += ',DepthWeightedScore'
-        return header;
+        return csvHeader(self.getMaxDepthAllSentences());
     
     def extractWordSet(self, jsonEchoTreeStr):
         '''
@@ -328,14 +679,14 @@ class Evaluator(object):
         flatTree  = self.extractWordSeqsHelper(pythonEchoTree);
         flatQueue = deque(flatTree.split());
         # Number of words: breadth ** (depth-1) + 1
-        numSibPops = WORD_TREE_BREADTH ** (WORD_TREE_DEPTH - 2);
+        numSibPops = self.maxBranch ** (self.maxDepth - 2);
         # Root word first:
         resDictQueue = deque([flatQueue[0]]);
         for dummy in range(numSibPops):
             sibs = deque([]);
             parentDict = OrderedDict();
             resDictQueue.append(parentDict);
-            for dummy in range(WORD_TREE_BREADTH):
+            for dummy in range(self.maxBranch):
                 sibs.append(flatQueue.pop());
             parentDict[flatQueue.pop()] = sibs;
         return resDictQueue;
@@ -419,7 +770,69 @@ class Evaluator(object):
         return res;
             
     def initWordCaptureTally(self):
-        self.performanceTally = [];
+        self.performanceTally = PerformanceTally();
+        
+    def initTreeMemoStats(self):
+        self.treeMemoHits = 0;
+        self.treeMemoMisses = 0;
+        
+    def getTreeMemoHitRate(self):
+        '''
+        @return: percentage of getTreeIndex() calls that were served from the memo.
+        @rtype: float
+        '''
+        numLookups = self.treeMemoHits + self.treeMemoMisses;
+        if numLookups == 0:
+            return 0.0;
+        return 100.0 * self.treeMemoHits / numLookups;
+        
+    def getTreeIndex(self, word):
+        '''
+        Return the TreeIndex of the given word's tree, in the current
+        arity and tree shape.
+        @param word: root word of the tree
+        @type word: string
+        @rtype: TreeIndex
+        '''
+        return self.lookupTreeIndex(word, self.maxDepth, self.maxBranch);
+    
+    def lookupTreeIndex(self, word, maxDepth, maxBranch):
+        '''
+        Return the TreeIndex of the given word's tree of the given shape.
+        Indexes are memoized by word, arity, and tree shape. Once the memo
+        holds treeMemoSize indexes, the least recently used one is dropped.
+        When the database's model version changes, the memo is cleared.
+        Indexes of trees smaller than treeDepth and treeBranch are derived
+        from the index of the tree of that shape.
+        @param word: root word of the tree
+        @type word: string
+        @param maxDepth: depth of the tree
+        @type maxDepth: int
+        @param maxBranch: breadth of the tree
+        @type maxBranch: int
+        @rtype: TreeIndex
+        '''
+        self.wordExplorer.checkModelVersion();
+        if self.wordExplorer.modelVersionInCache != self.treeMemoModelVersion:
+            self.treeMemo.clear();
+            self.treeMemoModelVersion = self.wordExplorer.modelVersionInCache;
+        key = (word, self.arity, maxDepth, maxBranch);
+        try:
+            # Popped, so that re-inserting it below makes it the most recently used:
+            treeIndex = self.treeMemo.pop(key);
+            self.treeMemoHits += 1;
+        except KeyError:
+            if maxDepth <= self.treeDepth and maxBranch <= self.treeBranch and \
+               (maxDepth, maxBranch) != (self.treeDepth, self.treeBranch):
+                treeIndex = self.lookupTreeIndex(word, self.treeDepth, self.treeBranch).subIndex(maxDepth, maxBranch);
+            else:
+                treeIndex = TreeIndex(self.wordExplorer.makeWordTree(word, self.arity, maxDepth=maxDepth, maxBranch=maxBranch));
+            self.treeMemoMisses += 1;
+            if len(self.treeMemo) >= self.treeMemoSize > 0:
+                self.treeMemo.popitem(last=False);
+        if self.treeMemoSize > 0:
+            self.treeMemo[key] = treeIndex;
+        return treeIndex;
         
     def tallyWordCapture(self, sentenceTokens, emailID=-1, sentenceID=None, removeStopwords=False):
         '''
@@ -433,7 +846,7 @@ class Evaluator(object):
            - depths: for each tree depth, how many of the sentence's words appeared at that depth.
            
        Creates a SentencePerformance instance that stores the result measures. Adds
-       that instance to this evaluator's performanceTally array.
+       its results to this evaluator's performanceTally.
                      
         @param sentenceTokens: tokens that make up the sentence.
         @type sentenceTokens: [string]
@@ -446,16 +859,21 @@ class Evaluator(object):
         @return: an array of all words successfully predicted (in any level of the tree)
         @rtype: [string]
         '''
-        # We'll modify sentenceTokens in the loop
-        # below, so get a shallow copy for the loop:
-        tokenCopy = copy.copy(sentenceTokens);
-        for word in tokenCopy:
-            if len(word) == 0:
-                sentenceTokens.remove(word);
-                continue;
-            if removeStopwords and (word.lower() in STOPWORDS):
-                sentenceTokens.remove(word);
-                continue;
+        return self.tallyCleanTokens(TOKEN_CLEANERS[removeStopwords].clean(sentenceTokens), emailID, sentenceID);
+        
+    def tallyCleanTokens(self, sentenceTokens, emailID=-1, sentenceID=None):
+        '''
+        Like tallyWordCapture(), for a sentence whose empty tokens, and
+        stopwords if so desired, were already removed by a TokenCleaner.
+        @param sentenceTokens: the cleaned tokens of the sentence.
+        @type sentenceTokens: [string]
+        @param emailID: optional ID to identify from which email the given sentence was taken.
+        @type emailID: <any>
+        @param sentenceID: optional ID to identify the given sentence within its email.
+        @type sentenceID: <any>
+        @return: an array of all words successfully predicted (in any level of the tree)
+        @rtype: [string]
+        '''
         if len(sentenceTokens) == 0:
             # The sentence was all empty words, or stopwords that we were asked to remove:
             return "";
@@ -471,12 +889,14 @@ class Evaluator(object):
         predictedWords = [];
         
         # Start for real:
-        tree = self.wordExplorer.makeWordTree(sentenceTokens[0], self.arity);
-        treeWords = self.extractWordSet(self.wordExplorer.makeJSONTree(tree));
+        treeIndex = self.getTreeIndex(sentenceTokens[0]);
+        # Note that this is extractWordSet()'s (rootWord, wordSet) pair,
+        # not the word set. Kept, so that results stay comparable:
+        treeWords = treeIndex.extractedWordSet;
         prevWord = sentenceTokens[0];
         for wordPos, word in enumerate(sentenceTokens[1:]):
             #word = word.lower();
-            wordDepth = self.getDepthFromWord(tree, word);
+            wordDepth = treeIndex.getDepth(word);
             if self.verbosity == Verbosity.DEBUG:
                 print("   Word '%s' score:\t\t%f  %f" % (prevWord,
                                                          1.0 if wordDepth == 1 else 0.0, 
@@ -495,17 +915,17 @@ class Evaluator(object):
                 sentencePerf.addPredictedWord(word);
                 predictedWords.append(word);
             # Build a new tree from the (virtually) typed in current word
-            tree =  self.wordExplorer.makeWordTree(word, self.arity);
-            treeWords = self.extractWordSet(self.wordExplorer.makeJSONTree(tree));
+            treeIndex = self.getTreeIndex(word);
+            treeWords = treeIndex.extractedWordSet;
             prevWord = word;
         
         # Finished looking at every toking in the sentence.
-        self.performanceTally.append(sentencePerf);
+        self.performanceTally.add(sentencePerf);
         if self.verbosity == Verbosity.DEBUG:
             totalDepthWeightedScore = 0.0
             totalDepth1Score = 0;
             totalDepth2Score = 0;
-            performance = self.performanceTally[-1]
+            performance = sentencePerf;
             totalDepthWeightedScore += performance.getDepthWeightedSuccessSentence();
             totalDepth1Score        += performance.getDepthCount(1);
             totalDepth2Score        += performance.getDepthCount(2);
@@ -516,38 +936,35 @@ class Evaluator(object):
             print("\t\t\t       \t-------------------------------");
         return predictedWords;
     
-    def readSentence(self, fd):
-        sentenceOpener = '['
-        sentenceCloser= ']'
-        res = '';
-        # Find start of next sentence:
-        while 1:
-            try:
-                letter = fd.read(1);
-                if letter == sentenceOpener:
-                    # Found start of sentence
-                    break;
-                if len(letter) == 0:
-                    # Gone through the whole file:
-                    return None;
-            except IOError:
-                return None
-        while 1:
-            try:
-                letter = fd.read(1);
-                # Reached end of file before closing bracket:
-                if len(letter) == 0:
-                    raise IOError;
-            except IOError:
-                print "Warning: ignoring unfinished sentence: %s." % res;
-                return None
-            if letter == sentenceCloser:
-                return res;
-            if letter == " " or letter in PUNCTUATION:
-                continue;
-            res += letter;
+    @staticmethod
+    def readSentences(tokenFilePath):
+        '''
+        Iterate over the sentences of one token file. Each sentence is
+        the text between a pair of brackets, with spaces and punctuation
+        other than the token separating commas removed.
+        @param tokenFilePath: path to the token file
+        @type tokenFilePath: string
+        @return: iterator over comma-separated token strings
+        @rtype: iterator
+        '''
+        return iterBracketedSentences(tokenFilePath, deleteChars=' ' + PUNCTUATION);
+    
+    @staticmethod
+    def readSentencePositions(tokenFilePath, startPos=0):
+        '''
+        Like readSentences(), but starting at the given byte offset, and with
+        the byte offset past each sentence, from which reading can resume.
+        @param tokenFilePath: path to the token file
+        @type tokenFilePath: string
+        @param startPos: byte offset at which to start reading
+        @type startPos: int
+        @return: iterator over (byte offset, comma-separated token string)
+        @rtype: iterator
+        '''
+        return iterBracketedSentencePositions(tokenFilePath, deleteChars=' ' + PUNCTUATION, startPos=startPos);
             
-    def checksum(self, theStr):
+    @staticmethod
+    def checksum(theStr):
         '''
         Returns the sum of all the given string's ASCCII values.
         @param theStr: string to be checksummed.
@@ -556,9 +973,135 @@ class Evaluator(object):
         @rtype: int
         '''
         return reduce(lambda x,y:x+y, map(ord, theStr))
+    
+    def testSentences(self, tokenFilePaths, corpusDir=None, resumePoint=None):
+        '''
+        Iterate over the sentences to measure, either parsed from the
+        token files, or loaded from a binary corpus written by 
+        writeBinaryCorpus(). Both give the same sentences and IDs.
+        @param tokenFilePaths: paths of the token files. Ignored if corpusDir is provided.
+        @type tokenFilePaths: [string]
+        @param corpusDir: binary corpus in the evaluator's view.
+        @type corpusDir: string
+        @param resumePoint: if provided, (file index, byte offset, sentence ID) of 
+                            a sentence handed out earlier. Iteration continues 
+                            with the sentence after it.
+        @type resumePoint: (int, int, int)
+        @return: iterator over (token file path, email ID, sentence ID within the file, 
+                 position, [token]). The position is the index of the file, and the 
+                 byte offset past the sentence in the token file; None for binary
+                 corpora. Each token list is new, so it may be modified.
+        @rtype: iterator
+        '''
+        (resumeFileIndex, resumeOffset, resumeSentenceID) = resumePoint if resumePoint is not None else (0, None, -1);
+        if corpusDir is None:
+            for fileIndex in xrange(resumeFileIndex, len(tokenFilePaths)):
+                tokenFilePath = tokenFilePaths[fileIndex];
+                msgID = self.checksum(tokenFilePath);
+                if fileIndex == resumeFileIndex and resumeOffset is not None:
+                    (startPos, firstSentenceID) = (resumeOffset, resumeSentenceID + 1);
+                else:
+                    (startPos, firstSentenceID) = (0, 0);
+                # Get one sentence at a time as a comma-separated string of tokens:
+                for sentenceID, (sentenceEnd, pythonSentenceTokens) in enumerate(self.readSentencePositions(tokenFilePath, startPos), firstSentenceID):
+                    yield (tokenFilePath, msgID, sentenceID, (fileIndex, sentenceEnd), pythonSentenceTokens.split(','));
+            return;
+        corpus = BinaryCorpus(corpusDir, view=EVALUATOR_VIEW);
+        currFileIndex = None;
+        for (fileIndex, tokenArray) in corpus.iterSentences(xrange(resumeFileIndex, len(corpus.sourceFiles))):
+            if fileIndex != currFileIndex:
+                currFileIndex = fileIndex;
+                tokenFilePath = corpus.sourceFiles[fileIndex];
+                msgID = self.checksum(tokenFilePath);
+                sentenceID = 0;
+            if fileIndex > resumeFileIndex or sentenceID > resumeSentenceID:
+                yield (tokenFilePath, msgID, sentenceID, (fileIndex, None), tokenArray);
+            sentenceID += 1;
             
             
-    def measurePerformance(self, csvFilePath, dbFilePath, arity, tokenFilePaths, verbosity=Verbosity.NONE, removeStopwords=False):
+    def measureSerially(self, tokenFilePaths, corpusDir=None, removeStopwords=False, resumePoint=None):
+        '''
+        Measure each test sentence in this process.
+        @param tokenFilePaths: paths of the token files. Ignored if corpusDir is provided.
+        @type tokenFilePaths: [string]
+        @param corpusDir: binary corpus in the evaluator's view.
+        @type corpusDir: string
+        @param removeStopwords: whether or not to remove stopwords.
+        @type removeStopwords: boolean
+        @param resumePoint: if provided, start after this sentence. See testSentences().
+        @type resumePoint: (int, int, int)
+        @return: iterator over (token file path, sentence ID, position, sentence length in characters, 
+                 [predicted word], tallied), one per sentence, in order. The position is
+                 testSentences()'s. tallied is True if the tally holds the results of all
+                 sentences up to this one, and of none after it.
+        @rtype: iterator
+        '''
+        for sentenceNum, (tokenFilePath, msgID, sentenceID, position, tokenArray) in enumerate(self.testSentences(tokenFilePaths, corpusDir, resumePoint)):
+            if self.verbosity == Verbosity.DEBUG:
+                print("Sentence %d tokens: %s" % (sentenceNum,','.join(tokenArray)));
+            sentenceLen = sentenceCharLen(tokenArray);
+            # Do the stats:
+            predictedWordsThisSentence = self.tallyWordCapture(tokenArray, emailID=msgID, sentenceID=sentenceID, removeStopwords=removeStopwords);
+            if self.verbosity == Verbosity.DEBUG:
+                print("Words predicted in sentence %d: %s." % (sentenceNum, predictedWordsThisSentence));
+                print("Typing saved: " + str(self.performanceTally.typingSavings[-1]));
+            yield (tokenFilePath, sentenceID, position, sentenceLen, predictedWordsThisSentence, True);
+    
+    def measureInParallel(self, tokenFilePaths, numWorkers, corpusDir=None, removeStopwords=False, resumePoint=None):
+        '''
+        Parallel version of measureSerially(). Batches of sentences are
+        measured by measureSentenceBatch() in a pool of worker processes,
+        each with its own WordExplorer on this evaluator's database. The
+        results are merged in sentence order, so the tally, and thereby
+        the CSV, are the same as those of a serial run.
+        @param tokenFilePaths: paths of the token files. Ignored if corpusDir is provided.
+        @type tokenFilePaths: [string]
+        @param numWorkers: number of worker processes.
+        @type numWorkers: int
+        @param corpusDir: binary corpus in the evaluator's view.
+        @type corpusDir: string
+        @param removeStopwords: whether or not to remove stopwords.
+        @type removeStopwords: boolean
+        @param resumePoint: if provided, start after this sentence. See testSentences().
+        @type resumePoint: (int, int, int)
+        @return: same as measureSerially(). The tally receives the results of
+                 a whole batch at a time, so only a batch's last sentence is tallied.
+        @rtype: iterator
+        '''
+        pool = multiprocessing.Pool(numWorkers, 
+                                    initializer=initEvalWorker, 
+                                    initargs=(self.wordExplorer.db.dbPath, self.arity, removeStopwords,
+                                              (self.maxDepth, self.maxBranch, self.treeDepth, self.treeBranch),
+                                              self.treeMemoSize));
+        try:
+            # imap() hands back the results in batch order:
+            for (batchResults, batchTally, treeMemoHits, treeMemoMisses) in pool.imap(measureSentenceBatch, self.iterSentenceBatches(tokenFilePaths, corpusDir, resumePoint)):
+                # Report the workers' memo use as our own:
+                self.treeMemoHits += treeMemoHits;
+                self.treeMemoMisses += treeMemoMisses;
+                self.performanceTally.extend(batchTally);
+                for (resultNum, (tokenFilePath, sentenceID, position, sentenceLen, predictedWordsThisSentence)) in enumerate(batchResults):
+                    yield (tokenFilePath, sentenceID, position, sentenceLen, predictedWordsThisSentence, resultNum == len(batchResults) - 1);
+        finally:
+            pool.close();
+            pool.join();
+    
+    def iterSentenceBatches(self, tokenFilePaths, corpusDir=None, resumePoint=None):
+        '''
+        Group the test sentences into lists of up to WORKER_BATCH_SIZE.
+        @return: iterator over lists of testSentences() tuples
+        @rtype: iterator
+        '''
+        batch = [];
+        for sentence in self.testSentences(tokenFilePaths, corpusDir, resumePoint):
+            batch.append(sentence);
+            if len(batch) >= WORKER_BATCH_SIZE:
+                yield batch;
+                batch = [];
+        if len(batch) > 0:
+            yield batch;
+            
+    def measurePerformance(self, csvFilePath, dbFilePath, arity, tokenFilePaths, verbosity=Verbosity.NONE, removeStopwords=False, corpusDir=None, numWorkers=None, resumable=False):
         '''
         Token files must hold a string as produced by the Stanford NLP core 
         tokenizer/sentence segmenter. Ex: "[foo, bar, fum]". Notice the ',<space>'
@@ -580,78 +1123,256 @@ class Evaluator(object):
         @type verbose: Verbosity
         @param removeStopwords: whether or not to remove ngrams with stopwords from the echo trees
         @type  removeStopwords: boolean
+        @param corpusDir: if provided, read the sentences from this binary corpus, 
+                          written by writeBinaryCorpus(), instead of from tokenFilePaths.
+        @type corpusDir: string
+        @param numWorkers: if provided, measure the sentences in this many worker processes. 
+                           The results are the same as those of a serial run. Debug output
+                           of the workers is not printed.
+        @type numWorkers: int
+        @param resumable: if True, write results to disk as they come in, with checkpoints, 
+                          and continue from the last checkpoint of an earlier, interrupted
+                          run with the same settings. See ResultCheckpointer.
+        @type resumable: boolean
         @return: Average of depth-weighted performance of all sentences
         @rtype: float.
         '''
         if verbosity > 0:
             numSentencesDone = 0;
             reportEvery = PROGRESS_RATE; # progress every PROGRESS_RATE sentences
-            # Be debug level verbose:
-            if verbosity > 1:
-                self.verbosity = verbosity;
+            # Report progress, and be debug level verbose if asked:
+            self.verbosity = verbosity;
             
         self.arity = arity;
         
         self.initWordCaptureTally();
+        self.initTreeMemoStats();
         # Total length of all words in all sentences that will be tested
         allWordsLen = 0;
-        # A list of all words that were predicted successfully:
-        allPredictedWords = [];
-        for tokenFilePath in tokenFilePaths:
-            msgID = self.checksum(tokenFilePath);
-            sentenceID = 0;
-            with open(tokenFilePath, 'r') as tokenFD:
-                while 1:
-                    # Get one sentence as a comma-separated string of tokens:
-                    pythonSentenceTokens = self.readSentence(tokenFD);
-                    if self.verbosity == Verbosity.DEBUG:
-                        print("Sentence %d tokens: %s" % (numSentencesDone,str(pythonSentenceTokens)));
-                    if pythonSentenceTokens is None:
-                        # Done with one file.
-                        break;
-                    tokenArray = pythonSentenceTokens.split(',');
-                    # Compute the sentence length in characters, adding
-                    # a space (or closing period) for each token:
-                    for token in tokenArray:
-                        allWordsLen += len(token) + 1;
-                    # Do the stats:
-                    predictedWordsThisSentence = self.tallyWordCapture(tokenArray, emailID=msgID, sentenceID=sentenceID, removeStopwords=removeStopwords);
-                    if self.verbosity == Verbosity.DEBUG:
-                        print("Words predicted in sentence %d: %s." % (numSentencesDone, predictedWordsThisSentence));
-                        print("Typing saved: " + str(self.performanceTally[-1].getPercentTypeSavings()));
-                    allPredictedWords.extend(predictedWordsThisSentence);
-                    sentenceID += 1;
-                    if self.verbosity != Verbosity.NONE:
-                        numSentencesDone += 1;
-                        if numSentencesDone % reportEvery == 0:
-                            print "At file %s. Done %d sentences." % (os.path.basename(tokenFilePath), numSentencesDone);
-                            
+        # Total length of all words that were predicted successfully:
         numCharsSaved = 0;
+        checkpointer = None;
+        resumePoint = None;
+        if resumable:
+            runSettings = {'dbPath'          : self.wordExplorer.db.dbPath,
+                           'arity'           : arity,
+                           'maxDepth'        : self.maxDepth,
+                           'maxBranch'       : self.maxBranch,
+                           'removeStopwords' : removeStopwords,
+                           'tokenFilePaths'  : list(tokenFilePaths) if corpusDir is None else None,
+                           'corpusDir'       : corpusDir};
+            checkpointer = ResultCheckpointer(csvFilePath, runSettings);
+            (resumePoint, allWordsLen, numCharsSaved) = (checkpointer.resumePoint, checkpointer.allWordsLen, checkpointer.numCharsSaved);
+            if resumePoint is not None and self.verbosity != Verbosity.NONE:
+                print "Resuming after sentence %d of file %d, with %d sentences done." % \
+                    (resumePoint[2], resumePoint[0], checkpointer.numSentences);
+        if numWorkers is None:
+            sentenceResults = self.measureSerially(tokenFilePaths, corpusDir, removeStopwords, resumePoint);
+        else:
+            sentenceResults = self.measureInParallel(tokenFilePaths, numWorkers, corpusDir, removeStopwords, resumePoint);
+        for (tokenFilePath, sentenceID, position, sentenceLen, predictedWordsThisSentence, tallied) in sentenceResults:
+            allWordsLen += sentenceLen;
+            for word in predictedWordsThisSentence:
+                numCharsSaved += len(word);
+            if checkpointer is not None and tallied and len(self.performanceTally) >= CHECKPOINT_RATE:
+                checkpointer.checkpoint(self.performanceTally, position, sentenceID, allWordsLen, numCharsSaved);
+                self.initWordCaptureTally();
+            if self.verbosity != Verbosity.NONE:
+                numSentencesDone += 1;
+                if numSentencesDone % reportEvery == 0:
+                    print "At file %s. Done %d sentences. Tree memo hit rate: %.1f%%." % \
+                        (os.path.basename(tokenFilePath), numSentencesDone, self.getTreeMemoHitRate());
+        if self.verbosity != Verbosity.NONE:
+            print "Done %d sentences. Tree memo hit rate: %.1f%% of %d trees." % \
+                (numSentencesDone, self.getTreeMemoHitRate(), self.treeMemoHits + self.treeMemoMisses);
+                        
         # Compute percentage typing saved for all sentences together.
         # Note that we cannot subtract one char for the automatically
         # generated space after each word, because users do have to
         # click on the word:
-        for word in allPredictedWords:
-            numCharsSaved += len(word);
         typingSaved = numCharsSaved * 100 / allWordsLen;
+        
+        if checkpointer is not None:
+            # Mean sentence performance:
+            return checkpointer.finish(self.performanceTally);
          
         with open(csvFilePath,'w') as CsvFd:
-            csvAll = self.toCSV(outFileFD=CsvFd);
-        if self.verbosity == Verbosity.DEBUG:
-            print csvAll;
-        # Compute mean sentence performance:
-        totalPerfDbAndArity = 0.0;
-        sentenceID = 0;
-        for sentencePerformance in self.performanceTally:
-            totalPerfDbAndArity += sentencePerformance.getDepthWeightedSuccessSentence();
-            if self.verbosity == Verbosity.DEBUG:
-                print("Sentence %d tally: %f" % (sentenceID, sentencePerformance.getDepthWeightedSuccessSentence()));
-                sentenceID += 1;
+            self.writeCSV(CsvFd);
         if self.verbosity == Verbosity.DEBUG:
-            print("Total score (sumSentenceScores/numSentences): %f / %d = %f" % (totalPerfDbAndArity, 
+            print self.toCSV();
+            for sentenceID, sentenceScore in enumerate(self.performanceTally.depthWeightedScores):
+                print("Sentence %d tally: %f" % (sentenceID, sentenceScore));
+            print("Total score (sumSentenceScores/numSentences): %f / %d = %f" % (sum(self.performanceTally.depthWeightedScores), 
                                                                                   len(self.performanceTally), 
-                                                                                  totalPerfDbAndArity/len(self.performanceTally)));
-        return totalPerfDbAndArity/len(self.performanceTally)
+                                                                                  self.performanceTally.getMeanDepthWeightedScore()));
+        # Mean sentence performance:
+        return self.performanceTally.getMeanDepthWeightedScore();
+
+    def sweepPerformance(self, csvFilePath, tokenFilePaths, sweepConfigs, verbosity=Verbosity.NONE, corpusDir=None):
+        '''
+        Measure the sentences once for each of several configurations, in
+        one pass over the sentences. For each word, the tree of the largest
+        depth and breadth in sweepConfigs is built once per arity; the trees
+        of the other configurations are derived from it. Each configuration's
+        CSV file, at sweepCSVPath(csvFilePath, config), is the one that 
+        measurePerformance() writes for that configuration.
+        
+        @param csvFilePath: path from which the CSV file paths are derived.
+        @type csvFilePath: string
+        @param tokenFilePaths: fully qualified paths to each token file.
+        @type tokenFilePaths: [string]
+        @param sweepConfigs: configurations, each (arity, tree depth, tree breadth, removeStopwords).
+        @type sweepConfigs: [(int, int, int, boolean)]
+        @param verbosity: if not Verbosity.NONE: report progress.
+        @type verbosity: Verbosity
+        @param corpusDir: if provided, read the sentences from this binary corpus
+                          instead of from tokenFilePaths.
+        @type corpusDir: string
+        @return: average of depth-weighted performance of all sentences, by configuration.
+        @rtype: {(int, int, int, boolean) : float}
+        '''
+        for (arity, depth, breadth, removeStopwords) in sweepConfigs:
+            if depth < 1 or breadth < 1:
+                raise ValueError("Tree depth and breadth must be at least 1; got %d and %d." % (depth, breadth));
+        tallies = OrderedDict((config, PerformanceTally()) for config in sweepConfigs);
+        measuredShape = (self.arity, self.maxDepth, self.maxBranch, self.treeDepth, self.treeBranch);
+        wordExplorer = self.wordExplorer;
+        # A WordExplorer drops its follower cache whenever the arity
+        # changes, so each arity gets its own:
+        wordExplorers = dict((config[0], WordExplorer(wordExplorer.db.dbPath)) for config in sweepConfigs);
+        sweepCleaners = dict((config[3], TOKEN_CLEANERS[config[3]]) for config in sweepConfigs);
+        self.treeDepth  = max([config[1] for config in sweepConfigs]);
+        self.treeBranch = max([config[2] for config in sweepConfigs]);
+        self.initTreeMemoStats();
+        try:
+            for sentenceNum, (tokenFilePath, msgID, sentenceID, position, tokenArray) in enumerate(self.testSentences(tokenFilePaths, corpusDir)):
+                # Clean the sentence once per stopword mode, not once per configuration:
+                cleanTokens = dict((removeStopwords, cleaner.clean(tokenArray)) for (removeStopwords, cleaner) in sweepCleaners.items());
+                for config in sweepConfigs:
+                    (self.arity, self.maxDepth, self.maxBranch, removeStopwords) = config;
+                    self.wordExplorer = wordExplorers[self.arity];
+                    self.performanceTally = tallies[config];
+                    self.tallyCleanTokens(cleanTokens[removeStopwords], emailID=msgID, sentenceID=sentenceID);
+                if verbosity != Verbosity.NONE and (sentenceNum + 1) % PROGRESS_RATE == 0:
+                    print "At file %s. Done %d sentences in %d configurations. Tree memo hit rate: %.1f%%." % \
+                        (os.path.basename(tokenFilePath), sentenceNum + 1, len(sweepConfigs), self.getTreeMemoHitRate());
+            results = OrderedDict();
+            for (config, performanceTally) in tallies.items():
+                self.performanceTally = performanceTally;
+                with open(sweepCSVPath(csvFilePath, config), 'w') as csvFd:
+                    self.writeCSV(csvFd);
+                results[config] = performanceTally.getMeanDepthWeightedScore();
+        finally:
+            (self.arity, self.maxDepth, self.maxBranch, self.treeDepth, self.treeBranch) = measuredShape;
+            self.wordExplorer = wordExplorer;
+        return results;
+
+def csvHeader(maxDepth):
+    '''
+    @param maxDepth: deepest depth at which a word of any sentence was found.
+    @type maxDepth: int
+    @return: header line of the CSV files, without line end.
+    @rtype: string
+    '''
+    header = 'EmailID,SentenceID,SentenceLen,Failures,OutofSeq,InputSavings';        
+    for depthIndex in range(1, maxDepth + 1):
+        header += ',Depth_' + str(depthIndex);
+    header += ',DepthWeightedScore'
+    return header;
+
+def sweepCSVPath(csvFilePath, sweepConfig):
+    '''
+    Path of the CSV file of one sweep configuration: csvFilePath, with 
+    the configuration inserted before the extension. Example:
+    'eval.csv' --> 'eval_arity2_depth3_breadth5_noStopwords.csv'
+    @param csvFilePath: path given to Evaluator.sweepPerformance()
+    @type csvFilePath: string
+    @param sweepConfig: (arity, tree depth, tree breadth, removeStopwords)
+    @type sweepConfig: (int, int, int, boolean)
+    @rtype: string
+    '''
+    (arity, depth, breadth, removeStopwords) = sweepConfig;
+    (root, extension) = os.path.splitext(csvFilePath);
+    return '%s_arity%d_depth%d_breadth%d%s%s' % (root, arity, depth, breadth, 
+                                                 '_noStopwords' if removeStopwords else '', 
+                                                 extension);
+
+def sentenceCharLen(tokenArray):
+    '''
+    Compute the sentence length in characters, adding
+    a space (or closing period) for each token.
+    @param tokenArray: the sentence's tokens, before stopword removal.
+    @type tokenArray: [string]
+    @rtype: int
+    '''
+    numChars = 0;
+    for token in tokenArray:
+        numChars += len(token) + 1;
+    return numChars;
+
+# Evaluator of a worker process; set by initEvalWorker():
+workerEvaluator = None;
+
+def initEvalWorker(dbPath, arity, removeStopwords, treeShape, treeMemoSize):
+    '''
+    Initializer of Evaluator.measureInParallel()'s worker processes:
+    open the database, and take over the measurement settings of the
+    parent's evaluator.
+    @param treeShape: the parent evaluator's (maxDepth, maxBranch, treeDepth, treeBranch)
+    @type treeShape: (int, int, int, int)
+    '''
+    global workerEvaluator;
+    workerEvaluator = Evaluator(dbPath, treeMemoSize=treeMemoSize);
+    workerEvaluator.arity = arity;
+    (workerEvaluator.maxDepth, workerEvaluator.maxBranch, workerEvaluator.treeDepth, workerEvaluator.treeBranch) = treeShape;
+    workerEvaluator.removeStopwords = removeStopwords;
+
+def measureSentenceBatch(batch):
+    '''
+    Worker for Evaluator.measureInParallel(): measure a batch of sentences.
+    @param batch: tuples (token file path, email ID, sentence ID, position, [token]),
+                  as handed out by Evaluator.testSentences().
+    @type batch: [tuple]
+    @return: for each sentence, (token file path, sentence ID, position, sentence length 
+             in characters, [predicted word]); the batch's PerformanceTally; and the number
+             of tree memo hits and misses of the batch.
+    @rtype: ([tuple], PerformanceTally, int, int)
+    '''
+    workerEvaluator.initTreeMemoStats();
+    workerEvaluator.initWordCaptureTally();
+    results = [];
+    for (tokenFilePath, msgID, sentenceID, position, tokenArray) in batch:
+        sentenceLen = sentenceCharLen(tokenArray);
+        predictedWords = workerEvaluator.tallyWordCapture(tokenArray, emailID=msgID, sentenceID=sentenceID, 
+                                                          removeStopwords=workerEvaluator.removeStopwords);
+        results.append((tokenFilePath, sentenceID, position, sentenceLen, predictedWords));
+    return (results, workerEvaluator.performanceTally, workerEvaluator.treeMemoHits, workerEvaluator.treeMemoMisses);
+
+def writeBinaryCorpus(tokenFilePaths, corpusDir):
+    '''
+    Convert token files into a binary corpus that holds the sentences
+    as Evaluator.readSentences() splits them. Pass the corpus directory
+    to measurePerformance() to skip the parsing on later runs.
+    @param tokenFilePaths: paths of the token files. Kept as given, since
+                           the email IDs in the CSV output are their checksums.
+    @type tokenFilePaths: [string]
+    @param corpusDir: directory for the corpus. Created if needed; replaced if it holds one.
+    @type corpusDir: string
+    '''
+    writer = BinaryCorpusWriter(corpusDir, EVALUATOR_VIEW);
+    try:
+        sentenceNum = 0;
+        for tokenFilePath in tokenFilePaths:
+            writer.startFile(tokenFilePath);
+            msgID = Evaluator.checksum(tokenFilePath);
+            for pythonSentenceTokens in Evaluator.readSentences(tokenFilePath):
+                for token in pythonSentenceTokens.split(','):
+                    writer.addToken(token, sentenceNum, msgID);
+                sentenceNum += 1;
+        writer.finish();
+    except:
+        writer.abort();
+        raise;
 
 # ---------------------------------- Running and Testing ------------------------------------
 
@@ -661,6 +1382,9 @@ if __name__ == '__main__':
     import sys;
 #    from subprocess import call;
 
+    def intList(commaSeparated):
+        return [int(item) for item in commaSeparated.split(',')];
+
     parser = argparse.ArgumentParser(prog='echo_tree_evaluator');
     
     
@@ -672,6 +1396,39 @@ if __name__ == '__main__':
                         dest='remStopwords',
                         action='store_true');
         
+    parser.add_argument("-c", "--corpus", 
+                        dest='corpusDir',
+                        help="read the sentences from this binary corpus instead of from token files.");
+    
+    parser.add_argument("-w", "--writeCorpus", 
+                        dest='writeCorpusDir',
+                        help="first convert the token files into a binary corpus in this directory, then measure from it.");
+        
+    parser.add_argument("-p", "--processes", 
+                        type=int,
+                        dest='numWorkers',
+                        help="measure in this many worker processes. Default: measure in this process.");
+        
+    parser.add_argument("--resumable", 
+                        action='store_true',
+                        help="write results to disk as they come in, with checkpoints; rerun with the same arguments to resume.");
+        
+    parser.add_argument("--arities", 
+                        type=intList,
+                        help="sweep: comma separated ngram arities, such as 2,3. Default: the arity argument.");
+        
+    parser.add_argument("--depths", 
+                        type=intList,
+                        help="sweep: comma separated tree depths. Default: %d." % WORD_TREE_DEPTH);
+        
+    parser.add_argument("--breadths", 
+                        type=intList,
+                        help="sweep: comma separated tree breadths. Default: %d." % WORD_TREE_BREADTH);
+        
+    parser.add_argument("--bothStopwordModes", 
+                        action='store_true',
+                        help="sweep: measure both with and without stopwords.");
+        
     parser.add_argument('csvFilePath', 
                         type=argparse.FileType('w'),
                         default=sys.stdout,
@@ -689,9 +1446,9 @@ if __name__ == '__main__':
                         )
     
     parser.add_argument('tokenFilePaths', 
-                        nargs='+', 
+                        nargs='*', 
                         type=argparse.FileType('r'),
-                        help="List of tokenfiles to use for measurements.",
+                        help="List of tokenfiles to use for measurements. Omit when using --corpus.",
                         );
     
     args = parser.parse_args();
@@ -710,18 +1467,53 @@ if __name__ == '__main__':
         print("Error: Ngram arity must currently be either 2 or 3.");
         sys.exit();
     
+    corpusDir = args.corpusDir;
+    if args.writeCorpusDir is not None:
+        writeBinaryCorpus(tokenFilePaths, args.writeCorpusDir);
+        corpusDir = args.writeCorpusDir;
+    if corpusDir is None and len(tokenFilePaths) == 0:
+        print("Error: Need token files, or a binary corpus.");
+        sys.exit();
+    if args.numWorkers is not None and args.numWorkers <= 0:
+        print("Error: Number of worker processes must be positive.");
+        sys.exit();
+    
     if args.verbose:
         verbosity = Verbosity.LOG;
     else:
         verbosity = Verbosity.NONE;
         
     evaluator = Evaluator(args.dbFilePath.name);
+    if args.arities is not None or args.depths is not None or args.breadths is not None or args.bothStopwordModes:
+        # Sweep mode; one CSV file per configuration:
+        arities  = args.arities if args.arities is not None else [args.arity];
+        depths   = args.depths if args.depths is not None else [WORD_TREE_DEPTH];
+        breadths = args.breadths if args.breadths is not None else [WORD_TREE_BREADTH];
+        stopwordModes = [False, True] if args.bothStopwordModes else [args.remStopwords];
+        if any(arity not in (2, 3) for arity in arities):
+            print("Error: Ngram arity must currently be either 2 or 3.");
+            sys.exit();
+        sweepConfigs = [(arity, depth, breadth, removeStopwords) for arity in arities for depth in depths 
+                        for breadth in breadths for removeStopwords in stopwordModes];
+        try:
+            results = evaluator.sweepPerformance(args.csvFilePath.name, tokenFilePaths, sweepConfigs, 
+                                                 verbosity=verbosity, corpusDir=corpusDir);
+        except ValueError as e:
+            print("Error: %s" % e);
+            sys.exit();
+        print("Arity,Depth,Breadth,RemoveStopwords,MeanDepthWeightedScore,CSVFile");
+        for (config, score) in results.items():
+            print("%d,%d,%d,%s,%f,%s" % (config + (score, sweepCSVPath(args.csvFilePath.name, config))));
+        sys.exit();
     evaluator.measurePerformance(args.csvFilePath.name, 
                                  args.dbFilePath.name, 
                                  args.arity,
                                  tokenFilePaths,
                                  verbosity=verbosity,
-                                 removeStopwords=args.remStopwords
+                                 removeStopwords=args.remStopwords,
+                                 corpusDir=corpusDir,
+                                 numWorkers=args.numWorkers,
+                                 resumable=args.resumable
                                  );  
     
     sys.exit();
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import unittest;
+import os;
+import re;
+import json;
+
+from echo_tree_experiment.compact_protocol import encodeEvents, decodeFrame, OPCODES, COMPACT_PROTOCOL_VERSION, MAX_FIELD_LEN;
+
+
+class TestCompactProtocol(unittest.TestCase):
+
+    def test_frameLayout(self):
+        # Version, then opcode, number of fields, and each field's
+        # 16 bit big-endian length followed by its bytes:
+        self.assertEqual('\x01' + '\x04\x02' + '\x00\x02hi' + '\x00\x00',
+                         encodeEvents([('addWord', ['hi', ''])]));
+        self.assertEqual('\x01\x0d\x00', encodeEvents([('done', [])]));
+        self.assertEqual('\x01\x04\x01\x01\x02' + 'x' * 258, encodeEvents([('addWord', ['x' * 258])]));
+        self.assertEqual('\x01', encodeEvents([]));
+
+    def test_roundTrip(self):
+        events = [('login', ['me@stanford.edu', 'you@stanford.edu', 'disabledRole']),
+                  ('addWord', ['caf\xc3\xa9']),
+                  # Separators of the text protocol are plain characters here:
+                  ('showMsg', ['a>b|c']),
+                  ('parDone', []),
+                  ('newPar', ['']),
+                  ];
+        self.assertEqual(events, decodeFrame(encodeEvents(events)));
+        # Unicode fields come back as UTF-8:
+        self.assertEqual([('addWord', [u'na\xefve → 漢字'.encode('utf-8')])],
+                         decodeFrame(encodeEvents([('addWord', [u'na\xefve → 漢字'])])));
+        for opName in OPCODES.keys():
+            self.assertEqual([(opName, ['1', '2'])], decodeFrame(encodeEvents([(opName, ['1', '2'])])));
+
+    def test_maxFieldLen(self):
+        longestField = 'w' * MAX_FIELD_LEN;
+        frame = encodeEvents([('showMsg', [longestField]), ('done', [])]);
+        self.assertEqual('\xff\xff', frame[3:5]);
+        self.assertEqual([('showMsg', [longestField]), ('done', [])], decodeFrame(frame));
+        self.assertRaises(ValueError, encodeEvents, [('showMsg', ['w' * (MAX_FIELD_LEN + 1)])]);
+        # The limit is in bytes of UTF-8, not in characters:
+        self.assertRaises(ValueError, encodeEvents, [('showMsg', [u'\xe9' * (MAX_FIELD_LEN // 2 + 1)])]);
+
+    def test_badFrames(self):
+        frame = encodeEvents([('addWord', ['hello'])]);
+        self.assertRaises(ValueError, decodeFrame, '');
+        # Other version:
+        self.assertRaises(ValueError, decodeFrame, chr(COMPACT_PROTOCOL_VERSION + 1) + frame[1:]);
+        # Truncated in the header, in the length, and in the field:
+        for frameLen in range(2, len(frame)):
+            self.assertRaises(ValueError, decodeFrame, frame[:frameLen]);
+        self.assertRaises(ValueError, decodeFrame, '\x01\xfe\x00');
+        self.assertRaises(ValueError, encodeEvents, [('noSuchOp', [])]);
+
+    def test_browserAgrees(self):
+        # manageExperiment.js must use the same version and opcodes:
+        scriptPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../browser_scripts/manageExperiment.js");
+        with open(scriptPath) as fd:
+            script = fd.read();
+        self.assertEqual(str(COMPACT_PROTOCOL_VERSION), re.search(r'var COMPACT_PROTOCOL_VERSION = (\d+);', script).group(1));
+        browserOpcodes = json.loads(re.search(r'var COMPACT_OPCODES = (\{[^}]*\});', script).group(1));
+        self.assertEqual(OPCODES, browserOpcodes);
+
+if __name__ == '__main__':
+    unittest.main()
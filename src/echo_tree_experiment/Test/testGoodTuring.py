@@ -0,0 +1,51 @@
+import unittest;
+
+from echo_tree_experiment.good_turing import simpleGoodTuring, goodTuringProbabilities, relativeFrequencies;
+
+# Frequencies of frequencies, and the 'r,p' lines that goodTuringSmoothing.c
+# prints for them, with probabilities rounded to four significant digits.
+
+# Turing estimates for the low frequencies:
+SMALL_FREQ_OF_FREQS = {1 : 268, 2 : 112, 3 : 70, 4 : 41, 5 : 24, 6 : 14, 7 : 15, 8 : 14, 9 : 6, 10 : 5};
+SMALL_EXPECTED = {0 : '0.1927', 1 : '0.0005722', 2 : '0.001027', 3 : '0.001674', 4 : '0.002337', 5 : '0.003008',
+                  6 : '0.003682', 7 : '0.004359', 8 : '0.005038', 9 : '0.005718', 10 : '0.006398'};
+
+# The prosody data of Gale & Sampson's paper; smoothed estimates throughout.
+# Only some of the frequencies are checked:
+PROSODY_FREQ_OF_FREQS = {1 : 120, 2 : 40, 3 : 24, 4 : 13, 5 : 15, 6 : 5, 7 : 11, 8 : 2, 9 : 2, 10 : 1, 12 : 3,
+                         14 : 2, 15 : 1, 16 : 1, 17 : 3, 19 : 1, 20 : 3, 21 : 2, 23 : 3, 24 : 3, 25 : 3, 26 : 2,
+                         27 : 2, 28 : 1, 31 : 2, 32 : 2, 33 : 1, 34 : 2, 36 : 2, 41 : 3, 43 : 1, 45 : 3, 46 : 1,
+                         47 : 1, 50 : 1, 71 : 1, 84 : 1, 101 : 1, 105 : 1, 121 : 1, 124 : 1, 146 : 1, 162 : 1,
+                         193 : 1, 199 : 1, 224 : 1, 226 : 1, 254 : 1, 257 : 1, 339 : 1, 421 : 1, 456 : 1, 481 : 1,
+                         483 : 1, 1140 : 1, 1256 : 1, 1322 : 1, 1530 : 1, 2131 : 1, 2395 : 1, 6925 : 1, 7846 : 1};
+PROSODY_EXPECTED = {0 : '0.003883', 1 : '2.468e-05', 2 : '5.522e-05', 3 : '8.672e-05', 4 : '0.0001186',
+                    5 : '0.0001506', 10 : '0.0003115', 50 : '0.001604', 1140 : '0.03685', 7846 : '0.2537'};
+
+
+class TestGoodTuring(unittest.TestCase):
+
+    def assertMatchesCTool(self, freqOfFreqs, expected):
+        (pZero, probabilities) = simpleGoodTuring(freqOfFreqs);
+        self.assertEqual(sorted(freqOfFreqs.keys()), sorted(probabilities.keys()));
+        for (freq, expectedProbability) in expected.items():
+            probability = pZero if freq == 0 else probabilities[freq];
+            self.assertEqual(expectedProbability, '%.4g' % probability, "Probability of frequency %d" % freq);
+
+    def test_turingEstimates(self):
+        self.assertMatchesCTool(SMALL_FREQ_OF_FREQS, SMALL_EXPECTED);
+
+    def test_smoothedEstimates(self):
+        self.assertMatchesCTool(PROSODY_FREQ_OF_FREQS, PROSODY_EXPECTED);
+
+    def test_estimator(self):
+        self.assertEqual(simpleGoodTuring(SMALL_FREQ_OF_FREQS)[1], goodTuringProbabilities(SMALL_FREQ_OF_FREQS));
+
+    def test_fewFrequencies(self):
+        # Four distinct frequencies are too few for the regression:
+        freqOfFreqs = {1 : 3, 2 : 1, 5 : 1, 9 : 1};
+        self.assertRaises(ValueError, simpleGoodTuring, freqOfFreqs);
+        self.assertEqual({1 : 1.0 / 19, 2 : 2.0 / 19, 5 : 5.0 / 19, 9 : 9.0 / 19}, goodTuringProbabilities(freqOfFreqs));
+        self.assertEqual(relativeFrequencies(freqOfFreqs), goodTuringProbabilities(freqOfFreqs));
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest;
+import os;
+import shutil;
+import tempfile;
+
+# The servers import the tornado copy in their own directory, so
+# they are imported the way they run, from that directory. The
+# server's Condition class reads a TreeTypes constant that
+# echo_tree_server does not define:
+import echo_tree_server;
+if not hasattr(echo_tree_server.TreeTypes, 'RECREATION_NGRAMS'):
+    echo_tree_server.TreeTypes.RECREATION_NGRAMS = echo_tree_server.TreeTypes.RECREATION_BIGRAMS;
+import echo_tree_experiment_server as server;
+from echo_tree_experiment_server import SessionSchedule, EchoTreeLogService, Role;
+
+
+class TestSessionSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp();
+        self.savedPaths = (server.PARTICIPANT_RECORDS_PATH, server.SCHEDULE_PATH, server.SCHEDULE_ROUNDS_LOG_PATH);
+        server.PARTICIPANT_RECORDS_PATH = os.path.join(self.tmpDir, 'participants.shelve');
+        server.SCHEDULE_PATH = os.path.join(self.tmpDir, 'sessionSchedule.pickle');
+        server.SCHEDULE_ROUNDS_LOG_PATH = os.path.join(self.tmpDir, 'sessionScheduleRounds.log');
+        self.resetSchedule();
+
+    def tearDown(self):
+        self.resetSchedule();
+        (server.PARTICIPANT_RECORDS_PATH, server.SCHEDULE_PATH, server.SCHEDULE_ROUNDS_LOG_PATH) = self.savedPaths;
+        shutil.rmtree(self.tmpDir);
+
+    def resetSchedule(self):
+        if SessionSchedule.roundsLogFD is not None:
+            SessionSchedule.roundsLogFD.close();
+        SessionSchedule.assignments = {};
+        SessionSchedule.roundsUsed = {};
+        SessionSchedule.generation = 0;
+        SessionSchedule.loadedMtime = None;
+        SessionSchedule.roundsLogFD = None;
+
+    def assertOppositeRoles(self, assignment1, assignment2):
+        self.assertEqual(set([Role.DISABLED, Role.PARTNER]), set([assignment1[0], assignment2[0]]));
+        self.assertEqual(assignment1[1], assignment2[1]);
+
+    def test_repeatedGetAssignment(self):
+        schedule = SessionSchedule.scheduleSession([('me', 'you')], numRounds=2);
+        # A player who asks again, say after reloading the page, gets the same round:
+        firstAnswer  = EchoTreeLogService.decideNewPlayersRoleAndCondition('me', 'you');
+        secondAnswer = EchoTreeLogService.decideNewPlayersRoleAndCondition('me', 'you');
+        friendAnswer = EchoTreeLogService.decideNewPlayersRoleAndCondition('you', 'me');
+        self.assertEqual(schedule[('me', 'you')][0], firstAnswer);
+        self.assertEqual(firstAnswer, secondAnswer);
+        self.assertOppositeRoles(secondAnswer, friendAnswer);
+        self.assertEqual(2, SessionSchedule.numRoundsLeft('me', 'you'));
+
+        # What handleGameDone() does once the game is played:
+        SessionSchedule.roundPlayed('me', 'you');
+        SessionSchedule.roundPlayed('you', 'me');
+        nextAnswer = EchoTreeLogService.decideNewPlayersRoleAndCondition('me', 'you');
+        self.assertEqual(nextAnswer, EchoTreeLogService.decideNewPlayersRoleAndCondition('me', 'you'));
+        self.assertOppositeRoles(nextAnswer, EchoTreeLogService.decideNewPlayersRoleAndCondition('you', 'me'));
+        self.assertNotEqual(firstAnswer[0], nextAnswer[0]);
+        self.assertEqual(1, SessionSchedule.numRoundsLeft('me', 'you'));
+
+        # The played rounds survive a restart:
+        self.resetSchedule();
+        self.assertEqual(nextAnswer, SessionSchedule.currentAssignment('me', 'you'));
+
+        SessionSchedule.roundPlayed('me', 'you');
+        SessionSchedule.roundPlayed('you', 'me');
+        self.assertIsNone(SessionSchedule.currentAssignment('me', 'you'));
+        self.assertEqual(0, SessionSchedule.numRoundsLeft('you', 'me'));
+
+if __name__ == '__main__':
+    unittest.main();
@@ -0,0 +1,43 @@
+import unittest;
+import os;
+import shutil;
+import sqlite3;
+import tempfile;
+
+from echo_tree_experiment.echo_tree import WordExplorer, ARITY;
+from echo_tree_experiment.stopword_free_followers import writeStopwordFreeFollowers;
+
+
+class TestStopwordFreeFollowers(unittest.TestCase):
+
+    def setUp(self):
+        currDir = os.path.dirname(os.path.realpath(__file__));
+        self.tmpDir = tempfile.mkdtemp();
+        self.dbFileName = os.path.join(self.tmpDir, "henryBlog.db");
+        shutil.copyfile(os.path.join(currDir, "../Resources/henryBlog.db"), self.dbFileName);
+        writeStopwordFreeFollowers(self.dbFileName);
+        conn = sqlite3.connect(self.dbFileName);
+        self.rootWords = [row[0] for row in conn.execute('SELECT DISTINCT word1 FROM Bigrams')];
+        conn.close();
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir);
+
+    def test_tablesMatchFiltering(self):
+        # Trees from the tables must equal the trees of an
+        # explorer that drops stopword followers itself:
+        for arity in [ARITY.BIGRAM, ARITY.TRIGRAM]:
+            tableExplorer = WordExplorer(self.dbFileName, skipStopwords=True);
+            self.assertEqual(10, tableExplorer.stopwordFreeTopK);
+            filteringExplorer = WordExplorer(self.dbFileName, skipStopwords=True);
+            filteringExplorer.stopwordFreeTopK = None;
+            changedRoots = [rootWord for rootWord in self.rootWords
+                            if tableExplorer.makeWordTree(rootWord, arity) != filteringExplorer.makeWordTree(rootWord, arity)];
+            self.assertEqual([], changedRoots, "%d of %d trees of arity %d differ." % (len(changedRoots), len(self.rootWords), arity));
+
+    def test_widerTreesRefused(self):
+        explorer = WordExplorer(self.dbFileName, skipStopwords=True);
+        self.assertRaises(ValueError, explorer.makeWordTree, 'my', ARITY.BIGRAM, maxBranch=11);
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+'''
+Tokenizer and sentence segmenter for plain text, in Python. Replaces
+tokenizeText.sh, which runs the Stanford Java tokenizer once per file.
+Tokens follow the Stanford (Penn Treebank) conventions that the rest
+of the pipeline relies on:
+
+   - Contractions are split off: "don't" --> "do", "n't"; "he'll" --> "he", "'ll".
+     TokenFromSentenceFeeder joins the "'ll" back onto its word.
+   - Punctuation characters are tokens of their own. Runs of '!' or '?',
+     and '...', are single tokens.
+   - Abbreviations (single letters, and the ones in ABBREVIATIONS) keep
+     their period, and do not end the sentence: "n.", "mr.", "u.s.".
+   - All kinds of brackets are escaped as -LRB- and -RRB-, slashes and asterisks
+     as \/ and \*, and double quotes become `` and ''.
+   - Sentences end after '.', or a run of '!' or '?', plus any further
+     such punctuation and closing quotes or brackets that follow. Newlines do not end sentences.
+   - Lower case month and day names are capitalized: "july" --> "July".
+   - Email separators, #/*383869*/!!!...!!!#^@, become the token sequence
+     that TokenFromSentenceFeeder.messageSepTest recognizes.
+
+Capitalization and stopwords are left alone; cleaning is up to the consumer.
+
+Run as a script, the module writes one <name>_Tokens.txt file per
+<name>.txt file, in the Stanford tokenizer's bracketed format, using
+a pool of worker processes:
+
+    text_tokenizer.py {textDir | textFile} [targetDir] [-p numWorkers]
+'''
+
+import os;
+import re;
+import sys;
+import glob;
+import argparse;
+import functools;
+import multiprocessing;
+
+# Lower case words that keep their trailing period:
+ABBREVIATIONS = frozenset(['mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'inc', 'ltd', 'co', 'corp',
+                           'vs', 'etc', 'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept',
+                           'oct', 'nov', 'dec', 'no', 'dept', 'est', 'approx']);
+
+# Capitalized when they occur in all lower case, as the Stanford tokenizer does:
+CAPITALIZED_WORDS = frozenset(['january', 'february', 'march', 'april', 'june', 'july', 'august', 'september',
+                               'october', 'november', 'december', 'monday', 'tuesday', 'wednesday', 'thursday',
+                               'friday', 'saturday', 'sunday']);
+
+# Contractions that are split off their word. "n't" is handled separately:
+CONTRACTION_PATTERN = re.compile(r"^(.+)('s|'re|'ve|'ll|'d|'m)$", re.IGNORECASE);
+
+# Words that start with an apostrophe, and are kept whole:
+LEADING_APOSTROPHE_WORDS = r"'(?:em|cause|tis|twas)(?![A-Za-z])";
+
+# The email separator; the number is the ID of the following email:
+EMAIL_SEP = r"#\s*/\s*\*\s*(?P<msgID>[0-9]+)\s*\*\s*/\s*!{36}\s*#\s*\^\s*@";
+
+WORD_CHARS = r"A-Za-z0-9\x80-\xff";
+
+TOKEN_PATTERN = re.compile('|'.join([
+    r"(?P<sep>%s)" % EMAIL_SEP,
+    # Numbers, including 3.5, 1,000, 10:30, and 12/25:
+    r"(?P<number>[0-9]+(?:[.,:/][0-9]+)*)(?![%s])" % WORD_CHARS,
+    # Dotted abbreviations, such as u.s. or e.g.:
+    r"(?P<dotted>(?:[A-Za-z]\.){2,})",
+    r"(?P<leading>%s)" % LEADING_APOSTROPHE_WORDS,
+    # Words, with inner apostrophes and hyphens, optionally followed by a period:
+    r"(?P<word>[%s]+(?:['-][%s]+)*)(?P<period>\.(?!\.))?" % (WORD_CHARS, WORD_CHARS),
+    r"(?P<ellipsis>\.\.\.+)",
+    r"(?P<bangs>[!?]+)",
+    r"(?P<dashes>--+)",
+    r"(?P<other>\S)",
+    ]));
+
+ESCAPES = {'(' : '-LRB-', ')' : '-RRB-',
+           '[' : '-LRB-', ']' : '-RRB-',
+           '{' : '-LRB-', '}' : '-RRB-',
+           '/' : '\\/',   '*' : '\\*'};
+
+# Tokens that belong to the sentence whose end they follow:
+SENTENCE_CLOSERS = frozenset(["''", "'", '-RRB-']);
+
+def splitContraction(word):
+    '''
+    Split a word into the word proper and its contraction, if any.
+    @param word: a word token
+    @type word: string
+    @return: one or two tokens
+    @rtype: [string]
+    '''
+    if len(word) > 3 and word[-3:].lower() == "n't":
+        return [word[:-3], word[-3:]];
+    if word.lower() == 'cannot':
+        return [word[:3], word[3:]];
+    if word in CAPITALIZED_WORDS:
+        return [word.capitalize()];
+    matchObj = CONTRACTION_PATTERN.match(word);
+    if matchObj is not None:
+        return [matchObj.group(1), matchObj.group(2)];
+    return [word];
+
+def escape(token):
+    if token in ESCAPES:
+        return ESCAPES[token];
+    return token.replace('/', '\\/').replace('*', '\\*');
+
+def tokenizeText(text):
+    '''
+    Tokenize text, and segment it into sentences.
+    @param text: the text
+    @type text: string
+    @return: the sentences, each a list of tokens.
+    @rtype: [[string]]
+    '''
+    sentences = [];
+    sentence = [];
+    sentenceEnded = False;
+    for matchObj in TOKEN_PATTERN.finditer(text):
+        kind = matchObj.lastgroup;
+        if kind == 'period':
+            # The period after a word is the last group that matched:
+            kind = 'word';
+        token = matchObj.group(0);
+        # Closers, further sentence-final punctuation ("?."), and possibly 
+        # a closing double quote still belong to an ended sentence:
+        if sentenceEnded and not (kind == 'other' and escape(token) in SENTENCE_CLOSERS) and \
+                token != '"' and token != '.' and kind != 'bangs':
+            sentences.append(sentence);
+            sentence = [];
+            sentenceEnded = False;
+        if kind == 'sep':
+            sentence.extend(['#', '\\/', '\\*', matchObj.group('msgID'), '\\*', '\\/', '!' * 36, '#', '^', '@']);
+        elif kind == 'word':
+            word = matchObj.group('word');
+            period = matchObj.group('period');
+            if period is not None and (len(word) == 1 or word.lower() in ABBREVIATIONS):
+                sentence.append(word + period);
+            else:
+                sentence.extend(splitContraction(word));
+                if period is not None:
+                    sentence.append(period);
+                    sentenceEnded = True;
+        elif kind == 'bangs':
+            sentence.append(token);
+            sentenceEnded = True;
+        elif token == '.':
+            sentence.append(token);
+            sentenceEnded = True;
+        elif token == '"':
+            start = matchObj.start();
+            if start == 0 or text[start - 1].isspace() or text[start - 1] in '([{':
+                if sentenceEnded:
+                    sentences.append(sentence);
+                    sentence = [];
+                    sentenceEnded = False;
+                sentence.append('``');
+            else:
+                sentence.append("''");
+        else:
+            sentence.append(escape(token));
+    if len(sentence) > 0:
+        sentences.append(sentence);
+    return sentences;
+
+def iterFileSentences(textFilePaths):
+    '''
+    Tokenize the given text files, one after the other.
+    Sentences never span files.
+    @param textFilePaths: paths of the text files
+    @type textFilePaths: [string]
+    @return: iterator over sentences, each a list of tokens.
+    @rtype: iterator
+    '''
+    for textFilePath in textFilePaths:
+        with open(textFilePath) as fd:
+            text = fd.read();
+        for sentence in tokenizeText(text):
+            yield sentence;
+
+def formatSentences(sentences):
+    '''
+    Render sentences in the Stanford tokenizer's output format:
+    "[It, was, just, ...][Next, sentence, .]"
+    @param sentences: the sentences, each a list of tokens.
+    @type sentences: [[string]]
+    @rtype: string
+    '''
+    return ''.join(['[' + ', '.join(sentence) + ']' for sentence in sentences]);
+
+def tokenFilePath(textFilePath, outDir):
+    '''
+    @return: path of the token file for the given text file:
+             its basename, with '_Tokens' appended, in outDir.
+    @rtype: string
+    '''
+    (baseName, extension) = os.path.splitext(os.path.basename(textFilePath));
+    return os.path.join(outDir, baseName + '_Tokens' + extension);
+
+def tokenizeFile(textFilePath, outDir):
+    '''
+    Worker for tokenizeFiles(): tokenize one text file into its token file.
+    @return: path of the token file
+    @rtype: string
+    '''
+    with open(textFilePath) as fd:
+        text = fd.read();
+    outPath = tokenFilePath(textFilePath, outDir);
+    with open(outPath, 'w') as fd:
+        fd.write(formatSentences(tokenizeText(text)));
+    return outPath;
+
+def tokenizeFiles(textFilePaths, outDir, numWorkers=None):
+    '''
+    Tokenize text files into token files, in a pool of worker processes.
+    @param textFilePaths: paths of the text files
+    @type textFilePaths: [string]
+    @param outDir: directory for the token files
+    @type outDir: string
+    @param numWorkers: number of worker processes. None: one per CPU.
+    @type numWorkers: int
+    @return: paths of the token files, in the order of textFilePaths.
+    @rtype: [string]
+    '''
+    pool = multiprocessing.Pool(numWorkers);
+    try:
+        return pool.map(functools.partial(tokenizeFile, outDir=outDir), textFilePaths);
+    finally:
+        pool.close();
+        pool.join();
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog='text_tokenizer');
+    parser.add_argument("source", help="a .txt file, or a directory of .txt files, to tokenize.");
+    parser.add_argument("targetDir", nargs='?',
+                        help="directory for the _Tokens.txt files; created if needed. Default: next to the source files.");
+    parser.add_argument("-p", "--processes", type=int, dest='numWorkers',
+                        help="number of worker processes. Default: one per CPU.");
+    args = parser.parse_args();
+
+    if os.path.isdir(args.source):
+        srcFiles = sorted(glob.glob(os.path.join(args.source, '*.txt')));
+        outDir = args.source;
+    elif os.path.isfile(args.source):
+        srcFiles = [args.source];
+        outDir = os.path.dirname(args.source);
+    else:
+        print("No file or directory named '%s' exists." % args.source);
+        sys.exit();
+    if args.targetDir is not None:
+        outDir = args.targetDir;
+        if not os.path.isdir(outDir):
+            os.makedirs(outDir);
+    tokenizeFiles(srcFiles, outDir, args.numWorkers);
@@ -5,6 +5,11 @@
 # of .txt files. Optionally: provide output directory. By default
 # results are stored in the input directory. All files will have
 # '_tokens' appended to their basename.
+#
+# text_tokenizer.py in this directory produces the same output
+# in Python, without starting a JVM per run, and
+# make_database_from_emails.py --rawText tokenizes in process
+# without writing token files at all.
 
 USAGE="Usage: tokenizeText.sh {textDir | textFile} [targetDir]"
 
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+'''
+Pre-tokenized binary corpus. Parsing the bracketed token files, and
+finding the email separators in them, is done once, by a conversion.
+Later runs load flat integer arrays instead.
+
+A corpus is a directory with these files:
+
+    corpus.json      Metadata: format version, view, byte order, sizes,
+                     and the token files the corpus was made from.
+    vocab.txt        One word per line, string_escape encoded. The line
+                     number is the word's ID. Words are in order of
+                     first appearance.
+    tokens.int32     Word ID of each token.
+    sentences.int32  Token offset at which each sentence starts, plus
+                     the total number of tokens.
+    emails.int32     Token offset at which each run of tokens with the
+                     same email ID starts, plus the total number of tokens.
+    emailIDs.int32   The email ID of each of those runs.
+    files.int32      Sentence offset at which each source file starts,
+                     plus the total number of sentences.
+
+All arrays are int32, in the byte order recorded in corpus.json.
+corpus.json is written last, so a directory holds a corpus only
+once its conversion has finished.
+
+The DB builder and the evaluator tokenize differently, so each
+corpus holds the tokens as one of them sees them (its 'view'):
+
+    BUILDER_VIEW    Tokens as TokenFeeder hands them out: cleaned,
+                    stopwords removed, contractions joined, email
+                    IDs taken from the email separators.
+    EVALUATOR_VIEW  Tokens as Evaluator.readSentences() splits them;
+                    the email ID of each token file's tokens is the
+                    file's checksum.
+'''
+
+import os;
+import sys;
+import json;
+from array import array;
+
+from ngram_counts import Vocabulary;
+
+BUILDER_VIEW = 'builder';
+EVALUATOR_VIEW = 'evaluator';
+
+FORMAT_VERSION = 1;
+
+META_FILE = 'corpus.json';
+VOCAB_FILE = 'vocab.txt';
+TOKENS_FILE = 'tokens.int32';
+SENTENCES_FILE = 'sentences.int32';
+EMAILS_FILE = 'emails.int32';
+EMAIL_IDS_FILE = 'emailIDs.int32';
+FILES_FILE = 'files.int32';
+
+# Array type code of the int32 arrays. C int is 32 bits
+# on all platforms we run on:
+INT32 = 'i';
+
+# Largest token or sentence offset an int32 array can hold:
+MAX_OFFSET = (1 << 31) - 1;
+
+# Token IDs buffered before they are written out during conversion:
+WRITE_BLOCK_TOKENS = 1 << 20;
+
+def isBinaryCorpus(corpusDir):
+    '''
+    @return: True if the given directory holds a finished binary corpus.
+    @rtype: boolean
+    '''
+    return os.path.isfile(os.path.join(corpusDir, META_FILE));
+
+# ------------------------------- class BinaryCorpusWriter ---------------------
+
+class BinaryCorpusWriter(object):
+    '''
+    Writes a binary corpus from a stream of tokens. Usage:
+        writer = BinaryCorpusWriter(corpusDir, BUILDER_VIEW);
+        for tokenFilePath in tokenFilePaths:
+            writer.startFile(tokenFilePath);
+            for token in ...:
+                writer.addToken(token.word, token.sentenceID, token.emailID);
+        writer.finish();
+    '''
+
+    def __init__(self, corpusDir, view):
+        '''
+        @param corpusDir: directory for the corpus. Created if it does not exist.
+                          A corpus that is already there is replaced.
+        @type corpusDir: string
+        @param view: BUILDER_VIEW or EVALUATOR_VIEW
+        @type view: string
+        '''
+        if view not in (BUILDER_VIEW, EVALUATOR_VIEW):
+            raise ValueError("Corpus view must be '%s' or '%s'. Got '%s'." % (BUILDER_VIEW, EVALUATOR_VIEW, view));
+        if not os.path.isdir(corpusDir):
+            os.makedirs(corpusDir);
+        self.corpusDir = corpusDir;
+        self.view = view;
+        # Until finish() is done, the directory must not look like a corpus:
+        if isBinaryCorpus(corpusDir):
+            os.remove(os.path.join(corpusDir, META_FILE));
+        self.vocab = Vocabulary();
+        self.sentenceStarts = array(INT32);
+        self.emailStarts = array(INT32);
+        self.emailIDs = array(INT32);
+        self.fileStarts = array(INT32);
+        self.sourceFiles = [];
+        self.tokenBlock = array(INT32);
+        self.numTokens = 0;
+        self.prevSentenceID = None;
+        self.prevEmailID = None;
+        self.tokenFD = open(os.path.join(corpusDir, TOKENS_FILE), 'wb');
+
+    def startFile(self, sourceFile):
+        '''
+        Start the tokens of the next source file. Sentences never span files.
+        @param sourceFile: path of the token file
+        @type sourceFile: string
+        '''
+        self.sourceFiles.append(sourceFile);
+        self.fileStarts.append(len(self.sentenceStarts));
+        self.prevSentenceID = None;
+
+    def addToken(self, word, sentenceID, emailID):
+        '''
+        Append one token. A new sentence starts whenever sentenceID
+        differs from the previous token's; likewise for emails.
+        @param word: the token
+        @type word: string
+        @param sentenceID: ID of the token's sentence
+        @type sentenceID: int
+        @param emailID: ID of the token's email
+        @type emailID: int
+        '''
+        if len(self.sourceFiles) == 0:
+            raise ValueError("Call startFile() before adding tokens.");
+        if self.numTokens >= MAX_OFFSET:
+            raise ValueError("Binary corpora hold at most %d tokens." % MAX_OFFSET);
+        if sentenceID != self.prevSentenceID or self.prevSentenceID is None:
+            self.sentenceStarts.append(self.numTokens);
+            self.prevSentenceID = sentenceID;
+        if emailID != self.prevEmailID:
+            self.emailStarts.append(self.numTokens);
+            self.emailIDs.append(emailID);
+            self.prevEmailID = emailID;
+        self.tokenBlock.append(self.vocab.intern(word));
+        self.numTokens += 1;
+        if len(self.tokenBlock) >= WRITE_BLOCK_TOKENS:
+            self.tokenBlock.tofile(self.tokenFD);
+            self.tokenBlock = array(INT32);
+
+    def finish(self):
+        '''
+        Write the offset arrays, the vocabulary, and finally the metadata.
+        '''
+        self.tokenBlock.tofile(self.tokenFD);
+        self.tokenFD.close();
+        self.fileStarts.append(len(self.sentenceStarts));
+        self.sentenceStarts.append(self.numTokens);
+        self.emailStarts.append(self.numTokens);
+        for (fileName, offsets) in ((SENTENCES_FILE, self.sentenceStarts),
+                                    (EMAILS_FILE, self.emailStarts),
+                                    (EMAIL_IDS_FILE, self.emailIDs),
+                                    (FILES_FILE, self.fileStarts)):
+            with open(os.path.join(self.corpusDir, fileName), 'wb') as fd:
+                offsets.tofile(fd);
+        with open(os.path.join(self.corpusDir, VOCAB_FILE), 'wb') as fd:
+            for word in self.vocab.words:
+                fd.write(word.encode('string_escape') + '\n');
+        meta = {'formatVersion' : FORMAT_VERSION,
+                'view'          : self.view,
+                'byteOrder'     : sys.byteorder,
+                'numWords'      : len(self.vocab),
+                'numTokens'     : self.numTokens,
+                'numSentences'  : len(self.sentenceStarts) - 1,
+                'numEmailRuns'  : len(self.emailIDs),
+                'sourceFiles'   : self.sourceFiles};
+        with open(os.path.join(self.corpusDir, META_FILE), 'w') as fd:
+            json.dump(meta, fd, indent=2);
+
+    def abort(self):
+        '''
+        Close the token file, and leave the directory without a corpus.
+        '''
+        self.tokenFD.close();
+        os.remove(os.path.join(self.corpusDir, TOKENS_FILE));
+
+# ------------------------------- class BinaryCorpus ---------------------
+
+class BinaryCorpus(object):
+    '''
+    A binary corpus, loaded into memory. The arrays are public:
+
+        words           Word of each word ID.
+        tokenIDs        Word ID of each token.
+        sentenceStarts  Token offset of each sentence; one extra entry at the end.
+        emailStarts     Token offset of each email run; one extra entry at the end.
+        emailIDs        Email ID of each email run.
+        fileStarts      Sentence offset of each source file; one extra entry at the end.
+        sourceFiles     Path of each source file, as given to the conversion.
+    '''
+
+    def __init__(self, corpusDir, view=None):
+        '''
+        @param corpusDir: directory holding the corpus.
+        @type corpusDir: string
+        @param view: if provided, the view the corpus must hold.
+        @type view: string
+        @raise ValueError: if the directory holds no corpus, a corpus
+                           of another view or format version, or a
+                           truncated one.
+        '''
+        if not isBinaryCorpus(corpusDir):
+            raise ValueError("Directory %s holds no binary corpus." % corpusDir);
+        self.corpusDir = corpusDir;
+        with open(os.path.join(corpusDir, META_FILE)) as fd:
+            meta = json.load(fd);
+        if meta['formatVersion'] != FORMAT_VERSION:
+            raise ValueError("Binary corpus %s has format version %s; can only read version %d." %
+                             (corpusDir, meta['formatVersion'], FORMAT_VERSION));
+        self.view = meta['view'];
+        if view is not None and self.view != view:
+            raise ValueError("Binary corpus %s holds the %s view of its tokens, not the %s view." % (corpusDir, self.view, view));
+        # JSON hands back unicode; the rest of the code works with byte strings:
+        self.sourceFiles = [str(sourceFile) for sourceFile in meta['sourceFiles']];
+
+        with open(os.path.join(corpusDir, VOCAB_FILE), 'rb') as fd:
+            self.words = [line.decode('string_escape') for line in fd.read().split('\n')[:-1]];
+        if len(self.words) != meta['numWords']:
+            raise ValueError("Vocabulary of binary corpus %s is truncated." % corpusDir);
+        self.tokenIDs = self.readArray(TOKENS_FILE, meta['numTokens']);
+        self.sentenceStarts = self.readArray(SENTENCES_FILE, meta['numSentences'] + 1);
+        self.emailStarts = self.readArray(EMAILS_FILE, meta['numEmailRuns'] + 1);
+        self.emailIDs = self.readArray(EMAIL_IDS_FILE, meta['numEmailRuns']);
+        self.fileStarts = self.readArray(FILES_FILE, len(self.sourceFiles) + 1);
+        if meta['byteOrder'] != sys.byteorder:
+            for offsets in (self.tokenIDs, self.sentenceStarts, self.emailStarts, self.emailIDs, self.fileStarts):
+                offsets.byteswap();
+
+    def __len__(self):
+        return len(self.tokenIDs);
+
+    def readArray(self, fileName, numItems):
+        result = array(INT32);
+        with open(os.path.join(self.corpusDir, fileName), 'rb') as fd:
+            try:
+                result.fromfile(fd, numItems);
+            except EOFError:
+                raise ValueError("File %s of binary corpus %s is truncated." % (fileName, self.corpusDir));
+        return result;
+
+    def getFileIndex(self, sourceFile):
+        '''
+        @param sourceFile: path of a source file, as given to the conversion.
+        @type sourceFile: string
+        @return: index of the file in sourceFiles
+        @rtype: int
+        @raise ValueError: if the corpus was not made from that file.
+        '''
+        try:
+            return self.sourceFiles.index(sourceFile);
+        except ValueError:
+            raise ValueError("Binary corpus %s does not hold file %s." % (self.corpusDir, sourceFile));
+
+    def iterSentenceIDs(self, fileIndexes=None):
+        '''
+        Iterate over the sentences of the given source files, as word IDs.
+        @param fileIndexes: indexes into sourceFiles. None: all files, in order.
+        @type fileIndexes: [int]
+        @return: iterator over (fileIndex, array of word IDs)
+        @rtype: iterator
+        '''
+        if fileIndexes is None:
+            fileIndexes = xrange(len(self.sourceFiles));
+        for fileIndex in fileIndexes:
+            for sentenceIndex in xrange(self.fileStarts[fileIndex], self.fileStarts[fileIndex + 1]):
+                yield (fileIndex, self.tokenIDs[self.sentenceStarts[sentenceIndex]:self.sentenceStarts[sentenceIndex + 1]]);
+
+    def iterSentences(self, fileIndexes=None):
+        '''
+        Like iterSentenceIDs(), but each sentence is a new list of words.
+        @return: iterator over (fileIndex, [word])
+        @rtype: iterator
+        '''
+        words = self.words;
+        for (fileIndex, wordIDs) in self.iterSentenceIDs(fileIndexes):
+            yield (fileIndex, [words[wordID] for wordID in wordIDs]);
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+'''
+Compacts an n-gram database for serving. Trees are built from each
+word's first WORD_TREE_BREADTH followers, in the order in which
+WordFollower reads them, so everything after a word's top K followers
+is never served. The compacted database keeps:
+
+   - the top K followers of each word1, in WordFollower's order,
+     except for words with non-ASCII characters, which WordFollower
+     strips from the words it looks up,
+   - optionally, only n-grams seen at least minCount times (minCount 2
+     drops singletons; needs the count tables that the builder writes),
+   - optionally, instead of each REAL probability, its rank among the
+     table's distinct probabilities, quantized to 8 or 16 bits. SQLite
+     stores such small integers in one or two bytes instead of eight.
+
+The schema and the indexes are the source database's, so WordDatabase
+and WordFollower use the result as is. The count tables and the list
+of ingested chunk files are not copied, so a compacted database cannot
+be updated incrementally; compact the updated source instead. The model
+version is copied. The stopword-free follower tables are not; write
+them into the compacted database with stopword_free_followers.py.
+
+Run as a script, the module compacts a database, and reports the
+sizes of both files and how many trees changed:
+
+    compact_model.py srcDb dstDb [-k topK] [-c minCount] [-q {8,16}] [-n numTrees]
+'''
+
+import os;
+import sys;
+import time;
+import sqlite3;
+import argparse;
+
+from ngram_database import NGRAM_TABLES, BULK_LOAD_PRAGMAS, INSERT_BATCH_ROWS, selectTopFollowers, copyIndexes;
+from echo_tree import WordExplorer, WORD_TREE_BREADTH, ARITY;
+
+# Supported quantizations of probabilities, in bits:
+QUANTIZE_BITS = [8, 16];
+
+# Default number of root words whose trees are compared:
+DEFAULT_TREES_COMPARED = 500;
+
+def quantizedRanks(probabilities, numBits):
+    '''
+    Map probabilities to signed integers of numBits bits that keep their
+    order. If there are no more distinct probabilities than numBits can
+    encode, each gets its own rank, and no order is lost. Otherwise,
+    neighboring probabilities share ranks.
+    @param probabilities: the distinct probabilities
+    @type probabilities: set(float)
+    @param numBits: 8 or 16
+    @type numBits: int
+    @return: maps each probability to its rank
+    @rtype: {float : int}
+    '''
+    levels = sorted(probabilities);
+    numRanks = 1 << numBits;
+    # Signed ranks, because SQLite stores -128..127 in one byte, and -32768..32767 in two:
+    lowestRank = -(numRanks >> 1);
+    if len(levels) <= numRanks:
+        return dict((probability, lowestRank + level) for (level, probability) in enumerate(levels));
+    return dict((probability, lowestRank + level * numRanks // len(levels)) for (level, probability) in enumerate(levels));
+
+def compactModel(srcDbPath, dstDbPath, topK=WORD_TREE_BREADTH, minCount=1, quantizeBits=None, progressLogger=None):
+    '''
+    Write a compacted copy of an n-gram database.
+    @param srcDbPath: database to compact. Not modified.
+    @type srcDbPath: string
+    @param dstDbPath: path of the compacted database. Replaced if it exists.
+    @type dstDbPath: string
+    @param topK: number of followers kept per word1. At least WORD_TREE_BREADTH.
+    @type topK: int
+    @param minCount: drop n-grams seen fewer than this many times.
+    @type minCount: int
+    @param quantizeBits: if provided, 8 or 16: store quantized probability ranks.
+    @type quantizeBits: int
+    @param progressLogger: if provided, called with progress messages.
+    @type progressLogger: callable
+    @return: maps each n-gram table name to (rows in source, rows kept).
+    @rtype: {string : (int, int)}
+    @raise ValueError: for a topK below WORD_TREE_BREADTH, an unsupported
+                       quantization, or a minCount without count tables.
+    '''
+    if topK < WORD_TREE_BREADTH:
+        raise ValueError("Must keep at least the %d followers per word that trees are built from; got %d." % (WORD_TREE_BREADTH, topK));
+    if quantizeBits is not None and quantizeBits not in QUANTIZE_BITS:
+        raise ValueError("Probabilities can be quantized to %s bits; got %s." % (QUANTIZE_BITS, quantizeBits));
+    if not os.path.exists(srcDbPath):
+        raise IOError("Database %s does not exist." % srcDbPath);
+    log = progressLogger if progressLogger is not None else lambda msg: None;
+    srcConn = sqlite3.connect(srcDbPath);
+    srcConn.text_factory = str;
+    schema = dict(srcConn.execute("SELECT name, sql FROM sqlite_master WHERE type='table'").fetchall());
+    tmpPath = dstDbPath + '.tmp';
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath);
+    dstConn = sqlite3.connect(tmpPath);
+    dstConn.text_factory = str;
+    try:
+        for pragma in BULK_LOAD_PRAGMAS:
+            dstConn.execute(pragma);
+        rowCounts = {};
+        for arity in sorted(NGRAM_TABLES.keys()):
+            (tableName, countTableName, wordColumns, indexStatements) = NGRAM_TABLES[arity];
+            if tableName not in schema:
+                continue;
+            if minCount > 1 and countTableName not in schema:
+                raise ValueError("Database %s has no %s table, so n-grams cannot be pruned by count." % (srcDbPath, countTableName));
+            startTime = time.time();
+            isKept = makeCountFilter(srcConn, countTableName, wordColumns, minCount) if minCount > 1 else None;
+            rows = selectTopFollowers(srcConn, tableName, wordColumns, topK, isKept);
+            if quantizeBits is not None:
+                ranks = quantizedRanks(set([row[0] for row in rows]), quantizeBits);
+                rows = [(ranks[row[0]],) + row[1:] for row in rows];
+                log("Quantized %d distinct probabilities in %s to %d bit ranks." % (len(ranks), tableName, quantizeBits));
+            createStatement = schema[tableName];
+            if quantizeBits is not None:
+                createStatement = createStatement.replace('probability real', 'probability integer');
+            dstConn.execute(createStatement);
+            insertStatement = 'INSERT INTO %s (probability, %s) VALUES (%s)' % (tableName, ', '.join(wordColumns), ','.join(['?'] * (arity + 1)));
+            for batchStart in xrange(0, len(rows), INSERT_BATCH_ROWS):
+                dstConn.executemany(insertStatement, rows[batchStart:batchStart + INSERT_BATCH_ROWS]);
+            # Same indexes as the source, so that followers with equal
+            # probabilities come back in the same order:
+            copyIndexes(srcConn, dstConn, tableName);
+            rowCounts[tableName] = (srcConn.execute('SELECT COUNT(*) FROM %s' % tableName).fetchone()[0], len(rows));
+            log("Kept %d of %d rows of %s in %.1f sec." % (rowCounts[tableName][1], rowCounts[tableName][0], tableName, time.time() - startTime));
+        dstConn.execute('PRAGMA user_version=%d' % srcConn.execute('PRAGMA user_version').fetchone()[0]);
+        dstConn.execute('ANALYZE');
+        dstConn.commit();
+        dstConn.close();
+        dstConn = None;
+        os.rename(tmpPath, dstDbPath);
+    finally:
+        srcConn.close();
+        if dstConn is not None:
+            dstConn.close();
+            os.remove(tmpPath);
+    return rowCounts;
+
+def makeCountFilter(conn, countTableName, wordColumns, minCount):
+    '''
+    Make a keep-predicate for ngram_database.selectTopFollowers() that
+    leaves out n-grams seen fewer than minCount times. The counts are
+    read once per word1.
+    @return: the predicate
+    @rtype: callable
+    '''
+    countsQuery = 'SELECT %s, ngramCount FROM %s WHERE word1=?' % (', '.join(wordColumns[1:]), countTableName);
+    # word1 --> {followers : count}, for the latest word1 only:
+    countsOfWord = {};
+    def isFrequent(word1, followers):
+        if word1 not in countsOfWord:
+            countsOfWord.clear();
+            countsOfWord[word1] = dict((tuple(row[:-1]), row[-1]) for row in conn.execute(countsQuery, (word1,)));
+        return countsOfWord[word1].get(followers, 0) >= minCount;
+    return isFrequent;
+
+def countChangedTrees(srcDbPath, dstDbPath, arity, rootWords):
+    '''
+    Build the tree of each root word from both databases, and count
+    the trees that differ.
+    @param srcDbPath: the original database
+    @type srcDbPath: string
+    @param dstDbPath: the compacted database
+    @type dstDbPath: string
+    @param arity: ARITY.BIGRAM or ARITY.TRIGRAM
+    @type arity: int
+    @param rootWords: words whose trees are compared
+    @type rootWords: [string]
+    @return: number of root words whose trees differ
+    @rtype: int
+    '''
+    srcExplorer = WordExplorer(srcDbPath);
+    dstExplorer = WordExplorer(dstDbPath);
+    numChanged = 0;
+    for rootWord in rootWords:
+        if srcExplorer.makeWordTree(rootWord, arity) != dstExplorer.makeWordTree(rootWord, arity):
+            numChanged += 1;
+    return numChanged;
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog='compact_model');
+    parser.add_argument("srcDbPath", help="n-gram database to compact.");
+    parser.add_argument("dstDbPath", help="path of the compacted database (gets overwritten).");
+    parser.add_argument("-k", "--topK", type=int, dest='topK', default=WORD_TREE_BREADTH,
+                        help="followers to keep per word. At least, and by default, %d." % WORD_TREE_BREADTH);
+    parser.add_argument("-c", "--minCount", type=int, dest='minCount', default=1,
+                        help="drop n-grams seen fewer times than this; 2 drops singletons. Needs the count tables. Default: 1.");
+    parser.add_argument("-q", "--quantize", type=int, choices=QUANTIZE_BITS, dest='quantizeBits',
+                        help="store probabilities as ranks of this many bits.");
+    parser.add_argument("-n", "--numTrees", type=int, dest='numTrees', default=DEFAULT_TREES_COMPARED,
+                        help="compare the trees of this many root words. Default: %d." % DEFAULT_TREES_COMPARED);
+    args = parser.parse_args();
+
+    def printMsg(msg):
+        print msg;
+
+    try:
+        rowCounts = compactModel(args.srcDbPath, args.dstDbPath, topK=args.topK, minCount=args.minCount,
+                                 quantizeBits=args.quantizeBits, progressLogger=printMsg);
+    except (ValueError, IOError) as e:
+        print("Error: %s" % e);
+        sys.exit(1);
+    srcSize = os.path.getsize(args.srcDbPath);
+    dstSize = os.path.getsize(args.dstDbPath);
+    print("Database size: %.1f MB --> %.1f MB (%.0f%%)." % (srcSize / 1048576.0, dstSize / 1048576.0, 100.0 * dstSize / srcSize));
+    conn = sqlite3.connect(args.srcDbPath);
+    conn.text_factory = str;
+    rootWords = [row[0] for row in conn.execute('SELECT DISTINCT word1 FROM Bigrams ORDER BY word1 LIMIT ?', (args.numTrees,))];
+    conn.close();
+    for (arity, tableName) in [(ARITY.BIGRAM, 'Bigrams'), (ARITY.TRIGRAM, 'Trigrams')]:
+        if tableName in rowCounts:
+            print("%s trees that changed: %d of %d." % (tableName[:-1], countChangedTrees(args.srcDbPath, args.dstDbPath, arity, rootWords), len(rootWords)));
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+'''
+Compact binary encoding of the experiment server's WebSocket messages.
+The text protocol sends one frame per message, of the form
+opCode>arg1|arg2. The compact protocol packs any number of messages
+('events') into a single binary frame:
+
+    frame := version event*
+    event := opCode numFields field*
+    field := length bytes
+
+version, opCode, and numFields are unsigned bytes. A field's length
+is an unsigned 16 bit big-endian integer, followed by that many bytes
+of UTF-8 text. Fields are never split on separator characters, so
+words may contain '>' or '|'.
+
+Browser and server agree on the compact protocol during the test/sendLogin
+handshake. Browsers that do not offer it, and connections whose WebSocket
+version cannot carry binary frames, keep using the text protocol.
+'''
+
+import struct;
+
+# Version byte that starts every compact frame. Bump when the
+# opcode table or the frame layout change:
+COMPACT_PROTOCOL_VERSION = 1;
+
+# Longest field that fits the 16 bit length prefix:
+MAX_FIELD_LEN = 0xFFFF;
+
+# Numeric opcodes. Keep in sync with COMPACT_OPCODES in manageExperiment.js:
+OPCODES = {
+           'test'             : 1,
+           'sendLogin'        : 2,
+           'login'            : 3,
+           'addWord'          : 4,
+           'goodGuessClicked' : 5,
+           'parDone'          : 6,
+           'newPar'           : 7,
+           'showMsg'          : 8,
+           'waitForPlayer'    : 9,
+           'dyadComplete'     : 10,
+           'subscribeToTree'  : 11,
+           'newAssignment'    : 12,
+           'done'             : 13,
+           'pleaseClose'      : 14,
+           };
+OPCODE_NAMES = dict((opCode, opName) for (opName, opCode) in OPCODES.items());
+
+_headerStruct = struct.Struct('>BB');
+_lengthStruct = struct.Struct('>H');
+
+def encodeEvents(events):
+    '''
+    Pack a sequence of events into one compact frame.
+    @param events: sequence of (opName, [field1, field2, ...]). Fields
+                   are str (UTF-8) or unicode.
+    @type events: [(string, [string])]
+    @return: the frame, ready to be sent as a binary WebSocket message.
+    @rtype: string
+    @raise ValueError: if an opName is unknown, or a field is too long.
+    '''
+    parts = [chr(COMPACT_PROTOCOL_VERSION)];
+    for (opName, fields) in events:
+        try:
+            opCode = OPCODES[opName];
+        except KeyError:
+            raise ValueError("Opcode '%s' has no compact encoding." % opName);
+        parts.append(_headerStruct.pack(opCode, len(fields)));
+        for field in fields:
+            if isinstance(field, unicode):
+                field = field.encode('utf-8');
+            if len(field) > MAX_FIELD_LEN:
+                raise ValueError("Field of '%s' is %d bytes long; maximum is %d." % (opName, len(field), MAX_FIELD_LEN));
+            parts.append(_lengthStruct.pack(len(field)));
+            parts.append(field);
+    return ''.join(parts);
+
+def decodeFrame(frame):
+    '''
+    Unpack a compact frame into its events.
+    @param frame: binary WebSocket message
+    @type frame: string
+    @return: list of (opName, [field1, field2, ...]). Fields are UTF-8 str.
+    @rtype: [(string, [string])]
+    @raise ValueError: if the frame is truncated, has an unsupported
+                       version, or contains an unknown opcode.
+    '''
+    if len(frame) == 0:
+        raise ValueError("Empty compact frame.");
+    version = ord(frame[0]);
+    if version != COMPACT_PROTOCOL_VERSION:
+        raise ValueError("Compact protocol version %d not supported." % version);
+    events = [];
+    pos = 1;
+    frameLen = len(frame);
+    try:
+        while pos < frameLen:
+            (opCode, numFields) = _headerStruct.unpack_from(frame, pos);
+            pos += 2;
+            fields = [];
+            for fieldNum in range(numFields):
+                fieldLen = _lengthStruct.unpack_from(frame, pos)[0];
+                pos += 2;
+                if pos + fieldLen > frameLen:
+                    raise ValueError("Compact frame truncated inside a field.");
+                fields.append(frame[pos:pos + fieldLen]);
+                pos += fieldLen;
+            try:
+                events.append((OPCODE_NAMES[opCode], fields));
+            except KeyError:
+                raise ValueError("Unknown compact opcode %d." % opCode);
+    except struct.error:
+        raise ValueError("Compact frame truncated.");
+    return events;
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+'''
+Crash recovery for the experiment server's live game state.
+
+Every change to a dyad or to one of its paragraph scores is recorded
+as a small delta. Recording only appends the delta to an in-memory
+list, so callers on the IOLoop never touch the disk. A background
+writer thread periodically appends the pending deltas to a journal
+file (one JSON list per line), and applies them to its own copy of
+the game state. Every compactEvery deltas, the writer dumps that
+copy to a snapshot file, and starts a fresh journal. Since the copy
+belongs to the writer thread, compaction needs no cooperation from
+the IOLoop.
+
+Each delta carries a sequence number, and the snapshot records the
+number of the last delta it contains. Recovery loads the snapshot,
+and replays the journal deltas with higher sequence numbers. A partly
+written last journal line, as left by a crash, is ignored.
+
+Delta format: [seq, op, dyadID, arg1, arg2, ...], where op is one of:
+
+    dyad      disabledID, partnerID, instantiatorRole, condition, creationTime
+    cond      condition
+    loggedIn  True/False
+    completed
+    par       parID, startTime
+    start     startTime         (of the dyad's current paragraph)
+    word      word, time
+    click     time
+    stop      stopTime
+    saved     numParScoresSaved
+    remove
+'''
+
+import os;
+import json;
+import time;
+from threading import Event, Lock, Thread;
+
+# Seconds between writes of pending deltas to the journal:
+DEFAULT_FLUSH_INTERVAL = 0.5;
+# Number of journaled deltas after which a new snapshot is taken:
+DEFAULT_COMPACT_EVERY = 5000;
+
+# ------------------------------- class DyadJournal ---------------------
+
+class DyadJournal(object):
+    '''
+    Journal of dyad state deltas, with periodic compaction into
+    a snapshot. Usage:
+        journal = DyadJournal(journalPath, snapshotPath);
+        dyadStates = journal.recover();
+        journal.start();
+        ...
+        journal.record('word', dyadID, 'h', time.time());
+        ...
+        journal.close();
+    '''
+
+    def __init__(self, journalPath, snapshotPath,
+                 flushInterval=DEFAULT_FLUSH_INTERVAL,
+                 compactEvery=DEFAULT_COMPACT_EVERY):
+        '''
+        @param journalPath: file to which deltas are appended.
+        @type journalPath: string
+        @param snapshotPath: file holding the latest snapshot.
+        @type snapshotPath: string
+        @param flushInterval: seconds between writes of pending deltas.
+        @type flushInterval: float
+        @param compactEvery: number of journaled deltas that trigger a snapshot.
+        @type compactEvery: int
+        '''
+        self.journalPath = journalPath;
+        self.snapshotPath = snapshotPath;
+        self.flushInterval = flushInterval;
+        self.compactEvery = compactEvery;
+
+        # Guards seq and pendingDeltas, which are shared
+        # between callers of record() and the writer thread:
+        self.pendingLock = Lock();
+        self.pendingDeltas = [];
+        self.seq = 0;
+
+        # Owned by the writer thread once it runs:
+        self.dyadStates = {};
+        self.lastAppliedSeq = 0;
+        self.deltasSinceSnapshot = 0;
+        self.journalFD = None;
+
+        self.stopRequested = Event();
+        self.writerThread = None;
+
+    def record(self, op, dyadID, *args):
+        '''
+        Queue one delta for the journal. Cheap; never touches the disk.
+        @param op: delta type (see module documentation)
+        @type op: string
+        @param dyadID: unique ID of the dyad the delta applies to.
+        @type dyadID: string
+        @param args: the delta's arguments.
+        '''
+        with self.pendingLock:
+            self.seq += 1;
+            self.pendingDeltas.append([self.seq, op, dyadID] + list(args));
+
+    def recover(self):
+        '''
+        Rebuild the game state from snapshot and journal. Must be
+        called before start(). The recovered state is immediately
+        compacted into a fresh snapshot.
+        @return: dict mapping dyadID to the dyad's state dict. See
+                 applyDelta() for the dict's keys.
+        @rtype: {string : dict}
+        '''
+        self.dyadStates = {};
+        self.lastAppliedSeq = 0;
+        try:
+            with open(self.snapshotPath, 'r') as fd:
+                snapshot = json.load(fd);
+            self.dyadStates = snapshot['dyads'];
+            self.lastAppliedSeq = snapshot['seq'];
+        except (IOError, ValueError, KeyError):
+            pass;
+        try:
+            with open(self.journalPath, 'r') as fd:
+                for line in fd:
+                    try:
+                        delta = json.loads(line);
+                    except ValueError:
+                        # Last line was cut short by a crash:
+                        break;
+                    if delta[0] <= self.lastAppliedSeq:
+                        # Already contained in the snapshot:
+                        continue;
+                    self.applyDelta(delta);
+        except IOError:
+            pass;
+        with self.pendingLock:
+            self.seq = max(self.seq, self.lastAppliedSeq);
+        self.compact();
+        return self.dyadStates;
+
+    def start(self):
+        '''
+        Start the writer thread.
+        '''
+        if self.journalFD is None:
+            self.journalFD = open(self.journalPath, 'a');
+        self.stopRequested.clear();
+        self.writerThread = Thread(target=self.runWriter, name='DyadJournalWriter');
+        self.writerThread.daemon = True;
+        self.writerThread.start();
+
+    def close(self):
+        '''
+        Stop the writer thread after it wrote all pending deltas.
+        '''
+        self.stopRequested.set();
+        if self.writerThread is not None:
+            self.writerThread.join();
+            self.writerThread = None;
+        if self.journalFD is not None:
+            self.journalFD.close();
+            self.journalFD = None;
+
+    def runWriter(self):
+        while not self.stopRequested.is_set():
+            self.stopRequested.wait(self.flushInterval);
+            self.flush();
+        # Pick up deltas recorded while we were writing:
+        self.flush();
+
+    def flush(self):
+        '''
+        Append all pending deltas to the journal, and take a snapshot
+        if enough deltas accumulated. Called by the writer thread.
+        '''
+        with self.pendingLock:
+            deltas = self.pendingDeltas;
+            self.pendingDeltas = [];
+        if len(deltas) == 0:
+            return;
+        self.journalFD.write(''.join([json.dumps(delta, separators=(',',':')) + '\n' for delta in deltas]));
+        self.journalFD.flush();
+        os.fsync(self.journalFD.fileno());
+        for delta in deltas:
+            self.applyDelta(delta);
+        self.deltasSinceSnapshot += len(deltas);
+        if self.deltasSinceSnapshot >= self.compactEvery:
+            self.compact();
+
+    def compact(self):
+        '''
+        Write the current state to a new snapshot, and start an empty
+        journal. The snapshot is written to a temporary file that is
+        renamed over the old snapshot, so a crash leaves either the old
+        or the new one. Deltas are only dropped from the journal after
+        the rename; deltas in both are recognized by their sequence number.
+        '''
+        tmpPath = self.snapshotPath + '.tmp';
+        with open(tmpPath, 'w') as fd:
+            json.dump({'seq' : self.lastAppliedSeq, 'time' : time.time(), 'dyads' : self.dyadStates}, fd);
+            fd.flush();
+            os.fsync(fd.fileno());
+        os.rename(tmpPath, self.snapshotPath);
+        if self.journalFD is not None:
+            self.journalFD.close();
+        self.journalFD = open(self.journalPath, 'w');
+        self.deltasSinceSnapshot = 0;
+
+    def applyDelta(self, delta):
+        '''
+        Apply one delta to the writer's copy of the game state.
+        A dyad's state is a dict with keys disabledID, partnerID,
+        instantiatorRole, condition, creationTime, loggedIn, completed,
+        numParScoresSaved, and parScores. Each paragraph score is a
+        dict with keys parID, startTime, stopTime, numGoodGuesses,
+        tickerTokens, and changeLog.
+        @param delta: [seq, op, dyadID, arg1, ...]
+        @type delta: list
+        '''
+        seq, op, dyadID = delta[0:3];
+        args = delta[3:];
+        self.lastAppliedSeq = seq;
+        if op == 'dyad':
+            (disabledID, partnerID, instantiatorRole, condition, creationTime) = args;
+            self.dyadStates[dyadID] = {'disabledID'        : disabledID,
+                                       'partnerID'         : partnerID,
+                                       'instantiatorRole'  : instantiatorRole,
+                                       'condition'         : condition,
+                                       'creationTime'      : creationTime,
+                                       'loggedIn'          : False,
+                                       'completed'         : False,
+                                       'numParScoresSaved' : 0,
+                                       'parScores'         : []};
+            return;
+        try:
+            dyadState = self.dyadStates[dyadID];
+        except KeyError:
+            # Delta for a dyad that was already removed:
+            return;
+        if op == 'remove':
+            del self.dyadStates[dyadID];
+        elif op == 'cond':
+            dyadState['condition'] = args[0];
+        elif op == 'loggedIn':
+            dyadState['loggedIn'] = args[0];
+        elif op == 'completed':
+            dyadState['completed'] = True;
+        elif op == 'saved':
+            dyadState['numParScoresSaved'] = args[0];
+        elif op == 'par':
+            dyadState['parScores'].append({'parID'          : args[0],
+                                           'startTime'      : args[1],
+                                           'stopTime'       : 0,
+                                           'numGoodGuesses' : 0,
+                                           'tickerTokens'   : [],
+                                           'changeLog'      : {'insertWord':[], 'goodnessClick':[]}});
+        elif len(dyadState['parScores']) > 0:
+            parScore = dyadState['parScores'][-1];
+            if op == 'word':
+                parScore['tickerTokens'].append(args[0]);
+                parScore['changeLog']['insertWord'].append(args[1]);
+            elif op == 'click':
+                parScore['numGoodGuesses'] += 1;
+                parScore['changeLog']['goodnessClick'].append(args[0]);
+            elif op == 'start':
+                parScore['startTime'] = args[0];
+            elif op == 'stop':
+                parScore['stopTime'] = args[0];
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import os;
+import time;
 
 import sqlite3;
 import json;
@@ -15,11 +16,20 @@ Python and JSON results.
 WORD_TREE_BREADTH = 5;
 WORD_TREE_DEPTH   = 3;
 
+# Seconds between checks whether the database's model version changed:
+MODEL_VERSION_CHECK_INTERVAL = 5;
+
 class ARITY:
     BIGRAM  = 2;
     TRIGRAM = 3;
 
-STOPWORDS =  ['a','able','about','across','after','all','almost','also','am','among','an','and','any',
+# Tables that hold each word's top followers without stopwords, as written by
+# stopword_free_followers.py, and the table that describes them:
+STOPWORD_FREE_TABLES = {ARITY.BIGRAM  : 'BigramsNoStopwords',
+                        ARITY.TRIGRAM : 'TrigramsNoStopwords'};
+STOPWORD_FREE_INFO_TABLE = 'StopwordFreeFollowers';
+
+STOPWORDS =  frozenset(['a','able','about','across','after','all','almost','also','am','among','an','and','any',
               'are','as','at','be','because','been','but','by','can','cannot','could','dear','did','do',
               'does','either','else','ever','every','for','from','get','got','had','has','have','he',
               'her','hers','him','his','how','however','i','if','in','into','is','it','its','just',
@@ -29,7 +39,43 @@ STOPWORDS =  ['a','able','about','across','after','all','almost','also','am','am
               'they','this','tis','to','too','twas','us','wants','was','we','were','what','when','where',
               'which','while','who','whom','why','will','with','would','yet','you','your',
               'subject', 'cc', 'bcc', 'nbspb', 'mr.', 'inc.', 'one', 'two', 'three', 'four', 'five', 
-              'six', 'seven', 'eight', 'nine', 'ten', 'enron', 'http'];
+              'six', 'seven', 'eight', 'nine', 'ten', 'enron', 'http']);
+
+# ------------------------------- class TokenCleaner ---------------------
+class TokenCleaner(object):
+    '''
+    Drops empty tokens, and optionally stopwords, from a sentence in
+    one pass. Stopwords are recognized by their lower case form.
+    '''
+    
+    def __init__(self, removeStopwords=False, stopwords=STOPWORDS):
+        '''
+        @param removeStopwords: whether or not to drop stopwords as well.
+        @type removeStopwords: boolean
+        @param stopwords: the words to drop, in lower case.
+        @type stopwords: iterable(string)
+        '''
+        self.removeStopwords = removeStopwords;
+        self.stopwords = frozenset(stopwords);
+        
+    def isKept(self, word):
+        '''
+        @return: True if clean() keeps the given token.
+        @rtype: boolean
+        '''
+        return len(word) > 0 and not (self.removeStopwords and word.lower() in self.stopwords);
+        
+    def clean(self, tokens):
+        '''
+        @param tokens: the tokens of a sentence. Not modified.
+        @type tokens: [string]
+        @return: a new list of the tokens that are kept, in order.
+        @rtype: [string]
+        '''
+        if not self.removeStopwords:
+            return [word for word in tokens if len(word) > 0];
+        stopwords = self.stopwords;
+        return [word for word in tokens if len(word) > 0 and word.lower() not in stopwords];
 
 # ------------------------------- class Word Database ---------------------
 class WordDatabase(object):
@@ -49,6 +95,38 @@ class WordDatabase(object):
         except Exception as e:
             raise IOError(`e` + ": %s" % self.dbPath);
         
+    def getModelVersion(self):
+        '''
+        Return the database's model version. Incremental updates of
+        the database increment the version. 0 for databases that
+        predate versioning.
+        @rtype: int
+        '''
+        return self.conn.execute('PRAGMA user_version').fetchone()[0];
+
+    def getStopwordFreeTopK(self, stopwords=STOPWORDS):
+        '''
+        Return how many followers per word the stopword-free follower
+        tables hold. The tables are only used if they were written for
+        the database's current model version, and for the given stopwords.
+        @param stopwords: the stopwords the tables must leave out.
+        @type stopwords: iterable(string)
+        @return: number of followers per word, or None if the database has
+                 no stopword-free follower tables that can be used.
+        @rtype: int
+        '''
+        try:
+            info = self.conn.execute('SELECT modelVersion, topK, stopwords FROM %s' % STOPWORD_FREE_INFO_TABLE).fetchone();
+        except sqlite3.OperationalError:
+            # No such table:
+            return None;
+        if info is None:
+            return None;
+        (modelVersion, topK, stopwordsJSON) = info;
+        if modelVersion != self.getModelVersion() or frozenset(json.loads(stopwordsJSON)) != frozenset(stopwords):
+            return None;
+        return topK;
+
     def close(self):
         pass;
     
@@ -61,7 +139,7 @@ class WordFollower(object):
     exceptions. See Python contextmanager.
     '''
 
-    def __init__(self, db, word, arity):
+    def __init__(self, db, word, arity, stopwordFree=False):
         '''
         Provides a tuple generator, given a WordDatabase instance 
         that accesses a word co-occurrence file, a root word, and the
@@ -72,10 +150,14 @@ class WordFollower(object):
         @type word: string
         @param arity: the 'n' in ngram. 2 for bigram, 3 for trigrams, etc.
         @type arity: ARITY
+        @param stopwordFree: if True, read the word's top followers without stopwords
+                             from the STOPWORD_FREE_TABLES, rather than all its followers.
+        @type stopwordFree: boolean
         '''
         self.db   = db;
         self.word = self.strip_non_ascii(word);
         self.arity = arity;
+        self.stopwordFree = stopwordFree;
         
     def __enter__(self):
         '''
@@ -90,9 +172,11 @@ class WordFollower(object):
         # though the followingCount is declared as int:
         try:
             if self.arity == ARITY.BIGRAM:
-                self.cursor.execute('SELECT word2 from Bigrams where word1="%s" ORDER BY probability*1 desc;' % self.word);
+                tableName = STOPWORD_FREE_TABLES[ARITY.BIGRAM] if self.stopwordFree else 'Bigrams';
+                self.cursor.execute('SELECT word2 from %s where word1="%s" ORDER BY probability*1 desc;' % (tableName, self.word));
             elif self.arity == ARITY.TRIGRAM:
-                self.cursor.execute('SELECT word2,word3 from Trigrams where word1="%s" ORDER BY probability*1 desc;' % self.word);
+                tableName = STOPWORD_FREE_TABLES[ARITY.TRIGRAM] if self.stopwordFree else 'Trigrams';
+                self.cursor.execute('SELECT word2,word3 from %s where word1="%s" ORDER BY probability*1 desc;' % (tableName, self.word));
             else:
                 raise ValueError("WordFollower for arity %d is not implemented." % self.arity);
         except sqlite3.OperationalError as e:
@@ -130,24 +214,39 @@ class WordExplorer(object):
     structure, given a source word and an underlying co-occurrence database.
     Python structures are recursive, as are the corresponding JSON structures:
     WordTree := {"word" : <rootWord>,"followWordObjs" : [WordTree1, WordTree2, ...]}
+    
+    An explorer created with skipStopwords=True builds trees whose followers
+    hold no stopwords, so that the branches go to useful words. The followers
+    are read from the database's stopword-free follower tables, if it has
+    up to date ones (see stopword_free_followers.py). Otherwise all of a word's
+    followers are read, and the ones with stopwords are dropped.
     '''
     
-    def __init__(self, dbPath):
+    def __init__(self, dbPath, skipStopwords=False):
         '''
         Create new WordExplorer that can be used for multiple tree creation requests.
         @param dbPath: Path to SQLite word co-occurrence file.
         @type dbPath: string
+        @param skipStopwords: if True, followers that contain stopwords are left out of the trees.
+        @type skipStopwords: boolean
         '''
         self.cache = {};
         self.db = WordDatabase(dbPath);
+        self.skipStopwords = skipStopwords;
+        self.stopwordCleaner = TokenCleaner(removeStopwords=True);
         # Cache needs to be invalidated when we change arity,
-        # or when we change db (see getSortedFollowers(), and setDb()):
+        # or when we change db (see getSortedFollowers(), and setDb()),
+        # or when the db's model version changes (see checkModelVersion()):
         self.arityInCache = None
+        self.modelVersionInCache = self.db.getModelVersion();
+        self.stopwordFreeTopK = self.db.getStopwordFreeTopK(self.stopwordCleaner.stopwords);
+        self.lastVersionCheckTime = time.time();
 
     def getSortedFollowers(self, word, arity):
         '''
         Return an array of follow-words for the given root word.
-        The array is sorted by decreasing frequency. A cache
+        The array is sorted by decreasing frequency. If this explorer
+        skips stopwords, followers with stopwords are left out. A cache
         is maintained to speed requests for root words after
         their first use, which must turn to the database. All
         After the first request, follow-ons will therefore be fast.   
@@ -158,6 +257,7 @@ class WordExplorer(object):
         @raise ValueError: if language model database access fails  
         '''
 
+        self.checkModelVersion();
         try:
             if self.arityInCache is not None:
                 # Is arity in this call different than 
@@ -169,17 +269,42 @@ class WordExplorer(object):
         except KeyError:
             # Not cached yet:
             wordArr = []; 
-            with WordFollower(self.db, word, arity) as followers:
-                for followerWordPlusCount in followers:
-                    wordArr.append(followerWordPlusCount);
+            if self.skipStopwords and self.stopwordFreeTopK is None:
+                # No usable precomputed followers; filter all of them:
+                isKept = self.stopwordCleaner.isKept;
+                with WordFollower(self.db, word, arity) as followers:
+                    for followerWordPlusCount in followers:
+                        if all(isKept(followerWord) for followerWord in followerWordPlusCount):
+                            wordArr.append(followerWordPlusCount);
+            else:
+                with WordFollower(self.db, word, arity, stopwordFree=self.skipStopwords) as followers:
+                    for followerWordPlusCount in followers:
+                        wordArr.append(followerWordPlusCount);
             self.cache[word] = wordArr;
         return wordArr;
 
 
+    def checkModelVersion(self):
+        '''
+        Every MODEL_VERSION_CHECK_INTERVAL seconds, check whether the
+        database was updated, and drop the cache if so.
+        '''
+        now = time.time();
+        if now - self.lastVersionCheckTime < MODEL_VERSION_CHECK_INTERVAL:
+            return;
+        self.lastVersionCheckTime = now;
+        modelVersion = self.db.getModelVersion();
+        if modelVersion != self.modelVersionInCache:
+            self.cache = {};
+            self.modelVersionInCache = modelVersion;
+            self.stopwordFreeTopK = self.db.getStopwordFreeTopK(self.stopwordCleaner.stopwords);
+
     def setDb(self, newDbPath):
         # New db invalidates our cache:
         self.cache = {};
         self.db = WordDatabase(newDbPath);
+        self.modelVersionInCache = self.db.getModelVersion();
+        self.stopwordFreeTopK = self.db.getStopwordFreeTopK(self.stopwordCleaner.stopwords);
       
     def makeWordTree(self, wordArr, arity, wordTree=None, maxDepth=WORD_TREE_DEPTH, maxBranch=WORD_TREE_BREADTH):
         '''
@@ -206,12 +331,17 @@ class WordExplorer(object):
         @type maxBranch: int
         @return: new EchoTree Python structure
         @rtype: string
-        @raise ValueError: if language model database access fails  
+        @raise ValueError: if language model database access fails, or if this
+                           explorer skips stopwords, and maxBranch exceeds the
+                           number of followers per word in the stopword-free tables.
         '''
         # Recursion bottomed out:
         if maxDepth <= 0:
             return wordTree;
         if wordTree is None:
+            if self.skipStopwords and self.stopwordFreeTopK is not None and maxBranch > self.stopwordFreeTopK:
+                raise ValueError("Database %s holds %d stopword-free followers per word; cannot build trees %d wide." %
+                                 (self.db.dbPath, self.stopwordFreeTopK, maxBranch));
             # Use OrderedDict so that conversions to JSON show the 'word' key first:
             wordTree = OrderedDict();
             # First call; wordArr is allowed to be a string, rather than a strArray:
@@ -245,7 +375,7 @@ class WordExplorer(object):
                 return wordTree;
             # Each member of the followWordOjbs array is its own tree:
             followerTree = OrderedDict();
-            newSubtree = self.makeWordTree(followerWords, arity, wordTree=followerTree, maxDepth=maxDepth-1);
+            newSubtree = self.makeWordTree(followerWords, arity, wordTree=followerTree, maxDepth=maxDepth-1, maxBranch=maxBranch);
             # Don't enter empty dictionaries into the array:
             if len(newSubtree) > 0:
                 wordTree['followWordObjs'].append(newSubtree);
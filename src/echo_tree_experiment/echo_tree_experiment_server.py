@@ -36,16 +36,22 @@ import datetime;
 import random;
 import copy;
 import shelve;
+import pickle;
+import json;
 import collections
-from threading import Event, Lock, Thread;
+import itertools;
+from threading import Event, Lock, RLock, Thread;
 
 import tornado;
 from tornado.ioloop import IOLoop;
-from tornado.websocket import WebSocketHandler;
+from tornado.websocket import WebSocketHandler, WebSocketProtocol76;
 from tornado.httpserver import HTTPServer;
 
 from echo_tree import WordExplorer;
 from echo_tree_server import TreeTypes;
+from static_asset_cache import StaticAssetCache;
+import compact_protocol;
+from dyad_journal import DyadJournal;
 
 HOST = socket.getfqdn();
 
@@ -76,16 +82,32 @@ JS_MIME   = "application/javascript";
 OP_CODE_SEPARATOR = '>';
 ARGS_SEPARATOR = '|';
 
+# Browsers that understand the compact binary protocol announce
+# it in their reply to the 'test' message: test> ...|protocols=1
+# The server confirms with sendLogin>compact=1
+PROTOCOLS_OFFER_PREFIX = 'protocols=';
+COMPACT_ACCEPTED_ARG   = 'compact=%d' % compact_protocol.COMPACT_PROTOCOL_VERSION;
+
 SCRIPT_DIR = os.path.realpath(os.path.dirname(__file__));
 #DBPATH = os.path.join(os.path.realpath(os.path.dirname(__file__)), "Resources/testDb.db");
 #DBPATH = os.path.join(SCRIPT_DIR, "Resources/EnronCollectionProcessed/EnronDB/enronDB.db");
 RECREATION_DB_PATH = os.path.join(SCRIPT_DIR, "Resources/dmozRecreation.db");
 #GOOGLE_DB_PATH = os.path.join(SCRIPT_DIR, "Resources/googleNgrams.db");
 
+# Directory with the HTML, CSS, and JavaScript served to participants:
+BROWSER_SCRIPTS_DIR = os.path.join(SCRIPT_DIR, "../browser_scripts");
+
 PARAGRAPHS_PATH = os.path.join(SCRIPT_DIR, "Resources/paragraphs.txt");
 
 CSV_OUTPUT_DIR  = os.path.join(SCRIPT_DIR, "Measurements");
 PARTICIPANT_RECORDS_PATH = os.path.join(CSV_OUTPUT_DIR, "participants.shelve"); 
+# Role/condition assignments precomputed for scheduled sessions:
+SCHEDULE_PATH = os.path.join(CSV_OUTPUT_DIR, "sessionSchedule.pickle");
+# Rounds of the schedule that were used (see SessionSchedule):
+SCHEDULE_ROUNDS_LOG_PATH = os.path.join(CSV_OUTPUT_DIR, "sessionScheduleRounds.log");
+# Crash recovery of live dyads (see dyad_journal.py):
+DYAD_JOURNAL_PATH  = os.path.join(CSV_OUTPUT_DIR, "dyadJournal.log");
+DYAD_SNAPSHOT_PATH = os.path.join(CSV_OUTPUT_DIR, "dyadSnapshot.json");
 
 DISABLED_INSTRUCTIONS = "Once you click the OK button, you will go back to the brown login screen. " +\
                         "Once there, please log in again. Then begin typing the sentence that you will " +\
@@ -214,6 +236,21 @@ class Participant(object):
         newContact = PlayContact(playmateID, thisParticipantsRole, condition);
         self.playContacts.append(newContact);
 
+    def removeContact(self, playmateID, rolePlayed, condition):
+        '''
+        Remove the latest contact with the given playmate, role, and
+        condition, if there is one. The same NOTE as for addContact()
+        applies.
+        @return: True if a contact was removed.
+        @rtype: boolean
+        '''
+        for contactIndex in range(len(self.playContacts) - 1, -1, -1):
+            contact = self.playContacts[contactIndex];
+            if (contact.playmateID, contact.rolePlayed, contact.condition) == (playmateID, rolePlayed, condition):
+                del self.playContacts[contactIndex];
+                return True;
+        return False;
+
     def getPlaymates(self):
         '''
         Return an array with all IDs of playmates this participant has played with.
@@ -425,17 +462,409 @@ class Participant(object):
             return Role.DISABLED;
         else:
             return Role.PARTNER;
+# -----------------------------------------  Class SessionSchedule --------------------
+
+class SessionSchedule(object):
+    '''
+    Role and condition assignments computed ahead of time for all
+    pairs of a scheduled session. The schedule maps (ownID, otherID)
+    to a list of (role, condition) tuples, one per round the pair
+    will play, in the order the rounds are to be played. getAssignment
+    requests of a scheduled player return the first tuple that was not
+    yet played, however often they are repeated. Once a game is done,
+    handleGameDone() moves both players on to their next tuple, so
+    that the roles switch between rounds just as they do when
+    assignments are computed on the fly.
+    
+    scheduleSession() records all scheduled contacts in the participant
+    records at once, and writes the schedule to SCHEDULE_PATH by writing
+    a temporary file, and renaming it over the old one. Readers therefore
+    always see either the old or the new schedule. The file is re-read
+    when its modification time changes, so a schedule computed by the
+    scheduleSession.py command line tool is picked up by a running server.
+    
+    getAssignment requests only look up the schedule in memory. The
+    rounds each player played are counted, and each played round is
+    appended to SCHEDULE_ROUNDS_LOG_PATH as one JSON list, [generation,
+    ownID, otherID], so that the counts survive a restart. The generation
+    identifies the schedule; saving a new schedule starts a new one,
+    and empties the log.
+    '''
+    
+    # (ownID, otherID) --> [(role, condition), ...]:
+    assignments = {};
+    # (ownID, otherID) --> number of rounds played:
+    roundsUsed = {};
+    generation = 0;
+    loadedMtime = None;
+    roundsLogFD = None;
+    scheduleLock = Lock();
+    
+    @staticmethod
+    def computeSchedule(roster, participantDict, numRounds=NUM_OF_ROUNDS_PER_DYAD):
+        '''
+        Compute balanced assignments for every pair in the roster in
+        one pass. Roles follow Participant.nextRole(), and conditions
+        follow Participant.nextCondition(). The participant records
+        are not modified. Instead, copies accumulate the scheduled
+        contacts, so that a player who appears in several pairs is
+        balanced across all of them.
+        
+        Of the two players of a pair, the one who so far played
+        the disabled role less often (relative to the partner role)
+        gets the disabled role. On a tie the first player's
+        nextRole() decides.
+        
+        @param roster: pairs of player IDs that will play together.
+        @type roster: [(string, string)]
+        @param participantDict: mapping from player ID to Participant. Players
+                                not in the dict are treated as new players.
+        @type participantDict: {dict | shelve}
+        @param numRounds: number of rounds each pair will play.
+        @type numRounds: int
+        @return: dict mapping (ownID, otherID) to a list of (role, condition).
+        @rtype: dict
+        '''
+        participants = {};
+        def participantFor(playerID):
+            try:
+                return participants[playerID];
+            except KeyError:
+                try:
+                    participant = copy.deepcopy(participantDict[playerID]);
+                except KeyError:
+                    participant = Participant(playerID);
+                participants[playerID] = participant;
+                return participant;
+        
+        def disabledSurplus(participant):
+            roles = participant.getRoles();
+            return roles.count(Role.DISABLED) - roles.count(Role.PARTNER);
+        
+        schedule = {};
+        # Round by round, so that each pair's rounds alternate roles:
+        for roundNum in range(numRounds):
+            for (playerID1, playerID2) in roster:
+                participant1 = participantFor(playerID1);
+                participant2 = participantFor(playerID2);
+                surplus1 = disabledSurplus(participant1);
+                surplus2 = disabledSurplus(participant2);
+                if surplus1 < surplus2:
+                    role1 = Role.DISABLED;
+                elif surplus1 > surplus2:
+                    role1 = Role.PARTNER;
+                else:
+                    role1 = participant1.nextRole();
+                role2 = Role.PARTNER if role1 == Role.DISABLED else Role.DISABLED;
+                condition = participant1.nextCondition(participant2);
+                
+                participant1.addContact(playerID2, role1, condition);
+                participant2.addContact(playerID1, role2, condition);
+                schedule.setdefault((playerID1, playerID2), []).append((role1, condition));
+                schedule.setdefault((playerID2, playerID1), []).append((role2, condition));
+        return schedule;
+    
+    @staticmethod
+    def scheduleSession(roster, numRounds=NUM_OF_ROUNDS_PER_DYAD):
+        '''
+        Compute the assignments for a whole session, record the scheduled
+        contacts in the participant records, and persist the schedule.
+        Entries for pairs that are not in the roster are kept. The contacts
+        of rounds that a rescheduled pair did not use are removed first.
+        @param roster: pairs of player IDs that will play together.
+        @type roster: [(string, string)]
+        @param numRounds: number of rounds each pair will play.
+        @type numRounds: int
+        @return: the newly computed assignments.
+        @rtype: dict
+        '''
+        with SessionSchedule.scheduleLock:
+            SessionSchedule.reloadIfChanged();
+            with LoadedParticipants():
+                participantDict = EchoTreeLogService.participantDict;
+                participants = {};
+                def participantFor(playerID):
+                    try:
+                        return participants[playerID];
+                    except KeyError:
+                        try:
+                            participant = participantDict[playerID];
+                        except KeyError:
+                            participant = Participant(playerID);
+                        participants[playerID] = participant;
+                        return participant;
+                
+                rosterKeys = set(roster) | set([(playerID2, playerID1) for (playerID1, playerID2) in roster]);
+                for (ownID, otherID) in rosterKeys:
+                    for (role, condition) in SessionSchedule.unusedRounds(ownID, otherID):
+                        participantFor(ownID).removeContact(otherID, role, condition);
+                for participant in participants.values():
+                    participantDict[participant.getParticipantID()] = participant;
+                
+                schedule = SessionSchedule.computeSchedule(roster, participantDict, numRounds);
+                # In the order in which computeSchedule() balanced them:
+                numRecorded = {};
+                for roundNum in range(numRounds):
+                    for (playerID1, playerID2) in roster:
+                        for (ownID, otherID) in [(playerID1, playerID2), (playerID2, playerID1)]:
+                            roundIndex = numRecorded.get((ownID, otherID), 0);
+                            (role, condition) = schedule[(ownID, otherID)][roundIndex];
+                            participantFor(ownID).addContact(otherID, role, condition);
+                            numRecorded[(ownID, otherID)] = roundIndex + 1;
+                for participant in participants.values():
+                    participantDict[participant.getParticipantID()] = participant;
+            
+            # Carry over the unused rounds of the other pairs:
+            assignments = {};
+            for key in SessionSchedule.assignments.keys():
+                if key not in rosterKeys and len(SessionSchedule.unusedRounds(*key)) > 0:
+                    assignments[key] = SessionSchedule.unusedRounds(*key);
+            assignments.update(schedule);
+            SessionSchedule.assignments = assignments;
+            SessionSchedule.roundsUsed = {};
+            SessionSchedule.generation += 1;
+            SessionSchedule.save();
+        return schedule;
+    
+    @staticmethod
+    def currentAssignment(ownID, otherID):
+        '''
+        Return the scheduled (role, condition) of the round that the
+        given player plays next with the given other player. The round
+        stays current until roundPlayed() is called for it, so repeated
+        requests get the same answer.
+        @param ownID: ID of the player asking for an assignment.
+        @type ownID: string
+        @param otherID: ID of the player's opposite player.
+        @type otherID: string
+        @return: (role, condition), or None if the pair has no
+                 scheduled rounds left.
+        @rtype: {(string,string) | None}
+        '''
+        with SessionSchedule.scheduleLock:
+            SessionSchedule.reloadIfChanged();
+            unusedRounds = SessionSchedule.unusedRounds(ownID, otherID);
+            if len(unusedRounds) == 0:
+                return None;
+            return unusedRounds[0];
+        
+    @staticmethod
+    def roundPlayed(ownID, otherID):
+        '''
+        Mark the current scheduled round of the given player with
+        the given other player as played. Nothing is marked if
+        the pair has no scheduled rounds left.
+        @param ownID: ID of the player whose game is done.
+        @type ownID: string
+        @param otherID: ID of the player's opposite player.
+        @type otherID: string
+        '''
+        with SessionSchedule.scheduleLock:
+            SessionSchedule.reloadIfChanged();
+            if len(SessionSchedule.unusedRounds(ownID, otherID)) == 0:
+                return;
+            SessionSchedule.roundsUsed[(ownID, otherID)] = SessionSchedule.roundsUsed.get((ownID, otherID), 0) + 1;
+            SessionSchedule.logRoundUsed(ownID, otherID);
+        
+    @staticmethod
+    def numRoundsLeft(ownID, otherID):
+        '''
+        Return the number of scheduled rounds the given player has not
+        yet played with the given other player. Their contacts are already
+        in the participant records, so callers that count the games two
+        players played subtract these.
+        @rtype: int
+        '''
+        with SessionSchedule.scheduleLock:
+            SessionSchedule.reloadIfChanged();
+            return len(SessionSchedule.unusedRounds(ownID, otherID));
+        
+    @staticmethod
+    def unusedRounds(ownID, otherID):
+        '''
+        Return the scheduled (role, condition) tuples that the given
+        player has not yet played. Callers must hold scheduleLock.
+        @rtype: [(string,string)]
+        '''
+        rounds = SessionSchedule.assignments.get((ownID, otherID), []);
+        return rounds[SessionSchedule.roundsUsed.get((ownID, otherID), 0):];
+        
+    @staticmethod
+    def logRoundUsed(ownID, otherID):
+        '''
+        Append a played round to the rounds log. Callers must hold scheduleLock.
+        '''
+        if SessionSchedule.roundsLogFD is None:
+            SessionSchedule.roundsLogFD = open(SCHEDULE_ROUNDS_LOG_PATH, 'a');
+        SessionSchedule.roundsLogFD.write(json.dumps([SessionSchedule.generation, ownID, otherID]) + '\n');
+        SessionSchedule.roundsLogFD.flush();
+        
+    @staticmethod
+    def reloadIfChanged():
+        '''
+        Re-read the schedule file if it changed since it was last
+        read, and count the rounds used of its generation in the
+        rounds log. A partly written last log line, as left by a
+        crash, is ignored. Callers must hold scheduleLock.
+        '''
+        try:
+            mtime = os.path.getmtime(SCHEDULE_PATH);
+        except OSError:
+            return;
+        if mtime == SessionSchedule.loadedMtime:
+            return;
+        with open(SCHEDULE_PATH, 'rb') as fd:
+            (SessionSchedule.generation, SessionSchedule.assignments) = pickle.load(fd);
+        SessionSchedule.roundsUsed = {};
+        try:
+            with open(SCHEDULE_ROUNDS_LOG_PATH, 'r') as fd:
+                for line in fd:
+                    try:
+                        (generation, ownID, otherID) = json.loads(line);
+                    except ValueError:
+                        continue;
+                    if generation == SessionSchedule.generation:
+                        SessionSchedule.roundsUsed[(ownID, otherID)] = SessionSchedule.roundsUsed.get((ownID, otherID), 0) + 1;
+        except IOError:
+            # No rounds used yet:
+            pass;
+        SessionSchedule.loadedMtime = mtime;
+        
+    @staticmethod
+    def save():
+        '''
+        Atomically replace the schedule file with the in-memory
+        schedule, and empty the rounds log. Callers must hold
+        scheduleLock.
+        '''
+        tmpPath = SCHEDULE_PATH + '.tmp';
+        with open(tmpPath, 'wb') as fd:
+            pickle.dump((SessionSchedule.generation, SessionSchedule.assignments), fd, pickle.HIGHEST_PROTOCOL);
+            fd.flush();
+            os.fsync(fd.fileno());
+        os.rename(tmpPath, SCHEDULE_PATH);
+        SessionSchedule.loadedMtime = os.path.getmtime(SCHEDULE_PATH);
+        # Lines of older generations are ignored, so a crash
+        # before the log is emptied loses nothing:
+        open(SCHEDULE_ROUNDS_LOG_PATH, 'w').close();
+        
+# -----------------------------------------  Class DyadRegistry --------------------
+
+class DyadRegistry(object):
+    '''
+    Holds the live ExperimentDyad instances, keyed by the unordered
+    pair of the two players' IDs. At most one dyad is registered per
+    pair. A second index maps each player to the pairs the player
+    is part of. Lookup, insertion, and removal are O(1). The registry
+    lock guards these two dicts, and is never held while talking
+    to browsers. Insertions and removals queue their journal deltas
+    while holding it, so that the journal replays them in the order
+    in which they changed the registry. State changes of a single
+    dyad are serialized by that dyad's own dyadLock.
+    '''
+    
+    def __init__(self):
+        # frozenset([playerID1, playerID2]) --> ExperimentDyad:
+        self.dyadsByPair = {};
+        # playerID --> set of pair keys the player is part of:
+        self.pairsByPlayer = {};
+        self.registryLock = Lock();
+        
+    @staticmethod
+    def pairKey(playerID1, playerID2):
+        return frozenset((playerID1, playerID2));
+    
+    def get(self, playerID1, playerID2):
+        '''
+        Return the dyad registered for the given two players, or None.
+        Order of the IDs does not matter.
+        @param playerID1: ID of one player
+        @type playerID1: string
+        @param playerID2: ID of the other player
+        @type playerID2: string
+        @rtype: {ExperimentDyad | None}
+        '''
+        return self.dyadsByPair.get(DyadRegistry.pairKey(playerID1, playerID2));
+    
+    def addIfAbsent(self, newDyad):
+        '''
+        Register newDyad under its pair of players, unless a dyad
+        that is not yet completed is already registered for that pair.
+        Completed dyads are replaced. Atomic, so two players logging
+        in at the same time end up sharing one dyad.
+        @param newDyad: dyad to register
+        @type newDyad: ExperimentDyad
+        @return: the dyad that is registered for the pair after the call.
+                 Callers check for identity with newDyad to learn whether
+                 their dyad was the one registered.
+        @rtype: ExperimentDyad
+        '''
+        key = DyadRegistry.pairKey(newDyad.disabledID(), newDyad.partnerID());
+        with self.registryLock:
+            existingDyad = self.dyadsByPair.get(key);
+            if existingDyad is not None and not existingDyad.isDyadCompleted():
+                return existingDyad;
+            self.dyadsByPair[key] = newDyad;
+            for playerID in key:
+                self.pairsByPlayer.setdefault(playerID, set()).add(key);
+            if existingDyad is not None:
+                existingDyad.journalDelta('remove');
+            newDyad.journalDelta('dyad', newDyad.disabledID(), newDyad.partnerID(), 
+                                 newDyad.instantiatorRole, newDyad.condition(), newDyad.creationTime);
+        return newDyad;
+    
+    def remove(self, dyad):
+        '''
+        Unregister the given dyad. Does nothing if a different
+        dyad is registered for the same pair of players.
+        @param dyad: dyad to remove
+        @type dyad: ExperimentDyad
+        @return: True if the dyad was removed, else False.
+        @rtype: boolean
+        '''
+        key = DyadRegistry.pairKey(dyad.disabledID(), dyad.partnerID());
+        with self.registryLock:
+            if self.dyadsByPair.get(key) is not dyad:
+                return False;
+            del self.dyadsByPair[key];
+            for playerID in key:
+                playerPairs = self.pairsByPlayer.get(playerID);
+                if playerPairs is None:
+                    continue;
+                playerPairs.discard(key);
+                if len(playerPairs) == 0:
+                    del self.pairsByPlayer[playerID];
+            dyad.journalDelta('remove');
+        return True;
+    
+    def dyadsOf(self, playerID):
+        '''
+        Return a snapshot list of all dyads the given player is part of.
+        @param playerID: ID of player
+        @type playerID: string
+        @rtype: [ExperimentDyad]
+        '''
+        with self.registryLock:
+            return [self.dyadsByPair[key] for key in self.pairsByPlayer.get(playerID, ())];
+        
+    def __len__(self):
+        return len(self.dyadsByPair);
+
 # -----------------------------------------  Classes ExperimentPair, ParagraphScore --------------------
 
 class ExperimentDyad(object):
     
     
-    # Dict of dyads keyed by player. Values are ExperimentDyad
-    # instances in which the keyed player participated in. Each dyad instance
-    # is represented in two value lists, once in the value for each player.
-    # However, the instances are the same object in both
-    # cases:
-    allDyads = {};
+    # Registry of live dyads, keyed by the unordered pair
+    # of player IDs (see DyadRegistry):
+    allDyads = DyadRegistry();
+    
+    # DyadJournal that records all state changes for crash
+    # recovery. None while recovering, or if journaling is off:
+    journal = None;
+    # Dyad IDs are unique across server restarts:
+    dyadIDPrefix = str(int(time.time()));
+    dyadIDCounter = itertools.count();
     
     def __init__(self, theInstantiatingHandler, instantiatorRole, disabledID, partnerID):
         '''
@@ -471,6 +900,59 @@ class ExperimentDyad(object):
         self.parScores = [];
         
         self.creationTime = time.time();
+        
+        # Identifies this dyad in the journal:
+        self.dyadID = ExperimentDyad.dyadIDPrefix + '.' + str(ExperimentDyad.dyadIDCounter.next());
+        # True for dyads rebuilt from the journal after a restart, until
+        # both players have reconnected, and the game is resumed:
+        self.resumed = False;
+        
+        # Serializes logins, game progress, and teardown of this dyad.
+        # Reentrant, b/c teardown may be triggered from within a
+        # handler that already holds the lock:
+        self.dyadLock = RLock();
+
+    @staticmethod
+    def restore(dyadID, dyadState):
+        '''
+        Rebuild a dyad from the state recovered by the DyadJournal.
+        The dyad has no handlers; it waits for both players to log
+        in again. Paragraph scores that were already saved to a
+        previous run's CSV file are saved again, so that the dyad's
+        row in this run's file is complete.
+        @param dyadID: the dyad's ID in the journal.
+        @type dyadID: string
+        @param dyadState: state dict as documented in DyadJournal.applyDelta()
+        @type dyadState: dict
+        @return: the restored dyad
+        @rtype: ExperimentDyad
+        '''
+        # JSON returns unicode; the rest of the server works with UTF-8 strings:
+        def toStr(value):
+            return value.encode('utf-8') if isinstance(value, unicode) else value;
+        dyad = ExperimentDyad(None, 
+                              toStr(dyadState['instantiatorRole']), 
+                              toStr(dyadState['disabledID']), 
+                              toStr(dyadState['partnerID']));
+        dyad.dyadID = toStr(dyadID);
+        dyad.theCondition = toStr(dyadState['condition']);
+        dyad.creationTime = dyadState['creationTime'];
+        dyad.resumed = True;
+        for parState in dyadState['parScores']:
+            parScore = ParagraphScore(dyad, dyad.condition(), parState['parID'], dyad.disabledID(), dyad.partnerID());
+            parScore.startTime      = parState['startTime'];
+            parScore.stopTime       = parState['stopTime'];
+            parScore.numGoodGuesses = parState['numGoodGuesses'];
+            parScore.tickerTokens   = [toStr(token) for token in parState['tickerTokens']];
+            parScore.numLettersTyped = len(parScore.tickerTokens);
+            parScore.changeLog      = {'insertWord'    : parState['changeLog']['insertWord'],
+                                       'goodnessClick' : parState['changeLog']['goodnessClick']};
+            dyad.parScores.append(parScore);
+        return dyad;
+    
+    def journalDelta(self, op, *args):
+        if ExperimentDyad.journal is not None:
+            ExperimentDyad.journal.record(op, self.dyadID, *args);
 
     def currentParScore(self):
         if len(self.parScores) > 0:
@@ -492,18 +974,27 @@ class ExperimentDyad(object):
     
     def setCondition(self, condition):
         self.theCondition = condition;
+        self.journalDelta('cond', condition);
     
     def isDyadLoggedIn(self):
         return self.dyadLoggedIn;
 
     def setDyadLoggedIn(self, state=True):
         self.dyadLoggedIn = state;
+        self.journalDelta('loggedIn', state);
         
     def isDyadCompleted(self):
         return self.dyadCompleted;
         
     def setDyadCompleted(self):
         self.dyadCompleted = True;
+        self.journalDelta('completed');
+        
+    def isResumed(self):
+        return self.resumed;
+    
+    def setResumed(self, newBool):
+        self.resumed = newBool;
         
     def isOpen(self):
         '''
@@ -531,6 +1022,22 @@ class ExperimentDyad(object):
             self.disabledHandler = handler;
         else:
             self.partnerHandler  = handler;
+            
+    def setFirstHandler(self, handler, role):
+        '''
+        Attach the handler of the first player to log back into
+        a restored dyad. The second player's handler is attached
+        via setThatHandler(), as for any other dyad.
+        '''
+        self.thisHandler = handler;
+        if role == Role.DISABLED:
+            self.disabledHandler = handler;
+        else:
+            self.partnerHandler = handler;
+            
+    def clearHandlers(self):
+        self.thisHandler = self.thatHandler = None;
+        self.disabledHandler = self.partnerHandler = None;
 
     def setSavedToFile(self, newBool):
         self.savedToFile = newBool;
@@ -555,7 +1062,9 @@ class ExperimentDyad(object):
                 else:
                     break;
             # Create a new score object for this sentence:
-            self.parScores.append(ParagraphScore(self, self.condition(), newParID, self.disabledID(), self.partnerID()));
+            newParScore = ParagraphScore(self, self.condition(), newParID, self.disabledID(), self.partnerID());
+            self.parScores.append(newParScore);
+            self.journalDelta('par', newParID, newParScore.startTime);
             # Persistently record that these two players were exposed to this par:
             disabledParticipant.addPar(newParID);
             partnerParticipant.addPar(newParID);
@@ -596,6 +1105,7 @@ class ExperimentDyad(object):
         # the next index into the parScore array that will
         # need to be saved, once another score is added:
         self.numParScoresSaved = len(self.parScores);
+        self.journalDelta('saved', self.numParScoresSaved);
         
         
 class ParagraphScore(object):
@@ -622,23 +1132,29 @@ class ParagraphScore(object):
         self.changeLog = {'insertWord':[], 'goodnessClick':[]};
         
     def addInsertedWord(self, word):
+        insertTime = time.time();
         self.tickerTokens.append(word);
         self.numLettersTyped += 1;
-        self.changeLog['insertWord'].append(time.time());
+        self.changeLog['insertWord'].append(insertTime);
         self.dyadParent.setSavedToFile(False);
+        self.dyadParent.journalDelta('word', word, insertTime);
         
     def addGoodnessClick(self):
+        clickTime = time.time();
         self.numGoodGuesses += 1;
-        self.changeLog['goodnessClick'].append(time.time());
+        self.changeLog['goodnessClick'].append(clickTime);
         self.dyadParent.setSavedToFile(False);        
+        self.dyadParent.journalDelta('click', clickTime);
         
     def setStartTime(self):
         self.startTime = time.time();
         self.dyadParent.setSavedToFile(False);        
+        self.dyadParent.journalDelta('start', self.startTime);
 
     def setStopTime(self):
         self.stopTime = time.time();
         self.dyadParent.setSavedToFile(False);        
+        self.dyadParent.journalDelta('stop', self.stopTime);
 
 # -----------------------------------------  Top Level Service Provider Classes --------------------
 
@@ -660,9 +1176,6 @@ class EchoTreeLogService(WebSocketHandler):
     # Lock for changing the current EchoTree:
     currentEchoTreeLock = Lock();
     
-    # Lock protecting access to dyads dict:
-    dyadLock = Lock();
-    
     # Lock for modifying participant shelf:
     participantRecordLock = Lock();
     
@@ -707,6 +1220,12 @@ class EchoTreeLogService(WebSocketHandler):
         self.myPlayerID   = None;
         self.myPartnersID = None;
         self.myRole       = None;
+        
+        # True once browser and server agreed on the compact
+        # binary protocol during the test/sendLogin handshake:
+        self.compactProtocol = False;
+        # Events waiting to be sent as one compact frame:
+        self.pendingEvents = [];
     
         
     
@@ -734,19 +1253,43 @@ class EchoTreeLogService(WebSocketHandler):
         
     def on_message(self, message):
         '''
-        Connected browser requests a new word:
+        Connected browser sent a message. Text frames carry one message
+        in the text protocol. Binary frames carry one or more events
+        in the compact protocol.
         @param message: message arriving from the browser
-        @type message: string
+        @type message: {unicode | string}
         '''
+        if not isinstance(message, unicode):
+            try:
+                events = compact_protocol.decodeFrame(message);
+            except ValueError as e:
+                EchoTreeLogService.log("Bad compact frame from participant: %s" % `e`);
+                return;
+            EchoTreeLogService.log("Events from participant: %s" % str(events));
+            for (opName, fields) in events:
+                self.dispatchMessage([opName] + fields);
+            return;
+        
         subjectMsg = message.encode('utf-8');
         EchoTreeLogService.log("Message from participant: '%s'." % subjectMsg);
         if (len(subjectMsg) == 0):
             return;
-        msgArr = subjectMsg.split(OP_CODE_SEPARATOR);
+        self.dispatchMessage(subjectMsg.split(OP_CODE_SEPARATOR));
         
+    def dispatchMessage(self, msgArr):
+        '''
+        Act on one message from the browser, whichever protocol
+        it arrived in.
+        @param msgArr: opcode, followed by the message's argument(s).
+        @type msgArr: [string]
+        '''
         if (msgArr[0] == 'test'):
             self.selfTest.append('partnerSubjectResponded');
-            self.write_message('sendLogin' + OP_CODE_SEPARATOR)
+            if self.offersCompactProtocol(msgArr):
+                self.compactProtocol = True;
+                self.write_message('sendLogin' + OP_CODE_SEPARATOR + COMPACT_ACCEPTED_ARG);
+            else:
+                self.write_message('sendLogin' + OP_CODE_SEPARATOR)
             return;
 
         # Is browser reporting the players' email addresses?
@@ -776,40 +1319,104 @@ class EchoTreeLogService(WebSocketHandler):
             curParScore.addInsertedWord(word);
             # Echo the word/letter to the partner:
             if self.myDyad.getThisHandler() == self:
-                self.myDyad.getThatHandler().write_message("addWord" + OP_CODE_SEPARATOR + word);
+                self.myDyad.getThatHandler().sendEvent("addWord", word);
             else:
-                self.myDyad.getThisHandler().write_message("addWord" + OP_CODE_SEPARATOR + word);
+                self.myDyad.getThisHandler().sendEvent("addWord", word);
 
         if (msgArr[0] == 'goodGuessClicked'):
             self.myDyad.currentParScore().addGoodnessClick();
             # Tell partner so feedback can be given:
-            self.myDyad.getThatHandler().write_message("goodGuessClicked" + OP_CODE_SEPARATOR);
+            self.myDyad.getThatHandler().sendEvent("goodGuessClicked");
             
         # Is browser reporting that one paragraph is all done?
         # (Note this msg is also used when a disabled partner is
         # asking for its first paragraph. The arg is -1 in that case.
         if (msgArr[0] == 'parDone'):
-            self.myDyad.currentParScore().setStopTime();
-            self.myDyad.saveToCSV();
-            newParID = self.startNewPar(self.myDyad);
-            if newParID is None:
-                # Game done. All NUM_OF_PARS_PER_ROUND paragraphs have
-                # been communicated. Add a CR to the CSV file to finish
-                # the row for this round:
-                with open(EchoTreeLogService.gameOutputFilePath, 'a') as fd:
-                    fd.write("\n");
-                self.handleGameDone(self.myDyad);
-                return;
+            with self.myDyad.dyadLock:
+                self.myDyad.currentParScore().setStopTime();
+                self.myDyad.saveToCSV();
+                newParID = self.startNewPar(self.myDyad);
+                if newParID is None:
+                    # Game done. All NUM_OF_PARS_PER_ROUND paragraphs have
+                    # been communicated. Add a CR to the CSV file to finish
+                    # the row for this round:
+                    with open(EchoTreeLogService.gameOutputFilePath, 'a') as fd:
+                        fd.write("\n");
+                    self.handleGameDone(self.myDyad);
+                    return;
+    
+    def offersCompactProtocol(self, testReplyArr):
+        '''
+        Determine whether the browser's reply to the test message offers
+        the compact protocol version this server speaks, and whether this
+        connection can carry binary frames at all (Draft-76 cannot).
+        @param testReplyArr: the browser's test message, split at OP_CODE_SEPARATOR.
+        @type testReplyArr: [string]
+        @rtype: boolean
+        '''
+        if len(testReplyArr) < 2 or isinstance(self.ws_connection, WebSocketProtocol76):
+            return False;
+        for arg in testReplyArr[1].split(ARGS_SEPARATOR):
+            if arg.startswith(PROTOCOLS_OFFER_PREFIX):
+                offeredVersions = arg[len(PROTOCOLS_OFFER_PREFIX):].split(',');
+                return str(compact_protocol.COMPACT_PROTOCOL_VERSION) in offeredVersions;
+        return False;
+    
+    def sendEvent(self, opName, *fields):
+        '''
+        Send one message to this handler's browser. With the text
+        protocol the message goes out immediately. With the compact 
+        protocol, events are collected, and all events generated
+        during one pass through the IOLoop leave in a single binary frame.
+        @param opName: message opcode, such as 'addWord'
+        @type opName: string
+        @param fields: the message's arguments
+        @type fields: string
+        '''
+        if not self.compactProtocol:
+            self.write_message(opName + OP_CODE_SEPARATOR + ARGS_SEPARATOR.join(fields));
+            return;
+        if len(self.pendingEvents) == 0:
+            IOLoop.instance().add_callback(self.flushEvents);
+        self.pendingEvents.append((opName, fields));
+        
+    def flushEvents(self):
+        '''
+        Send all pending compact protocol events in one frame.
+        '''
+        if len(self.pendingEvents) == 0:
+            return;
+        events = self.pendingEvents;
+        self.pendingEvents = [];
+        try:
+            super(EchoTreeLogService, self).write_message(compact_protocol.encodeEvents(events), binary=True);
+        except AttributeError:
+            # Connection closed before the frame went out: 
+            pass;
+        
+    def write_message(self, message, binary=False):
+        '''
+        Send a text message. Any compact protocol events that are
+        still pending go out first, so that messages arrive in
+        the order in which they were sent.
+        '''
+        if len(self.pendingEvents) > 0:
+            self.flushEvents();
+        super(EchoTreeLogService, self).write_message(message, binary);
     
     def handleGameDone(self, completedDyad):
         # This dyad is done:
         completedDyad.setDyadCompleted();
+        # Scheduled players move on to their next round:
+        SessionSchedule.roundPlayed(completedDyad.disabledID(), completedDyad.partnerID());
+        SessionSchedule.roundPlayed(completedDyad.partnerID(), completedDyad.disabledID());
         # Have these two players played enough games for
         # their experiment to be complete?
         with LoadedParticipants():
             thisParticipant = EchoTreeLogService.participantDict[self.myPlayerID];
             
-        numPlayed = thisParticipant.playedWith(self.myPartnersID);
+        # Scheduled rounds are recorded before they are played:
+        numPlayed = thisParticipant.playedWith(self.myPartnersID) - SessionSchedule.numRoundsLeft(self.myPlayerID, self.myPartnersID);
         if numPlayed >= 2:
             # Experiment done:
             completedDyad.thisHandler.write_message("done" + OP_CODE_SEPARATOR);
@@ -960,18 +1567,9 @@ class EchoTreeLogService(WebSocketHandler):
         if thisEmail == thatEmail:
             # Something wrong. To recover, check whether any open
             # dyad involves this player. If so, delete that dyad:
-            try:
-                with EchoTreeLogService.dyadLock:
-                    defectivePlayersDyads = ExperimentDyad.allDyads[thisEmail];
-                    if defectivePlayersDyads is not None:
-                        newDyadChain = [];
-                        for dyad in defectivePlayersDyads:
-                            if dyad.isDyadLoggedIn():
-                                newDyadChain.append(dyad);
-                        ExperimentDyad.allDyads[thisEmail] = newDyadChain;
-            except KeyError:
-                # no diad chain needs repairing.
-                pass;
+            for dyad in ExperimentDyad.allDyads.dyadsOf(thisEmail):
+                if not dyad.isDyadLoggedIn():
+                    ExperimentDyad.allDyads.remove(dyad);
                 
             self.write_message("showMsg" + OP_CODE_SEPARATOR + "Back here it looks as if player '%s' is trying to play with another player of the same name. " % thisEmail +\
                                "Trying to recover. Please go to the starting URL. So sorry.");
@@ -982,10 +1580,14 @@ class EchoTreeLogService(WebSocketHandler):
         self.myPartnersID = thatEmail;
         self.myRole       = role;
         
-        # Check whether these two players played together more than twice:
+        # Check whether these two players played together more than twice.
+        # Scheduled rounds are recorded before they are played. Asked
+        # outside the participant lock, which scheduleSession() takes
+        # while holding the schedule lock:
+        numRoundsLeft = SessionSchedule.numRoundsLeft(self.myPlayerID, self.myPartnersID);
         with LoadedParticipants():
             thisParticipant = EchoTreeLogService.participantDict[self.myPlayerID];
-            numPlayed = thisParticipant.playedWith(self.myPartnersID);
+            numPlayed = thisParticipant.playedWith(self.myPartnersID) - numRoundsLeft;
             if numPlayed > 2:
                 msg = "The two of you have already played two games together. The experiment " +\
                       "is designed to have each pair play two games. If you are trying again because " +\
@@ -997,84 +1599,79 @@ class EchoTreeLogService(WebSocketHandler):
                 self.write_message("pleaseClose" + OP_CODE_SEPARATOR + msg);
                 return;
         
-        with EchoTreeLogService.dyadLock:
-            try:
-                thisPlayersDyads = ExperimentDyad.allDyads[thisEmail];
-                for dyad in thisPlayersDyads:
-                    # Skip old dyads that are complete:
-                    if dyad.isDyadCompleted():
-                        continue;
-                    dyadDisabledID = dyad.disabledID();
-                    dyadPartnerID  = dyad.partnerID();
-                    if (thisEmail == dyadDisabledID and thatEmail == dyadPartnerID) or \
-                       (thisEmail == dyadPartnerID and thatEmail == dyadDisabledID):
-                        # Found waiting dyad:
-                        # The thisHandler was set when dyad was created. Now 
-                        # set that of the partner:
-                        dyad.setThatHandler(self);
-                        self.myDyad = dyad;
-                        if dyad.isDyadLoggedIn():
-                            EchoTreeLogService.log("Player logging into an already logged-in dyad with the same partner: " + str(msgArr));
-                            return;
-                        dyad.setDyadLoggedIn(state=True);
-                        # If this logging-in player is a partner, have
-                        # him subscribe to the disabled's tree:
-                        if self.myRole == Role.PARTNER: 
-                            msg = 'subscribeToTree' + OP_CODE_SEPARATOR + str(self.myPartnersID) + ARGS_SEPARATOR + str(dyad.condition());
-                            self.write_message(msg);
-                        else:
-                            # I'm the disabled player:
-                            msg = 'subscribeToTree' + OP_CODE_SEPARATOR + str(self.myPlayerID) + ARGS_SEPARATOR + str(dyad.condition());
-                            dyad.getPartnerHandler().write_message(msg);
-                        EchoTreeLogService.log("Dyad complete: %s/%s" % (thisEmail, thatEmail));
-                        self.write_message('dyadComplete' + OP_CODE_SEPARATOR);
-                        # Notify the already waiting player. When players hit the re-load button,
-                        # there can be a race condition, in which thisHandler is set to
-                        # None, even after we check for that condition. So instead of 
-                        # checking we use try/catch:
-                        thisHandler = dyad.getThisHandler();
-                        try:
-                            thisHandler.write_message("dyadComplete" + OP_CODE_SEPARATOR);
-                        except AttributeError:
-                            EchoTreeLogService.log("Found thisHandler to be None: dyad's disabledID: %s. dyad's partnerID: %s" % (str(dyadDisabledID), str(dyadPartnerID)));
-                            # Close the web socket; on_close() will do cleanup:
-                            try:
-                                self.write_message('showMsg' + OP_CODE_SEPARATOR + 'You and your partner are out of sync. Please: both refresh your Web page with the Reload button.');
-                                self.close();
-                            except Exception as e:
-                                self.log("Handler found dead as we try to write 'dyadComplete', then exception when trying to notify *this* player: " + `e`);
-                            return;
-                        
-                        self.startNewPar(dyad);
-                        return
-                    
-                # Dyad chain for the player who is checking in was found,
-                # but none of those dyads represented a game of this player with 
-                # that other player. Create a new open dyad and link it to this
-                # player's existing chain of dyads:
-                newDyad = ExperimentDyad(self, role, disabledEmail, partnerEmail);
+        dyad = ExperimentDyad.allDyads.get(thisEmail, thatEmail);
+        if dyad is not None and dyad.isResumed():
+            # Dyad was restored after a server restart. The first of its
+            # players to come back waits for the other:
+            with dyad.dyadLock:
+                if dyad.getThisHandler() is None:
+                    dyad.setFirstHandler(self, role);
+                    self.myDyad = dyad;
+                    self.write_message("waitForPlayer" + OP_CODE_SEPARATOR + thatEmail);
+                    EchoTreeLogService.log("Restored dyad waiting: %s/%s" % (thisEmail, thatEmail));
+                    return;
+        if dyad is None or dyad.isDyadCompleted():
+            # The other player has not logged in yet. Create
+            # a new dyad with this handler as the first argument,
+            # and the player ids as the rest:
+            newDyad = ExperimentDyad(self, role, disabledEmail, partnerEmail);
+            # Select an exerimental condition:
+            initialCondition = least_common(thisParticipant.getConditionByPlaymate(thatEmail));
+            assert(initialCondition is not None);
+            newDyad.setCondition(initialCondition);
+            # Register the new dyad, unless the other player
+            # registered one for the two of them in the meantime:
+            dyad = ExperimentDyad.allDyads.addIfAbsent(newDyad);
+            if dyad is newDyad:
                 self.myDyad = newDyad;
-                # Register this new dyad under both names so that we can find it:
-                ExperimentDyad.allDyads[thisEmail].append(newDyad);
-                ExperimentDyad.allDyads[thatEmail].append(newDyad);
                 self.write_message("waitForPlayer" + OP_CODE_SEPARATOR + thatEmail);
                 EchoTreeLogService.log("Dyad created and waiting: %s/%s" % (thisEmail, thatEmail));
                 return;
-            except KeyError:
-                # The other player has not logged in yet. Create
-                # a new dyad with this handler as the first argument,
-                # and the player ids as the rest:
-                newDyad = ExperimentDyad(self, role, disabledEmail, partnerEmail);
-                self.myDyad = newDyad;
-                # Select an exerimental condition:
-                initialCondition = least_common(thisParticipant.getConditionByPlaymate(thatEmail));
-                assert(initialCondition is not None);
-                newDyad.setCondition(initialCondition);
-                ExperimentDyad.allDyads[thisEmail] = [newDyad];
-                ExperimentDyad.allDyads[thatEmail] = [newDyad];
-                self.write_message("waitForPlayer" + OP_CODE_SEPARATOR + thatEmail);
-                EchoTreeLogService.log("Dyad created and waiting: %s/%s" % (thisEmail, thatEmail));
+
+        # Found waiting dyad:
+        with dyad.dyadLock:
+            dyadDisabledID = dyad.disabledID();
+            dyadPartnerID  = dyad.partnerID();
+            # The thisHandler was set when dyad was created. Now 
+            # set that of the partner:
+            dyad.setThatHandler(self);
+            self.myDyad = dyad;
+            if dyad.isDyadLoggedIn():
+                EchoTreeLogService.log("Player logging into an already logged-in dyad with the same partner: " + str(msgArr));
                 return;
+            dyad.setDyadLoggedIn(state=True);
+            # If this logging-in player is a partner, have
+            # him subscribe to the disabled's tree:
+            if self.myRole == Role.PARTNER: 
+                msg = 'subscribeToTree' + OP_CODE_SEPARATOR + str(self.myPartnersID) + ARGS_SEPARATOR + str(dyad.condition());
+                self.write_message(msg);
+            else:
+                # I'm the disabled player:
+                msg = 'subscribeToTree' + OP_CODE_SEPARATOR + str(self.myPlayerID) + ARGS_SEPARATOR + str(dyad.condition());
+                dyad.getPartnerHandler().write_message(msg);
+            EchoTreeLogService.log("Dyad complete: %s/%s" % (thisEmail, thatEmail));
+            self.write_message('dyadComplete' + OP_CODE_SEPARATOR);
+            # Notify the already waiting player. When players hit the re-load button,
+            # there can be a race condition, in which thisHandler is set to
+            # None, even after we check for that condition. So instead of 
+            # checking we use try/catch:
+            thisHandler = dyad.getThisHandler();
+            try:
+                thisHandler.write_message("dyadComplete" + OP_CODE_SEPARATOR);
+            except AttributeError:
+                EchoTreeLogService.log("Found thisHandler to be None: dyad's disabledID: %s. dyad's partnerID: %s" % (str(dyadDisabledID), str(dyadPartnerID)));
+                # Close the web socket; on_close() will do cleanup:
+                try:
+                    self.write_message('showMsg' + OP_CODE_SEPARATOR + 'You and your partner are out of sync. Please: both refresh your Web page with the Reload button.');
+                    self.close();
+                except Exception as e:
+                    self.log("Handler found dead as we try to write 'dyadComplete', then exception when trying to notify *this* player: " + `e`);
+                return;
+            
+            if dyad.isResumed():
+                self.resumePar(dyad);
+            else:
+                self.startNewPar(dyad);
 
     def getMyPlayerID(self):
         return self.myPlayerID;
@@ -1104,14 +1701,81 @@ class EchoTreeLogService(WebSocketHandler):
         topicKeyword = topicPlusParArr[0];
         # *******  The 1 can cause an IndexError. Deal with that.
         par = topicPlusParArr[1];
-        dyad.getDisabledHandler().write_message('newPar' + OP_CODE_SEPARATOR + str(parID) + ARGS_SEPARATOR + par);
-        dyad.getPartnerHandler().write_message('newPar' + OP_CODE_SEPARATOR + topicKeyword);
+        dyad.getDisabledHandler().sendEvent('newPar', str(parID), par);
+        dyad.getPartnerHandler().sendEvent('newPar', topicKeyword);
         return parID;
+    
+    def resumePar(self, dyad):
+        '''
+        Continue the game of a dyad that was restored after a server
+        restart, once both players are back. If a paragraph was in
+        progress, both players get it again, followed by everything
+        that had been typed so far. Otherwise the next paragraph starts.
+        @param dyad: restored dyad whose players both logged in again.
+        @type dyad: ExperimentDyad
+        '''
+        dyad.setResumed(False);
+        curParScore = dyad.currentParScore();
+        if curParScore is None or curParScore.stopTime != 0:
+            if self.startNewPar(dyad) is None:
+                # Server went down between the last paragraph and the end of the game:
+                self.handleGameDone(dyad);
+            return;
+        # Re-send the interrupted paragraph:
+        topicPlusParArr = EchoTreeLogService.paragraphs[curParScore.parID].split(ARGS_SEPARATOR);
+        dyad.getDisabledHandler().sendEvent('newPar', str(curParScore.parID), topicPlusParArr[1]);
+        dyad.getPartnerHandler().sendEvent('newPar', topicPlusParArr[0]);
+        for token in curParScore.tickerTokens:
+            dyad.getDisabledHandler().sendEvent('addWord', token);
+            dyad.getPartnerHandler().sendEvent('addWord', token);
+        EchoTreeLogService.log("Resumed paragraph %d of dyad %s/%s after %d tokens." %\
+                               (curParScore.parID, dyad.disabledID(), dyad.partnerID(), len(curParScore.tickerTokens)));
 
+    @staticmethod
+    def restoreDyads(journal):
+        '''
+        Rebuild the dyads that were live when the server last stopped,
+        and start journaling all further changes. Restored dyads wait
+        for both of their players to log in again.
+        @param journal: journal from which to recover, and to which to record.
+        @type journal: DyadJournal
+        @return: number of restored dyads
+        @rtype: int
+        '''
+        dyadStates = journal.recover();
+        restoredDyads = [];
+        completedDyadIDs = [];
+        for dyadID, dyadState in dyadStates.items():
+            if dyadState['completed']:
+                completedDyadIDs.append(dyadID);
+                continue;
+            dyad = ExperimentDyad.restore(dyadID, dyadState);
+            ExperimentDyad.allDyads.addIfAbsent(dyad);
+            restoredDyads.append(dyad);
+        ExperimentDyad.journal = journal;
+        for dyadID in completedDyadIDs:
+            journal.record('remove', dyadID);
+        for dyad in restoredDyads:
+            # Restored dyads are not logged in, and have
+            # not written anything to this run's CSV file:
+            dyad.journalDelta('loggedIn', False);
+            dyad.journalDelta('saved', 0);
+        journal.start();
+        EchoTreeLogService.log("Restored %d dyads from the dyad journal." % len(restoredDyads));
+        return len(restoredDyads);
+    
     @staticmethod
     def decideNewPlayersRoleAndCondition(contactingPlayerEmail, friendEmail):
         
+        # Pairs of a scheduled session had their assignments computed,
+        # and their contacts recorded, ahead of time. Both players get
+        # the current round's assignment until its game is done:
+        scheduledAssignment = SessionSchedule.currentAssignment(contactingPlayerEmail, friendEmail);
+        if scheduledAssignment is not None:
+            return scheduledAssignment;
+        
         # Get or create contacting player's participant's permanent record::
+        recordContact = True;
         with LoadedParticipants():
             try:
                 try:
@@ -1128,66 +1792,65 @@ class EchoTreeLogService(WebSocketHandler):
                 # then the role and conditions to play are completely constrained
                 # by what the player who logged in first was assigned as role and
                 # condition: 
-                with EchoTreeLogService.dyadLock:
-                    try:
-                        newPlayersDyads = ExperimentDyad.allDyads[contactingPlayerEmail];
-                    except KeyError:
-                        newPlayersDyads = [];
-                    for dyad in newPlayersDyads:
-                        # Check this player's open dyads (the ones waiting for login):
-                        if (dyad.isOpen() and (dyad.disabledID() == friendEmail)):
-                            # Dyad was opened for a friend of the new player. So the
-                            # new player must get the opposite role:
-                            newRole      = Role.PARTNER;
-                            newCondition = dyad.condition(); 
-                            return (newRole, newCondition);
-                        elif (dyad.isOpen()  and (dyad.partnerID() == friendEmail)):
-                            newRole = Role.DISABLED;
-                            newCondition = dyad.condition();
-                            return (newRole, newCondition); 
-        
-                    # No open dyad. 
-                    # Find whether contacting player has played with this
-                    # friend before:
-                    newRole      = contactingParticipant.nextRole();
-                    newCondition = contactingParticipant.nextCondition(friendParticipant);
-                    return(newRole, newCondition);
+                dyad = ExperimentDyad.allDyads.get(contactingPlayerEmail, friendEmail);
+                # Check for an open dyad (one waiting for login):
+                if (dyad is not None) and dyad.isOpen():
+                    if dyad.isResumed():
+                        # Game interrupted by a server restart. The contact
+                        # was recorded when the game first started:
+                        recordContact = False;
+                    if (dyad.disabledID() == friendEmail):
+                        # Dyad was opened for a friend of the new player. So the
+                        # new player must get the opposite role:
+                        newRole      = Role.PARTNER;
+                        newCondition = dyad.condition(); 
+                        return (newRole, newCondition);
+                    else:
+                        newRole = Role.DISABLED;
+                        newCondition = dyad.condition();
+                        return (newRole, newCondition); 
+    
+                # No open dyad. 
+                # Find whether contacting player has played with this
+                # friend before:
+                newRole      = contactingParticipant.nextRole();
+                newCondition = contactingParticipant.nextCondition(friendParticipant);
+                return(newRole, newCondition);
 
             finally:
-                contactingParticipant.addContact(friendEmail, newRole, newCondition);
-                EchoTreeLogService.participantDict[contactingPlayerEmail] = contactingParticipant;
+                if recordContact:
+                    contactingParticipant.addContact(friendEmail, newRole, newCondition);
+                    EchoTreeLogService.participantDict[contactingPlayerEmail] = contactingParticipant;
                 
     
     @staticmethod
     def deletePlayer(playerID):
-        with EchoTreeLogService.dyadLock:
-            try:
-                playerDyadChainCopy = copy.copy(ExperimentDyad.allDyads[playerID]);
-                playerDyadChain = ExperimentDyad.allDyads[playerID];
-            except KeyError:
-                # No dyads for this player exist: done.
-                return;
-            for dyad in playerDyadChainCopy:
+        for dyad in ExperimentDyad.allDyads.dyadsOf(playerID):
+            with dyad.dyadLock:
                 # if this dyad is open, two possibilities:
                 #   1. this dying player created the dyad ==> delete the dyad
-                #   2. another, still healthy player created this dyad, put it
-                #      into this dying player's list, and is not waiting
-                #      for this dying player. ==> don't delete the dyad, b/c when this
-                #      dying player logs in after dying, it should find and connect
-                #      into that waiting dyad:
+                #   2. another, still healthy player created this dyad, 
+                #      and is now waiting for this dying player. ==> don't 
+                #      delete the dyad, b/c when this dying player logs in 
+                #      after dying, it should find and connect into that 
+                #      waiting dyad:
                 if not dyad.isDyadLoggedIn():
+                    if dyad.isResumed():
+                        # Keep restored dyads until both players are back:
+                        dyad.clearHandlers();
+                        continue;
                     if dyad.instantiatingPlayerID() == playerID:
-                        playerDyadChain.remove(dyad);
+                        ExperimentDyad.allDyads.remove(dyad);
                     continue;
                 # Dyad is complete: save the dyad before deleting it:
                 if not dyad.savedToFile:
                     dyad.saveToCSV();
-                # Dyad was logged in. We saved it. Now:  
-                # declare this dyad open (for the benefit of the
-                # still-alive partner), but delete this copy of
-                # the dyad from the list of this player's dyads:
+                # Dyad was logged in. We saved it. Now declare this dyad 
+                # not logged in, and remove it from the registry. The 
+                # surviving player is asked to sign in again, which will
+                # create a fresh dyad:
                 dyad.setDyadLoggedIn(state=False);
-                playerDyadChain.remove(dyad);
+                ExperimentDyad.allDyads.remove(dyad);
                 try:
                     #dyad.getThatHandler().sendMsgToBrowser('Your opposite player disconnected from the game. Ask him/her to refresh their Web page.');
                     dyad.getThatHandler().write_message("pleaseClose" + OP_CODE_SEPARATOR + "The other player closed its connection to the server. Please sign in again."); 
@@ -1201,16 +1864,10 @@ class EchoTreeLogService(WebSocketHandler):
 
     @staticmethod
     def deleteDyad(dyad):
-        if dyad.isDyadLoggedIn() and not dyad.savedToFile:
-            dyad.saveToCSV();
-            
-        with EchoTreeLogService.dyadLock:
-            for playerID, dyadChain in ExperimentDyad.allDyads.items():
-                try:
-                    dyadChain.remove(dyad);
-                except ValueError:
-                    # The chain didn't have the dyad in in.
-                    pass
+        with dyad.dyadLock:
+            if dyad.isDyadLoggedIn() and not dyad.savedToFile:
+                dyad.saveToCSV();
+            ExperimentDyad.allDyads.remove(dyad);
 
     @staticmethod
     def log(theStr, addTimestamp=True):
@@ -1255,80 +1912,71 @@ class EchoTreeExperimentPageRequestHandler(HTTPServer):
 #    def _execute(self, transforms):
 #        pass;
 
+    # Preloaded browser_scripts files. Created on first request,
+    # or by main() before the page server starts:
+    assetCache = None;
+
+    @staticmethod
+    def getAssetCache():
+        if EchoTreeExperimentPageRequestHandler.assetCache is None:
+            EchoTreeExperimentPageRequestHandler.assetCache = StaticAssetCache(BROWSER_SCRIPTS_DIR);
+        return EchoTreeExperimentPageRequestHandler.assetCache;
+
     @staticmethod
     def handle_request(request):
         '''
         Handles the HTTP GET request. the request.path property holds
         /disabled.html, or /partner.css, or manageExperiment.js, etc.
+        Files are served from the in-memory asset cache.
         @param request: instance holding information about the request
         @type request: tornado.httpserver.HTTPRequest
         '''
-        # Path to the directory with all the material we serve.
-        #Should probably just load that once, but this request is not frequent.
-        scriptDir = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                  "../browser_scripts/");
-        isGetAssignment = False;                                  
-        if (request.path == "/"):
-            scriptPath = os.path.join(scriptDir, "index.html");
-        elif (os.path.split(request.path)[1] == 'getAssignment'):
+        if (os.path.split(request.path)[1] == 'getAssignment'):
             # Requested 'file' ended in getAssignment, so it's the initial form submission:
-            isGetAssignment = True;
+            EchoTreeExperimentPageRequestHandler.handleGetAssignment(request);
+            return;
+
+        if (request.path == "/"):
+            relPath = "index.html";
         else:
-            scriptPath = os.path.join(scriptDir, request.path[1:]);
-
-        mimeType = HTML_MIME;
-        reqPath  = request.path;
-        if reqPath.endswith('.css'):
-            mimeType = CSS_MIME;
-
-        elif reqPath.endswith(".js") or isGetAssignment:
-            mimeType = JS_MIME;
-
-        if (isGetAssignment):
-            requestURL = request.full_url();
-            urlFragTuple = urlparse.urlsplit(requestURL);
-            urlRoot = urlFragTuple.scheme + "://" + urlFragTuple.netloc + '/';
-            # Query part of URL is like this: 'ownEmail=me@google&otherEmail=you@google'
-            urlQuery = urlFragTuple.query;
-            # Get this type of struct: dict: {'ownEmail': ['me@google.com'], 'otherEmail': ['you@google.com']}
-            emailInfoDict = urlparse.parse_qs(urlQuery);
-            try:
-                (roleToAssign,condition) = EchoTreeLogService.decideNewPlayersRoleAndCondition(emailInfoDict['ownEmail'][0], emailInfoDict['otherEmail'][0]);
-            except KeyError:
-                EchoTreeLogService.log("Initial contact does not provide emails. Dict is: %s" % str(emailInfoDict));
-                return;
-            if roleToAssign == Role.DISABLED:
-                assignedScriptURL = urlRoot + 'disabled.html';
-            else:
-                assignedScriptURL = urlRoot + 'partner.html';
-            
-            contentLen = len(assignedScriptURL);
-            lastModTime = time.time();
+            relPath = request.path[1:];
+        if not EchoTreeExperimentPageRequestHandler.getAssetCache().serve(request, relPath):
+            EchoTreeLogService.log("Non-existing script path requested by some browser: %s" % str(relPath));
+
+    @staticmethod
+    def handleGetAssignment(request):
+        '''
+        Answer the initial form submission with the URL of the page
+        the player is to load: disabled.html or partner.html.
+        @param request: instance holding information about the request
+        @type request: tornado.httpserver.HTTPRequest
+        '''
+        requestURL = request.full_url();
+        urlFragTuple = urlparse.urlsplit(requestURL);
+        urlRoot = urlFragTuple.scheme + "://" + urlFragTuple.netloc + '/';
+        # Query part of URL is like this: 'ownEmail=me@google&otherEmail=you@google'
+        urlQuery = urlFragTuple.query;
+        # Get this type of struct: dict: {'ownEmail': ['me@google.com'], 'otherEmail': ['you@google.com']}
+        emailInfoDict = urlparse.parse_qs(urlQuery);
+        try:
+            (roleToAssign,condition) = EchoTreeLogService.decideNewPlayersRoleAndCondition(emailInfoDict['ownEmail'][0], emailInfoDict['otherEmail'][0]);
+        except KeyError:
+            EchoTreeLogService.log("Initial contact does not provide emails. Dict is: %s" % str(emailInfoDict));
+            return;
+        if roleToAssign == Role.DISABLED:
+            assignedScriptURL = urlRoot + 'disabled.html';
         else:
-            if not os.path.exists(scriptPath):
-                EchoTreeLogService.log("Non-existing script path requested by some browser: %s" + str(scriptPath));
-                return;
-            contentLen  = os.path.getsize(scriptPath);
-            lastModTime = time.ctime(os.path.getmtime(scriptPath));
-        
+            assignedScriptURL = urlRoot + 'partner.html';
 
-        # Create the response and the HTML page string:
+        # Create the response and the page URL string:
         reply =  "HTTP/1.1 200 OK\r\n" +\
-                 "Content-Type:" + mimeType + "\r\n" +\
-                 "Content-Length:%s\r\n" % contentLen +\
-                 "Last-Modified:%s\r\n" % lastModTime +\
-                 "\r\n";
-
-        if (isGetAssignment):
-            # Add the URL of the page the assignment-requesting user is to load:
-            reply += assignedScriptURL;
-        else:
-            # Add the HTML page to the header:
-            with open(scriptPath) as fileFD:
-                for line in fileFD:
-                    reply += line;
+                 "Content-Type:" + JS_MIME + "\r\n" +\
+                 "Content-Length:%s\r\n" % len(assignedScriptURL) +\
+                 "Last-Modified:%s\r\n" % time.time() +\
+                 "Cache-Control: no-store\r\n" +\
+                 "\r\n" +\
+                 assignedScriptURL;
         request.write(reply);
-        #self.set_header("Content-Type", mimeType);
         request.finish();
         
 # --------------------  Request Handler Class for browsers requesting the JavaScript that knows to open a disabled or partner connection ---------------
@@ -1347,24 +1995,9 @@ class EchoTreeExperimentPartnerRequestHandler(HTTPServer):
         '''
         Hangles the HTTP GET request.
         @param request: instance holding information about the request
-        @type request: ???
+        @type request: tornado.httpserver.HTTPRequest
         '''
-        # Path to the HTML page we serve. Should probably just load that once, but
-        # this request is not frequent. 
-        scriptPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 
-                                  "../browser_scripts/" + PARTNER_PAGE_NAME);
-        # Create the response and the HTML page string:
-        reply =  "HTTP/1.1 200 OK\r\n" +\
-                 "Content-type, text/html\r\n" +\
-                 "Content-Length:%s\r\n" % os.path.getsize(scriptPath) +\
-                 "Last-Modified:%s\r\n" % time.ctime(os.path.getmtime(scriptPath)) +\
-                 "\r\n";
-        # Add the HTML page to the header:
-        with open(scriptPath) as fileFD:
-            for line in fileFD:
-                reply += line;
-        request.write(reply);
-        request.finish();
+        EchoTreeExperimentPageRequestHandler.getAssetCache().serve(request, PARTNER_PAGE_NAME);
         
         
 # --------------------  Helper class for spawning the services in their own threads ---------------
@@ -1484,11 +2117,17 @@ if __name__ == '__main__':
     EchoTreeLogService.log("Starting EchoTree experiment server at port %s: Interacts with participants." % (str(ECHO_TREE_EXPERIMENT_SERVICE_PORT) + ":/echo_tree_experiment"));
     application = tornado.web.Application([(r"/echo_tree_experiment", EchoTreeLogService),                                           
                                            ]);
-    # Create the service that serves out the Web pages and JS:
+    # Create the service that serves out the Web pages and JS,
+    # loading all pages and scripts into memory first:
+    EchoTreeExperimentPageRequestHandler.getAssetCache();
     pageAndJSServer = SocketServerThreadStarter('EchoTreeExperimentPageRequestHandler', ECHO_TREE_PAGE_SERVICE_PORT); 
     pageAndJSServer.start();
                                            
                                            
+    # Rebuild the dyads that were playing when the server
+    # last went down, and journal all changes from now on:
+    EchoTreeLogService.restoreDyads(DyadJournal(DYAD_JOURNAL_PATH, DYAD_SNAPSHOT_PATH));
+    
     application.listen(ECHO_TREE_EXPERIMENT_SERVICE_PORT);
     
     try:
@@ -1505,6 +2144,7 @@ if __name__ == '__main__':
         if ioLoop.running():
             ioLoop.stop();
         pageAndJSServer.stop();
+        ExperimentDyad.journal.close();
         EchoTreeLogService.log("EchoTree experiment server stopped.");
         if EchoTreeLogService.logFD is not None:
             EchoTreeLogService.logFD.close();
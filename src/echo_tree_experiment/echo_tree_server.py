@@ -27,6 +27,7 @@ from tornado.httpserver import HTTPServer;
 
 from echo_tree import WordExplorer;
 from echo_tree import ARITY;
+from static_asset_cache import StaticAssetCache;
 
 # The following port is only used if this echo tree server
 # runs by itself, outside the context of a user experiment:
@@ -628,29 +629,20 @@ class EchoTreeScriptRequestHandler(tornado.web.RequestHandler):
     def _execute(self, request):
         EchoTreeScriptRequestHandler.handle_request(self.request);
         
+    # Cache over browser_scripts; created on first request:
+    assetCache = None;
+
     @staticmethod
     def handle_request(request):
         '''
-        Handles the HTTP GET request.
+        Handles the HTTP GET request. The page is served from
+        an in-memory cache that is refreshed when the file changes.
         @param request: instance holding information about the request
-        @type request: ???
+        @type request: tornado.httpserver.HTTPRequest
         '''
-        # Path to the HTML page we serve. Should probably just load that once, but
-        # this request is not frequent. 
-        scriptPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../browser_scripts/static/" + TREE_EVENT_LISTEN_SCRIPT_NAME);
-        # Create the response and the HTML page string:
-        
-        reply =  "HTTP/1.1 200 OK\r\n" +\
-                 "Content-type, text/html\r\n" +\
-                 "Content-Length:%s\r\n" % os.path.getsize(scriptPath) +\
-                 "Last-Modified:%s\r\n" % time.ctime(os.path.getmtime(scriptPath)) +\
-                 "\r\n";
-        # Add the HTML page to the header:
-        with open(scriptPath) as fileFD:
-            for line in fileFD:
-                reply += line;
-        request.write(reply);
-        request.finish();
+        if EchoTreeScriptRequestHandler.assetCache is None:
+            EchoTreeScriptRequestHandler.assetCache = StaticAssetCache(os.path.join(scriptDir, "../browser_scripts"));
+        EchoTreeScriptRequestHandler.assetCache.serve(request, "static/" + TREE_EVENT_LISTEN_SCRIPT_NAME);
         
 # --------------------  Helper class for spawning the services in their own threads ---------------
                 
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+'''
+Simple Good-Turing frequency estimation (Gale & Sampson, "Good-Turing
+Frequency Estimation Without Tears"), as implemented by Sampson's
+goodTuringSmoothing.c. Computes the same estimates in process, from
+the frequencies of frequencies of an n-gram table, so the database
+builder needs neither the compiled tool nor a text round trip.
+
+Run as a script, the module is a drop-in replacement for the C tool:
+it reads (frequency, frequency-of-frequency) pairs from stdin, and
+writes 'r,p' lines in the tool's output format to stdout.
+'''
+
+import sys;
+import math;
+
+# Number of standard deviations by which the Turing estimate must differ
+# from the smoothed estimate to be used. 1.96 is p < 0.05; Gale & Sampson
+# used 1.65 (p < 0.1) in their experiments:
+CONFID_FACTOR = 1.96;
+
+# Fewest distinct frequencies for which the regression is meaningful:
+MIN_INPUT = 5;
+
+def simpleGoodTuring(freqOfFreqs, confidFactor=CONFID_FACTOR):
+    '''
+    Estimate the probability of an item for each observed frequency.
+    @param freqOfFreqs: maps each observed frequency r to the number n_r of items seen r times.
+    @type freqOfFreqs: {int : int}
+    @param confidFactor: switching criterion between Turing and smoothed estimates.
+    @type confidFactor: float
+    @return: (P0, the joint probability of all unseen items; dict mapping each r to p_r).
+    @rtype: (float, {int : float})
+    @raise ValueError: if there are fewer than MIN_INPUT distinct frequencies,
+                       or a frequency or frequency of frequency is not positive.
+    '''
+    if len(freqOfFreqs) < MIN_INPUT:
+        raise ValueError("Need at least %d distinct frequencies for Simple Good-Turing; got %d." % (MIN_INPUT, len(freqOfFreqs)));
+    r = sorted(freqOfFreqs.keys());
+    n = [freqOfFreqs[freq] for freq in r];
+    if r[0] < 1 or min(n) < 1:
+        raise ValueError("Frequencies and frequencies of frequencies must be positive.");
+    rows = len(r);
+    bigN = sum(r[j] * n[j] for j in xrange(rows));
+    pZero = freqOfFreqs.get(1, 0) / float(bigN);
+
+    # Average the n_r over the gaps between observed frequencies,
+    # and fit log(Z_r) = intercept + slope * log(r):
+    logR = [];
+    logZ = [];
+    for j in xrange(rows):
+        i = 0 if j == 0 else r[j - 1];
+        k = float(2 * r[j] - i) if j == rows - 1 else float(r[j + 1]);
+        logR.append(math.log(r[j]));
+        logZ.append(math.log(2 * n[j] / (k - i)));
+    meanX = sum(logR) / rows;
+    meanY = sum(logZ) / rows;
+    xys = sum((x - meanX) * (y - meanY) for (x, y) in zip(logR, logZ));
+    xSquares = sum((x - meanX) ** 2 for x in logR);
+    slope = xys / xSquares;
+    intercept = meanY - slope * meanX;
+    smoothed = lambda freq: math.exp(intercept + slope * math.log(freq));
+
+    # Use the Turing estimate while it differs significantly from the
+    # smoothed one, and the smoothed estimate from then on:
+    rStar = [];
+    indiffValsSeen = False;
+    for j in xrange(rows):
+        y = (r[j] + 1) * smoothed(r[j] + 1) / smoothed(r[j]);
+        nextN = freqOfFreqs.get(r[j] + 1);
+        if nextN is None:
+            indiffValsSeen = True;
+        if not indiffValsSeen:
+            x = (r[j] + 1) * nextN / float(n[j]);
+            if abs(x - y) <= confidFactor * math.sqrt((r[j] + 1.0) ** 2 * nextN / float(n[j]) ** 2 * (1 + nextN / float(n[j]))):
+                indiffValsSeen = True;
+            else:
+                rStar.append(x);
+        if indiffValsSeen:
+            rStar.append(y);
+
+    # Renormalize so that the seen items share 1 - P0:
+    bigNPrime = sum(n[j] * rStar[j] for j in xrange(rows));
+    return (pZero, dict((r[j], (1 - pZero) * rStar[j] / bigNPrime) for j in xrange(rows)));
+
+def relativeFrequencies(freqOfFreqs):
+    '''
+    Maximum likelihood estimator: the probability of an n-gram with
+    count r is r divided by the total count of all n-grams.
+    @param freqOfFreqs: maps each count r to the number of n-grams with count r.
+    @type freqOfFreqs: {int : int}
+    @return: maps each count to its probability.
+    @rtype: {int : float}
+    '''
+    totalCount = sum(count * numNgrams for (count, numNgrams) in freqOfFreqs.items());
+    if totalCount == 0:
+        return {};
+    return dict((count, float(count) / totalCount) for count in freqOfFreqs.keys());
+
+def goodTuringProbabilities(freqOfFreqs):
+    '''
+    Estimator for NgramDatabaseWriter: Simple Good-Turing probabilities.
+    Tables with too few distinct frequencies for the regression fall
+    back to relative frequencies.
+    @param freqOfFreqs: maps each count r to the number of n-grams with count r.
+    @type freqOfFreqs: {int : int}
+    @return: maps each count to its probability.
+    @rtype: {int : float}
+    '''
+    if len(freqOfFreqs) < MIN_INPUT:
+        return relativeFrequencies(freqOfFreqs);
+    return simpleGoodTuring(freqOfFreqs)[1];
+
+def readFreqOfFreqs(fd):
+    '''
+    Read (frequency, frequency-of-frequency) pairs, one pair per line,
+    separated by whitespace or comma. Blank lines are ignored.
+    @param fd: file to read from
+    @type fd: file
+    @rtype: {int : int}
+    @raise ValueError: if a line does not hold exactly two positive integers.
+    '''
+    freqOfFreqs = {};
+    for lineNum, line in enumerate(fd):
+        fields = line.replace(',', ' ').split();
+        if len(fields) == 0:
+            continue;
+        try:
+            (freq, freqOfFreq) = [int(field) for field in fields];
+        except ValueError:
+            raise ValueError("Line %d is not a pair of integers: '%s'" % (lineNum + 1, line.strip()));
+        if freq < 1 or freqOfFreq < 1:
+            raise ValueError("Line %d holds a non-positive value: '%s'" % (lineNum + 1, line.strip()));
+        freqOfFreqs[freq] = freqOfFreq;
+    return freqOfFreqs;
+
+if __name__ == '__main__':
+    freqOfFreqs = readFreqOfFreqs(sys.stdin);
+    if len(freqOfFreqs) < MIN_INPUT:
+        print "\nFewer than %d input value-pairs" % MIN_INPUT;
+        sys.exit();
+    (pZero, probabilities) = simpleGoodTuring(freqOfFreqs);
+    print "0,%.4g" % pZero;
+    for freq in sorted(probabilities.keys()):
+        print "%d,%.4g" % (freq, probabilities[freq]);
@@ -4,34 +4,106 @@ import os
 import sys
 import re
 import argparse
-from collections import OrderedDict 
+import functools
+import time
+import multiprocessing
+import bisect
+from array import array
+
+from ngram_counts import Vocabulary, NgramCounts, SpillingBigramCounts
+from ngram_database import NgramDatabaseWriter, NgramDatabaseUpdater
+from binary_corpus import BinaryCorpusWriter, BinaryCorpus, BUILDER_VIEW, isBinaryCorpus
+import token_corpus
+from Tokenization.text_tokenizer import iterFileSentences
+from echo_tree import STOPWORDS
 
 
 # TODO:
 
-STOPWORDS =  ['a','able','about','across','after','all','almost','also','am','among','an','and','any',
-              'are','as','at','be','because','been','but','by','can','cannot','could','dear','did','do',
-              'does','either','else','ever','every','for','from','get','got','had','has','have','he',
-              'her','hers','him','his','how','however','i','if','in','into','is','it','its','just',
-              'least','let','like','likely','may','me','might','most','must','my','neither','no','nor',
-              'not','of','off','often','on','only','or','other','our','own','rather','said','say','says',
-              'she','should','since','so','some','than','that','the','their','them','then','there','these',
-              'they','this','tis','to','too','twas','us','wants','was','we','were','what','when','where',
-              'which','while','who','whom','why','will','with','would','yet','you','your',
-              'subject', 'cc', 'bcc', 'nbspb', 'mr.', 'inc.', 'one', 'two', 'three', 'four', 'five', 
-              'six', 'seven', 'eight', 'nine', 'ten', 'enron', 'http'];
+# Log progress every this many emails:
+LOG_MSG_INTERVAL = 1000;
+
+# Default memory budget for the in-memory run of out-of-core counting:
+DEFAULT_MAX_MEMORY_MB = 512;
 
 class DBCreator(object):
 
-    def __init__(self, dirToTokens, outFileName=None, maxNumSentences=None, logFile=None):
-        
+    def __init__(self, dirToTokens, outFileName=None, maxNumSentences=None, logFile=None, numWorkers=None, 
+                 spillDir=None, maxMemoryMB=DEFAULT_MAX_MEMORY_MB, outDbPath=None, update=False, rawText=False):
+        '''
+        Build the bigram CSV file from a directory of token chunk files.
+        Or, if outDbPath is provided, build the SQLite database that
+        WordDatabase opens, with its Bigrams and Trigrams tables.
+        @param dirToTokens: directory with the token chunk files, or a binary 
+                            corpus written by writeBinaryCorpus(). The output
+                            is the same for both.
+        @type dirToTokens: string
+        @param outFileName: path of the CSV file to write. None: write to stdout,
+                            unless outDbPath is provided.
+        @type outFileName: string
+        @param maxNumSentences: stop after this many sentences. Serial mode only.
+        @type maxNumSentences: int
+        @param logFile: path of log file. None: log to stdout.
+        @type logFile: string
+        @param numWorkers: if None, count in this process. Else count the chunk 
+                           files in a pool of this many worker processes, and 
+                           merge the partial counts. The CSV output is identical.
+        @type numWorkers: int
+        @param spillDir: if provided, count out of core: bigram counts are spilled
+                         to sorted run files in this directory whenever they exceed
+                         maxMemoryMB, and merged at the end. The CSV output is identical.
+        @type spillDir: string
+        @param maxMemoryMB: approximate memory budget for in-memory bigram counts
+                            when spillDir is provided. Does not cover the vocabulary.
+        @type maxMemoryMB: int
+        @param outDbPath: if provided, write an SQLite database to this path 
+                          instead of the CSV file. Trigrams are only counted 
+                          for the database, and are always held in memory.
+        @type outDbPath: string
+        @param update: if True, add just the chunk files that are not yet in the 
+                       existing database at outDbPath to that database.
+        @type update: boolean
+        @param rawText: if True, the chunk files in dirToTokens are untokenized text,
+                        which is tokenized in process by Tokenization.text_tokenizer,
+                        in the worker processes if there are any. No token files 
+                        are written.
+        @type rawText: boolean
+        '''
         
         if not os.path.isdir(dirToTokens):
             raise IOError("Directory to token chunk files must exist, and must contain files.");
         if maxNumSentences is not None and maxNumSentences <= 0:
             raise ValueError("Maximum number of sentences to process must be a postive integers.");
+        if numWorkers is not None and numWorkers <= 0:
+            raise ValueError("Number of worker processes must be a positive integer.");
+        if numWorkers is not None and maxNumSentences is not None:
+            raise ValueError("Maximum number of sentences is only supported when counting serially.");
+        if spillDir is not None and not os.path.isdir(spillDir):
+            raise IOError("Spill directory %s must exist." % spillDir);
+        if spillDir is not None and numWorkers is not None:
+            raise ValueError("Out-of-core counting is not supported with worker processes.");
+        if maxMemoryMB <= 0:
+            raise ValueError("Memory budget must be a positive number of megabytes.");
+        if outDbPath is not None and outFileName is not None:
+            raise ValueError("Write either a CSV file or a database, not both.");
+        if outDbPath is not None and not os.path.isdir(os.path.dirname(os.path.abspath(outDbPath))):
+            raise IOError("Directory for database %s must exist." % outDbPath);
+        if outDbPath is not None and maxNumSentences is not None:
+            raise ValueError("Databases record which chunk files they contain, so they must be built from entire chunk files.");
+        if update and outDbPath is None:
+            raise ValueError("Updates need the path of the database to update.");
+        corpus = None;
+        if isBinaryCorpus(dirToTokens):
+            if rawText:
+                raise ValueError("Binary corpora are already tokenized.");
+            if numWorkers is not None:
+                raise ValueError("Binary corpora are counted serially or out of core, not with worker processes.");
+            if maxNumSentences is not None:
+                raise ValueError("Maximum number of sentences is only supported when counting token chunk files.");
+            corpus = BinaryCorpus(dirToTokens, view=BUILDER_VIEW);
     
     
+        self.rawText = rawText;
         self.logFile = logFile;
         if self.logFile is not None:
             try:
@@ -51,62 +123,47 @@ class DBCreator(object):
             except IOError:
                 raise IOError("Cannot open output file %s for writing." % outFileName);
         
-        # (WordIndex is a static method, so no instantiation)
-        tokenFeeder = TokenFeeder(dirToTokens, maxNumSentences=maxNumSentences);
-        currToken = tokenFeeder.next();
-        # For progress reporting:        
-        msgsProcessed = 0;
-        msgsSinceLastReported = 0;
-        LOG_MSG_INTERVAL = 1000
-        currMsgID = 0;
+        if corpus is not None:
+            tokenChunkFiles = corpus.sourceFiles;
+        else:
+            tokenChunkFiles = SentenceFeeder.sortedChunkFiles(dirToTokens);
+        updater = None;
+        if update:
+            updater = NgramDatabaseUpdater(outDbPath, progressLogger=self.log);
+            tokenChunkFiles = [chunkFile for chunkFile in tokenChunkFiles if not updater.isIngested(chunkFile)];
+            if len(tokenChunkFiles) == 0:
+                updater.abort();
+                self.log("No new chunk files in %s; database %s is up to date." % (dirToTokens, outDbPath));
+                self.logDone();
+                return;
+            self.log("Adding %d new chunk files to %s..." % (len(tokenChunkFiles), outDbPath));
+        
+        countTrigrams = outDbPath is not None;
         try:
-            while 1:
-                nextToken = tokenFeeder.next();
-                currPosting = WordIndex.getPosting(currToken.word);
-                if currPosting is None:
-                    currPosting = WordPosting(currToken.word);
-                    # This posting is at the top level of the index.
-                    # Set the respective flag to True. This will 
-                    # change somne of the wordPosting's behavior:
-                    currPosting.setPostingTopLevel();
-                    WordIndex.addPosting(currPosting);
-                else:
-                    # Found this token before, bump its count:
-                    # Was this posting created last loop around
-                    # in the nextPosting = ... below. In that
-                    # case, just init this posting's counter, else
-                    # if the posting is already marked as top level,
-                    # it was seen before, and we just bump the global
-                    # occurrence counter:
-                    if currPosting.isTopLevelPosting:
-                        currPosting.bumpOccurrenceInCollection();
-                    else:
-                        currPosting.setPostingTopLevel();
-                        
-                nextPosting = WordIndex.getPosting(nextToken.word);
-                if nextPosting is None:
-                    nextPosting = WordPosting(nextToken.word);
-                    WordIndex.addPosting(nextPosting);
-                if nextToken.sentenceID == currToken.sentenceID:
-                    # Make a new posting for this follow-on word. That new
-                    # posting will live in currPosting's dict of followers,
-                    # and will have its own occurrence count. That count is
-                    # separate from the overall count kept in currPosting:
-                    followerWordPosting = WordPosting(nextPosting.rootWord);
-                    # We don't init this new posting's total occurrence counter,
-                    # b/c that will hapen next time around the loop:
-                    currPosting.addFollowsWord(followerWordPosting);
-                currToken = nextToken;
-                if currToken.emailID != currMsgID:
-                    currMsgID = currToken.emailID;
-                    msgsProcessed += 1;
-                    msgsSinceLastReported += 1;
-                    if msgsSinceLastReported >= LOG_MSG_INTERVAL:
-                        msgsSinceLastReported = 0;
-                        self.log("Processed %d emails..." % msgsProcessed);
-        except StopIteration:
-            pass
+            if spillDir is not None:
+                (vocab, bigrams, trigrams, lastWordID) = self.countOutOfCore(dirToTokens, spillDir, maxMemoryMB, maxNumSentences, countTrigrams, tokenChunkFiles, corpus);
+            elif numWorkers is None:
+                (vocab, bigrams, trigrams, lastWordID) = self.countSerially(dirToTokens, maxNumSentences, countTrigrams, tokenChunkFiles, corpus);
+            else:
+                (vocab, bigrams, trigrams, lastWordID) = self.countInParallel(dirToTokens, numWorkers, countTrigrams, tokenChunkFiles);
+        except:
+            if updater is not None:
+                updater.abort();
+            raise;
             
+        if outDbPath is not None:
+            self.log("Done creating in-memory index. Writing to database...");
+            try:
+                if updater is not None:
+                    self.updateDatabase(updater, vocab, bigrams, trigrams, tokenChunkFiles);
+                else:
+                    self.writeDatabase(outDbPath, vocab, bigrams, trigrams, tokenChunkFiles);
+            finally:
+                bigrams.close();
+                self.logDone();
+            return;
+        
+        wordRows = self.rowsFromCounts(vocab, bigrams, lastWordID);
         self.log("Done creating in-memory index. Writing to csv file...");
 
         # Build the CSV file:
@@ -118,8 +175,7 @@ class DBCreator(object):
             # The column headers:
             # FollowersCount is number of times a given word followed a given other word:
             csvFD.write("Word,Follower,FollowersCount,MetaNumOccurrences,MetaNumSuccessors,MetaWordLength\n");
-            for wordPosting in WordIndex.__iter__():
-                word = wordPosting.getRootWord();
+            for (word, numOccurrences, followerCounts) in wordRows:
                 # Write the summary information about this word:
                 csvFD.write(word + ',' +\
                             # No Follower
@@ -127,17 +183,17 @@ class DBCreator(object):
                             # No FollowersCount
                             ',' +\
                             # MetaNumOccurrences:
-                            str(wordPosting.getNumOccurrences()) + ',' +\
+                            str(numOccurrences) + ',' +\
                             # MetaNumSuccessors:
-                            str(wordPosting.getNumFollowers()) + ',' +\
+                            str(len(followerCounts)) + ',' +\
                             # MetaWordLength:
-                            str(len(wordPosting.getRootWord())) +\
+                            str(len(word)) +\
                             '\n');
                 # Write one line for each follower:
-                for followerWordPosting in wordPosting:
+                for (follower, followerCount) in followerCounts:
                     csvFD.write(word + ',' +\
-                                followerWordPosting.getRootWord() + ',' +\
-                                str(followerWordPosting.getHowOftenIFollowed()) +\
+                                follower + ',' +\
+                                str(followerCount) +\
                                 # No MetaNumOccurrences:
                                 ',' +\
                                 # No MetaNumSuccessors:
@@ -149,17 +205,393 @@ class DBCreator(object):
         finally:
             if outFileName is not None:
                 csvFD.close();
-            if self.logFile is not None:
-                self.log("Done.");
-                self.logFD.close();
-            else:
-                print "Done.";
+            bigrams.close();
+            self.logDone();
         
+    def logDone(self):
+        if self.logFile is not None:
+            self.log("Done.");
+            self.logFD.close();
+        else:
+            print "Done.";
+        
+    def countSerially(self, dirToTokens, maxNumSentences=None, countTrigrams=False, tokenChunkFiles=None, corpus=None):
+        '''
+        Count words and bigrams of all chunk files in this process.
+        @param dirToTokens: directory with the token chunk files.
+        @type dirToTokens: string
+        @param maxNumSentences: stop after this many sentences.
+        @type maxNumSentences: int
+        @param countTrigrams: if True, also count trigrams.
+        @type countTrigrams: boolean
+        @param tokenChunkFiles: if provided, count just these chunk files, instead of all files in dirToTokens.
+        @type tokenChunkFiles: [string]
+        @param corpus: if provided, count the tokens of this binary corpus instead
+                       of parsing the chunk files. tokenChunkFiles then selects
+                       among the corpus' source files.
+        @type corpus: BinaryCorpus
+        @return: (vocabulary, bigram counts, trigram counts or None, 
+                  ID of the last token's word or None). 
+        @rtype: (Vocabulary, NgramCounts, NgramCounts, int)
+        '''
+        vocab = Vocabulary();
+        bigrams = NgramCounts(2);
+        trigrams = NgramCounts(3) if countTrigrams else None;
+        (lastWordID, msgsProcessed) = self.countFrom(dirToTokens, maxNumSentences, tokenChunkFiles, corpus, vocab, bigrams, trigrams);
+        return (vocab, bigrams, trigrams, lastWordID);
+    
+    def countOutOfCore(self, dirToTokens, spillDir, maxMemoryMB, maxNumSentences=None, countTrigrams=False, tokenChunkFiles=None, corpus=None):
+        '''
+        Like countSerially(), but bounds the memory used for bigram counts.
+        Bigrams are spilled to sorted run files in spillDir, and k-way merged
+        while the rows are generated. The vocabulary, and trigrams if 
+        requested, stay in memory.
+        @param dirToTokens: directory with the token chunk files.
+        @type dirToTokens: string
+        @param spillDir: directory for the run files.
+        @type spillDir: string
+        @param maxMemoryMB: approximate memory budget for in-memory bigram counts.
+        @type maxMemoryMB: int
+        @param maxNumSentences: stop after this many sentences.
+        @type maxNumSentences: int
+        @param countTrigrams: if True, also count trigrams.
+        @type countTrigrams: boolean
+        @param tokenChunkFiles: if provided, count just these chunk files, instead of all files in dirToTokens.
+        @type tokenChunkFiles: [string]
+        @param corpus: if provided, count the tokens of this binary corpus.
+        @type corpus: BinaryCorpus
+        @return: same as countSerially(), but the bigram counts are a 
+                 SpillingBigramCounts, which the caller must close() 
+                 once it is done with them.
+        @rtype: (Vocabulary, SpillingBigramCounts, NgramCounts, int)
+        '''
+        vocab = Vocabulary();
+        trigrams = NgramCounts(3) if countTrigrams else None;
+        bigrams = SpillingBigramCounts(spillDir, 
+                                       SpillingBigramCounts.recordsForMemory(maxMemoryMB), 
+                                       progressLogger=self.log);
+        (lastWordID, msgsProcessed) = self.countFrom(dirToTokens, maxNumSentences, tokenChunkFiles, corpus, vocab, bigrams, trigrams);
+        self.log("Counted %d emails; %d words; %d bigrams in %d runs. Merging runs..." % 
+                 (msgsProcessed, len(vocab), bigrams.numAdded, len(bigrams.runPaths)));
+        return (vocab, bigrams, trigrams, lastWordID);
+    
+    def countFrom(self, dirToTokens, maxNumSentences, tokenChunkFiles, corpus, vocab, bigrams, trigrams):
+        '''
+        Count the tokens of the binary corpus if there is one, else
+        of the chunk files. Parameters as for countSerially().
+        @return: (ID of the last token's word, or None; number of emails)
+        @rtype: (int, int)
+        '''
+        if corpus is not None:
+            return countCorpus(corpus, vocab, bigrams, progressLogger=self.log, trigrams=trigrams, tokenChunkFiles=tokenChunkFiles);
+        tokenFeeder = TokenFeeder(dirToTokens, maxNumSentences=maxNumSentences, tokenChunkFiles=tokenChunkFiles, rawText=self.rawText);
+        return countTokens(tokenFeeder, vocab, bigrams, progressLogger=self.log, trigrams=trigrams);
+    
+    def countInParallel(self, dirToTokens, numWorkers, countTrigrams=False, tokenChunkFiles=None):
+        '''
+        Map/reduce version of countSerially(). Each chunk file is counted
+        by countChunkFile() in a pool of worker processes. The partial counts
+        are merged in chunk file order, which reproduces the serial run's
+        order of words and followers. Since sentences never span chunk
+        files, no bigram is lost at chunk edges.
+        @param dirToTokens: directory with the token chunk files.
+        @type dirToTokens: string
+        @param numWorkers: number of worker processes.
+        @type numWorkers: int
+        @param countTrigrams: if True, also count trigrams.
+        @type countTrigrams: boolean
+        @param tokenChunkFiles: if provided, count just these chunk files, instead of all files in dirToTokens.
+        @type tokenChunkFiles: [string]
+        @return: same as countSerially()
+        @rtype: (Vocabulary, NgramCounts, NgramCounts, int)
+        '''
+        if tokenChunkFiles is None:
+            tokenChunkFiles = SentenceFeeder.sortedChunkFiles(dirToTokens);
+        vocab = Vocabulary();
+        bigrams = NgramCounts(2);
+        trigrams = NgramCounts(3) if countTrigrams else None;
+        lastWordID = None;
+        msgsProcessed = 0;
+        pool = multiprocessing.Pool(numWorkers);
+        try:
+            # imap() hands back the results in chunk file order:
+            for chunkNum, (chunkWords, chunkOccurrences, chunkFirstIDs, chunkFollowerIDs, chunkCounts, chunkTrigrams, chunkLastWordID, chunkNumMsgs) in \
+                    enumerate(pool.imap(functools.partial(countChunkFile, countTrigrams=countTrigrams, rawText=self.rawText), tokenChunkFiles)):
+                # Translate the chunk's word IDs into global IDs. The chunk's
+                # vocabulary is in first appearance order, so new words are
+                # appended to the global vocabulary in the serial run's order:
+                globalIDs = array('l', [vocab.addOccurrence(word, numOccurrences) 
+                                        for (word, numOccurrences) in zip(chunkWords, chunkOccurrences)]);
+                for slot in xrange(len(chunkCounts)):
+                    bigrams.add((globalIDs[chunkFirstIDs[slot]], globalIDs[chunkFollowerIDs[slot]]), chunkCounts[slot]);
+                if chunkTrigrams is not None:
+                    (chunkTrigramIDColumns, chunkTrigramCounts) = chunkTrigrams;
+                    for slot in xrange(len(chunkTrigramCounts)):
+                        trigrams.add([globalIDs[column[slot]] for column in chunkTrigramIDColumns], chunkTrigramCounts[slot]);
+                if chunkLastWordID is not None:
+                    lastWordID = globalIDs[chunkLastWordID];
+                msgsProcessed += chunkNumMsgs;
+                self.log("Merged chunk file %d of %d (%d emails so far)..." % (chunkNum + 1, len(tokenChunkFiles), msgsProcessed));
+        finally:
+            pool.close();
+            pool.join();
+        return (vocab, bigrams, trigrams, lastWordID);
+    
+    def rowsFromCounts(self, vocab, bigrams, lastWordID):
+        '''
+        Turn the counts into the rows of the CSV file.
+        @param vocab: all words, with their occurrence counts.
+        @type vocab: Vocabulary
+        @param bigrams: bigram counts
+        @type bigrams: {NgramCounts | SpillingBigramCounts}
+        @param lastWordID: ID of the collection's last word, or None if there were no tokens.
+        @type lastWordID: int
+        @return: iterator over (word, numOccurrences, [(follower, followerCount)]) 
+                 in order of the words' first appearance.
+        @rtype: iterator
+        '''
+        # The very last token of the collection is never counted as
+        # an occurrence. A word that only occurs there shows up with 
+        # an occurrence count of -1:
+        if lastWordID is not None:
+            vocab.occurrences[lastWordID] -= 1;
+        for (wordID, followers) in bigrams.groupedByFirst(len(vocab)):
+            numOccurrences = vocab.getOccurrences(wordID);
+            yield (vocab.getWord(wordID), 
+                   numOccurrences if numOccurrences > 0 else -1,
+                   [(vocab.getWord(followerID), followerCount) for (followerID, followerCount) in followers]);
+    
+    def writeDatabase(self, outDbPath, vocab, bigrams, trigrams, tokenChunkFiles):
+        '''
+        Bulk load the counts into a new SQLite database.
+        @param outDbPath: path of the database. Replaced if it exists.
+        @type outDbPath: string
+        @param vocab: all words
+        @type vocab: Vocabulary
+        @param bigrams: bigram counts
+        @type bigrams: {NgramCounts | SpillingBigramCounts}
+        @param trigrams: trigram counts
+        @type trigrams: NgramCounts
+        @param tokenChunkFiles: the chunk files that were counted.
+        @type tokenChunkFiles: [string]
+        '''
+        writer = NgramDatabaseWriter(outDbPath, progressLogger=self.log);
+        try:
+            writer.loadNgrams(2, lambda: self.namedNgrams(vocab, bigrams));
+            writer.loadNgrams(3, lambda: self.namedNgrams(vocab, trigrams));
+            writer.finish(tokenChunkFiles);
+        except:
+            writer.abort();
+            raise;
+    
+    def updateDatabase(self, updater, vocab, bigrams, trigrams, tokenChunkFiles):
+        '''
+        Merge the counts of new chunk files into an existing database.
+        @param updater: updater opened on the database.
+        @type updater: NgramDatabaseUpdater
+        @param vocab: all words of the new chunk files
+        @type vocab: Vocabulary
+        @param bigrams: bigram counts of the new chunk files
+        @type bigrams: {NgramCounts | SpillingBigramCounts}
+        @param trigrams: trigram counts of the new chunk files
+        @type trigrams: NgramCounts
+        @param tokenChunkFiles: the new chunk files.
+        @type tokenChunkFiles: [string]
+        '''
+        try:
+            updater.mergeNgrams(2, self.namedNgrams(vocab, bigrams));
+            updater.mergeNgrams(3, self.namedNgrams(vocab, trigrams));
+            updater.finish(tokenChunkFiles);
+        except:
+            updater.abort();
+            raise;
+    
+    def namedNgrams(self, vocab, ngrams):
+        '''
+        Translate counted n-grams back to words.
+        @param vocab: all words
+        @type vocab: Vocabulary
+        @param ngrams: n-gram counts
+        @type ngrams: {NgramCounts | SpillingBigramCounts}
+        @return: iterator over ((word1, word2[, word3]), count)
+        @rtype: iterator
+        '''
+        for (firstID, group) in ngrams.groupedByFirst(len(vocab)):
+            firstWord = vocab.getWord(firstID);
+            for (rest, count) in group:
+                if isinstance(rest, tuple):
+                    yield ((firstWord,) + tuple([vocab.getWord(wordID) for wordID in rest]), count);
+                else:
+                    yield ((firstWord, vocab.getWord(rest)), count);
     
     def log(self, msg):
         print >>self.logFD, msg; 
         self.logFD.flush();
         
+def countTokens(tokens, vocab, bigrams, progressLogger=None, trigrams=None):
+    '''
+    Count each token as one occurrence of its word, and count a bigram
+    whenever two successive tokens are in the same sentence. Likewise
+    for trigrams, if trigram counts are provided.
+    @param tokens: iterator over Token instances
+    @type tokens: TokenFeeder
+    @param vocab: vocabulary to which occurrences are added.
+    @type vocab: Vocabulary
+    @param bigrams: bigram counts to add to.
+    @type bigrams: {NgramCounts | SpillingBigramCounts}
+    @param progressLogger: if provided, called with a progress message every LOG_MSG_INTERVAL emails.
+    @type progressLogger: callable
+    @param trigrams: if provided, trigram counts to add to.
+    @type trigrams: NgramCounts
+    @return: (ID of the last token's word, or None if there were no tokens; number of email message changes seen)
+    @rtype: (int, int)
+    '''
+    prevWordID = None;
+    prevSentenceID = None;
+    prevPrevWordID = None;
+    prevPrevSentenceID = None;
+    currMsgID = 0;
+    numEmails = 0;
+    numTokens = 0;
+    startTime = time.time();
+    for token in tokens:
+        numTokens += 1;
+        wordID = vocab.addOccurrence(token.word);
+        if token.sentenceID == prevSentenceID:
+            bigrams.add((prevWordID, wordID));
+            if trigrams is not None and prevSentenceID == prevPrevSentenceID:
+                trigrams.add((prevPrevWordID, prevWordID, wordID));
+        if token.emailID != currMsgID:
+            currMsgID = token.emailID;
+            numEmails += 1;
+            if progressLogger is not None and numEmails % LOG_MSG_INTERVAL == 0:
+                progressLogger("Processed %d emails; %d tokens (%.0f tokens/sec)..." % 
+                               (numEmails, numTokens, numTokens / max(time.time() - startTime, 1e-6)));
+        prevPrevWordID = prevWordID;
+        prevPrevSentenceID = prevSentenceID;
+        prevWordID = wordID;
+        prevSentenceID = token.sentenceID;
+    return (prevWordID, numEmails);
+
+def countCorpus(corpus, vocab, bigrams, progressLogger=None, trigrams=None, tokenChunkFiles=None):
+    '''
+    Like countTokens(), but for the tokens of a binary corpus. The 
+    corpus holds the tokens TokenFeeder would hand out, so the counts,
+    and their order, are the same as countTokens() would produce.
+    @param corpus: binary corpus in the builder's view
+    @type corpus: BinaryCorpus
+    @param vocab: vocabulary to which occurrences are added.
+    @type vocab: Vocabulary
+    @param bigrams: bigram counts to add to.
+    @type bigrams: {NgramCounts | SpillingBigramCounts}
+    @param progressLogger: if provided, called with a progress message every LOG_MSG_INTERVAL emails.
+    @type progressLogger: callable
+    @param trigrams: if provided, trigram counts to add to.
+    @type trigrams: NgramCounts
+    @param tokenChunkFiles: if provided, count just the tokens of these source files of the corpus.
+    @type tokenChunkFiles: [string]
+    @return: same as countTokens()
+    @rtype: (int, int)
+    '''
+    if tokenChunkFiles is None:
+        fileIndexes = range(len(corpus.sourceFiles));
+    else:
+        fileIndexes = [corpus.getFileIndex(chunkFile) for chunkFile in tokenChunkFiles];
+    # Corpus word ID --> vocab word ID, or -1 if not seen yet:
+    vocabIDs = array('l', [-1]) * len(corpus.words);
+    occurrences = vocab.occurrences;
+    wordID = None;
+    currMsgID = 0;
+    numEmails = 0;
+    numTokens = 0;
+    startTime = time.time();
+    sentenceStarts = corpus.sentenceStarts;
+    for fileIndex in fileIndexes:
+        emailIndex = bisect.bisect_right(corpus.emailStarts, sentenceStarts[corpus.fileStarts[fileIndex]]) - 1;
+        for sentenceIndex in xrange(corpus.fileStarts[fileIndex], corpus.fileStarts[fileIndex + 1]):
+            sentenceStart = sentenceStarts[sentenceIndex];
+            sentenceEnd = sentenceStarts[sentenceIndex + 1];
+            # Email changes, at most one of which can be inside 
+            # a sentence. Only used for progress reports:
+            while emailIndex < len(corpus.emailIDs) and corpus.emailStarts[emailIndex] < sentenceEnd:
+                if corpus.emailIDs[emailIndex] != currMsgID:
+                    currMsgID = corpus.emailIDs[emailIndex];
+                    numEmails += 1;
+                    if progressLogger is not None and numEmails % LOG_MSG_INTERVAL == 0:
+                        progressLogger("Processed %d emails; %d tokens (%.0f tokens/sec)..." % 
+                                       (numEmails, numTokens, numTokens / max(time.time() - startTime, 1e-6)));
+                emailIndex += 1;
+            prevWordID = None;
+            prevPrevWordID = None;
+            for corpusWordID in corpus.tokenIDs[sentenceStart:sentenceEnd]:
+                wordID = vocabIDs[corpusWordID];
+                if wordID < 0:
+                    wordID = vocab.intern(corpus.words[corpusWordID]);
+                    vocabIDs[corpusWordID] = wordID;
+                occurrences[wordID] += 1;
+                if prevWordID is not None:
+                    bigrams.add((prevWordID, wordID));
+                    if trigrams is not None and prevPrevWordID is not None:
+                        trigrams.add((prevPrevWordID, prevWordID, wordID));
+                prevPrevWordID = prevWordID;
+                prevWordID = wordID;
+            numTokens += sentenceEnd - sentenceStart;
+    return (wordID, numEmails);
+
+def writeBinaryCorpus(tokenChunkFiles, corpusDir, progressLogger=None, rawText=False):
+    '''
+    Convert token chunk files into a binary corpus that holds the
+    tokens TokenFeeder hands out. Pass the corpus directory to DBCreator
+    in place of the chunk file directory.
+    @param tokenChunkFiles: the chunk files, in order.
+    @type tokenChunkFiles: [string]
+    @param corpusDir: directory for the corpus. Created if needed; replaced if it holds one.
+    @type corpusDir: string
+    @param progressLogger: if provided, called with a message after each chunk file.
+    @type progressLogger: callable
+    @param rawText: if True, the chunk files are untokenized text.
+    @type rawText: boolean
+    '''
+    writer = BinaryCorpusWriter(corpusDir, BUILDER_VIEW);
+    try:
+        for chunkNum, chunkFilePath in enumerate(tokenChunkFiles):
+            writer.startFile(chunkFilePath);
+            for token in TokenFeeder(None, tokenChunkFiles=[chunkFilePath], rawText=rawText):
+                writer.addToken(token.word, token.sentenceID, token.emailID);
+            if progressLogger is not None:
+                progressLogger("Converted chunk file %d of %d (%d tokens so far)..." % (chunkNum + 1, len(tokenChunkFiles), writer.numTokens));
+        writer.finish();
+    except:
+        writer.abort();
+        raise;
+
+def countChunkFile(chunkFilePath, countTrigrams=False, rawText=False):
+    '''
+    Worker for DBCreator.countInParallel(): count the words and
+    bigrams of one token chunk file.
+    @param chunkFilePath: path to one token chunk file.
+    @type chunkFilePath: string
+    @param countTrigrams: if True, also count trigrams.
+    @type countTrigrams: boolean
+    @param rawText: if True, the chunk file is untokenized text.
+    @type rawText: boolean
+    @return: (words, occurrences, firstWordIDs, followerIDs, counts, trigrams, lastWordID, numEmails).
+             Word IDs are local to the chunk: indexes into words, which is in 
+             order of first appearance. occurrences holds each word's count. 
+             The bigram arrays are in order of first appearance. trigrams is
+             None, or ([firstWordIDs, secondWordIDs, thirdWordIDs], counts).
+             lastWordID is None if the chunk has no tokens.
+    @rtype: ([string], array, array, array, array, ([array], array), int, int)
+    '''
+    vocab = Vocabulary();
+    bigrams = NgramCounts(2);
+    trigrams = NgramCounts(3) if countTrigrams else None;
+    (lastWordID, numEmails) = countTokens(TokenFeeder(None, tokenChunkFiles=[chunkFilePath], rawText=rawText), vocab, bigrams, trigrams=trigrams);
+    return (vocab.words, vocab.occurrences, 
+            bigrams.wordIDColumns[0], bigrams.wordIDColumns[1], bigrams.counts, 
+            None if trigrams is None else (trigrams.wordIDColumns, trigrams.counts),
+            lastWordID, numEmails);
+
 # ---------------------------------------------- Class TokenFeeder  --------------------------
 
 class TokenFeeder(object):
@@ -168,12 +600,19 @@ class TokenFeeder(object):
     a CSV file. Schema: Word,EmailID,SentenceID
     '''
     
-    def __init__(self, dirToTokens, maxNumSentences=None):
+    def __init__(self, dirToTokens, maxNumSentences=None, tokenChunkFiles=None, rawText=False):
     
         if maxNumSentences is not None and maxNumSentences <= 0:
             raise ValueError("Maximum number of sentences to process must be a postive integers.");
         self.maxNumSentences = maxNumSentences    
-        self.sentenceIt = SentenceFeeder(dirToTokens);
+        if rawText:
+            if tokenChunkFiles is None:
+                tokenChunkFiles = SentenceFeeder.sortedChunkFiles(dirToTokens);
+            # Render each sentence the way SentenceFeeder would 
+            # find it in the Stanford tokenizer's output:
+            self.sentenceIt = ('[' + ', '.join(sentence) for sentence in iterFileSentences(tokenChunkFiles));
+        else:
+            self.sentenceIt = SentenceFeeder(dirToTokens, tokenChunkFiles=tokenChunkFiles);
         self.currSentence = None;
         self.tokenIt = None;
         self.numSentencesProcessed = 0;
@@ -447,7 +886,7 @@ class SentenceFeeder(object):
     segmented and tokenized. See notes.txt in package root. 
     '''
     
-    def __init__(self, dirToTokens):
+    def __init__(self, dirToTokens, tokenChunkFiles=None):
         '''
         Expects a directory containing chunk files of the form email12_NoHeads_Tokens.txt,
         with 12 being an example of a changing serial number. Each file is
@@ -460,10 +899,34 @@ class SentenceFeeder(object):
         
         where the number is the serial number of the following email.
          
-        Method creates a sorted list of the chunk file names in self.sortedEmailChunks.
+        Method creates a sorted list of the chunk file names in self.sortedTokenChunks.
+        Chunk files are memory-mapped one at a time, and scanned by token_corpus.
+
+        @param dirToTokens: directory path to email token chunk files
+        @type dirToTokens: string
+        @param tokenChunkFiles: if provided, feed sentences from just these chunk
+                                files, in the given order. dirToTokens is ignored.
+        @type tokenChunkFiles: [string]
+        '''
+        if tokenChunkFiles is None:
+            self.sortedTokenChunks = SentenceFeeder.sortedChunkFiles(dirToTokens);
+        else:
+            self.sortedTokenChunks = tokenChunkFiles;
+        
+        self.currFileIndex = 0;
+        self.currContent = '';
+        
+        self.ingestOneTokenFile(); 
 
+    @staticmethod
+    def sortedChunkFiles(dirToTokens):
+        '''
+        Return the paths of all token chunk files in the given directory,
+        sorted by the serial number that is embedded in their names.
         @param dirToTokens: directory path to email token chunk files
         @type dirToTokens: string
+        @return: sorted chunk file paths
+        @rtype: [string]
         '''
         if not os.path.isdir(dirToTokens):
             raise ValueError("SentenceFeeder needs absolute path to directory with email token files.");
@@ -473,7 +936,7 @@ class SentenceFeeder(object):
         numTokenFiles = sum(1 for fileName in allTokenFiles if fileName.find('.txt') > -1);
         if numTokenFiles == 0:
             raise ValueError("No email files found in '%s'." % dirToTokens);
-        self.sortedTokenChunks = [None] * numTokenFiles;
+        sortedTokenChunks = [None] * numTokenFiles;
         # Email chunk files have names like email12_NoHeads.txt. Sort
         # them into sortedTokenChunks according to their embedded
         # serial number (in this case 12:
@@ -486,20 +949,19 @@ class SentenceFeeder(object):
                 serialNum = int(serialNumStr);
             except ValueError:
                 raise ValueError("Could not extract email chunk file serial number from file name '%s'. Extraction got '%s'" % (chunkFileName, serialNumStr));
-            self.sortedTokenChunks[serialNum] = os.path.join(dirToTokens, chunkFileName);
-        
-        self.currFileIndex = 0;
-        
-        self.ingestOneTokenFile(); 
+            sortedTokenChunks[serialNum] = os.path.join(dirToTokens, chunkFileName);
+        return sortedTokenChunks;
 
     def ingestOneTokenFile(self):
+        # Sentences handed out earlier are copies, so the 
+        # previous chunk file's mapping can go:
+        token_corpus.closeMapping(self.currContent);
+        self.currContent = '';
         if self.currFileIndex >= len(self.sortedTokenChunks):
             return False;
-        with open(self.sortedTokenChunks[self.currFileIndex], 'r') as fd:
-            content = fd.read();
+        self.currContent = token_corpus.mapFile(self.sortedTokenChunks[self.currFileIndex]);
+        self.sentenceIt = token_corpus.iterBufferChunkSentences(self.currContent);
         self.currFileIndex += 1;
-        self.contentIndex = 0;
-        self.currContent = content;
         # Loaded another chunk file:
         return True;
         
@@ -507,273 +969,18 @@ class SentenceFeeder(object):
         return self;
         
     def next(self): #@ReservedAssignment
-        
-        startIndex = self.contentIndex;
-        try:
-            # Point past the next closing closing bracket:
-            self.contentIndex = self.currContent.index(']', startIndex) + 1;
-            return self.currContent[startIndex:self.contentIndex-1];
-        except ValueError:
-            # No more sentences in this chunk file. Get next one:
-            ingestionWorked = self.ingestOneTokenFile();
-            if not ingestionWorked:
-                raise StopIteration();
-            return self.next();
+        while 1:
+            try:
+                return self.sentenceIt.next();
+            except StopIteration:
+                # No more sentences in this chunk file. Get next one:
+                ingestionWorked = self.ingestOneTokenFile();
+                if not ingestionWorked:
+                    raise StopIteration();
     
         
         
       
-# ---------------------------------------------- Class WordIndex --------------------------
-
-class WordIndex(object):
-    '''
-    Entire word index. Holds a data structure like this:
-    
-    foo(2,set([0]),set([0]))
-    bar(5,set([1, 2, 3]), set([3]))
-    ----one(1,set([2]),set([2,5,10]))
-    ----two(2,set([3]), set([3,14]))
-    
-    foo occurred twice, both times in sentence 0 of msg 0.
-    bar occurred five times, in sentences 1,2,and 3 of msg 3
-    bar was following by the word 'one' one time, in sentence 3, msgs 2,5, and 10
-    bar was following by the word 'two' twice, in sentence 3, msgs 3 and 14
-    '''
-    
-    allPostings = OrderedDict();
-
-
-    @staticmethod
-    def __iter__():
-        return WordIndex.WordIterator();
-    
-    @staticmethod
-    def addPosting(wordPosting):
-        '''
-        If given word posting's root word is already in 
-        the index, do nothing, and return False. Else add
-        the new posting, and return True. For replacing an
-        existing posting, use setPosting().
-        @param wordPosting: posting to be added to the index.
-        @type wordPosting: WordPosting
-        @return: True if posting was added, False if the given posting's root word was already in the index.
-        @rtype: boolean
-        '''
-        posting = WordIndex.getPosting(wordPosting) 
-        if posting is None:
-            # wordPosting was not yet in the index: insert it:
-            WordIndex.allPostings[wordPosting.getRootWord()] = wordPosting;
-            return True;
-        return False;
-    
-    @staticmethod
-    def addPostings(wordPostingArr):
-        '''
-        Convenience method for adding multiple postings at once.
-        @param wordPostingArr: array of postings to add.
-        @type wordPostingArr: [WordPosting]
-        '''
-        for posting in wordPostingArr:
-            WordIndex.addPosting(posting);
-
-    @staticmethod
-    def setPosting(wordPosting):
-        '''
-        Add posting, or replace an existing one.
-        @param wordPosting: posting to add
-        @type wordPosting: WordPosting
-        '''
-        WordIndex[wordPosting.getRootWord()] = wordPosting;
-        
-    @staticmethod
-    def getPosting(wordOrWordPosting):
-        '''
-        Given either a string or a WordPosting, return the
-        first-level posting in the index.
-        @param wordOrWordPosting: word string or posting to retrieve
-        @type wordOrWordPosting: {word | WordPosting}
-        @return: WordPosting, or None, if not in index
-        @rtype: {WordPosting}
-        '''
-        # Fake overloading a la Python: duck typing
-        try:
-            word = wordOrWordPosting.getRootWord();
-        except AttributeError:
-            word = wordOrWordPosting;
-        try:
-            return WordIndex.allPostings[word];
-        except KeyError:
-            return None; 
-
-    @staticmethod
-    def prettyPrint():
-        '''
-        Print indented ASCII tree of the index data structure
-        '''
-        for rootWord in WordIndex.allPostings.keys():
-            print WordIndex.prettyPrintHelper(0, rootWord, WordIndex.allPostings[rootWord]);
-        
-    @staticmethod    
-    def prettyPrintHelper(indentSpaces, word, posting):
-        printout = ' '*indentSpaces + word + '(' + str(posting.followingCount) + ',' + str(posting.inSentence) + ')';
-        for followKey in posting.wordPostingsDict.keys():
-            printout += '\n' + WordIndex.prettyPrintHelper(indentSpaces + len(word), followKey, posting.wordPostingsDict[followKey]);
-        return printout;
-    
-    class WordIterator(object):
-        '''
-        Provides an iterator service for the enclosing class WordIndex.
-        Feeds out one WordPosting at a time, one for each word in the index.
-        '''
-        
-        def __init__(self):
-            # Use iteration through WordIndex's root words, i.e. the dict keys:
-            self.theIterator = WordIndex.allPostings.__iter__();
-            
-        def __iter__(self):
-            return self;
-        
-        def next(self): #@ReservedAssignment
-            '''
-            Get next key from the WordIndex.allPostings dict (a word), and 
-            return its item: a WordPosting.
-            '''
-            # Get next word's posting, and return it.
-            # The WordIndex.allPostings iterator with throw
-            # the required StopIteration exception when
-            # the word index is exhausted:
-            return WordIndex.getPosting(self.theIterator.next());
-        
-
-# ---------------------------------------------- Class WordPosting --------------------------
-
-
-class WordPosting(object):
-    '''
-    A single posting. It contains:
-        - the word itself, 
-        - a set of sentence IDs in which the word occurred,
-        - a set of message IDs in which the word occurred, 
-        - a total occurrences count, and 
-        - a dictionary of follow-on words. 
-    May be used as an iterator: for followPosting in oneWordPosting:...
-    '''
-    
-    #def __init__(self, word, sentenceID, emailMsgID):
-    def __init__(self, word):
-        self.rootWord = word;
-        self.wordPostingsDict = OrderedDict();
-        #self.inSentence = set([sentenceID]);
-        #self.inEmail = set([emailMsgID]);
-        self.followingCount = 1;
-        self.numOccInCollection = -1;
-        self.wordPostingsIndex = -1;
-        self.isTopLevelPosting = False;
-     
-    def __repr__(self):
-        return "<WordPosting: %s %d followers following %d (%d)>" % (self.rootWord, len(self.wordPostingsDict.keys()), self.followingCount, id(self));
-
-    def __str__(self):
-        return "<WordPosting: %s %d followers following %d (%d)>" % (self.rootWord, len(self.wordPostingsDict.keys()), self.followingCount, id(self));
-
-    def setPostingTopLevel(self):
-        self.numOccInCollection = 1;
-        self.followingCount = -1;
-        self.isTopLevelPosting = True;
-       
-    def bumpOccurrenceInCollection(self):
-        '''
-        Only called by WordIndex when a word is found (again).
-        This is greater than 1 only for the top level WordPosting within
-        WordIndex
-        '''
-        if self.isTopLevelPosting:
-            self.numOccInCollection += 1;
-
-    def getNumOccurrences(self):
-        '''
-        Return number of times this posting's word occurred in the emails total.
-        @return: total number of this word's occurrences. Or -1, if this WordPosting
-                 is not a top level posting in WordIndex.
-        @rtype: int
-        '''
-        if self.isTopLevelPosting:
-            return self.numOccInCollection;
-        else:
-            return -1;
-    
-    def getHowOftenIFollowed(self):
-        '''
-        Returns how often this WordPosting W's rootWord followed the 
-        WordPosting in whose wordPostingsDict W is listed as a follower.
-        I.e. this number is how often this word followed a particular
-        other word. If this WordPosting is not top level in WordIndex,
-        method returns -1.
-        '''
-        if not self.isTopLevelPosting:
-            return self.followingCount;
-        else:
-            -1;
-    
-    def getNumFollowers(self):
-        '''
-        @return: number of words that follow this word
-        @rtype: int
-        '''
-        return len(self.wordPostingsDict.keys());
-    
-#    def getNumOfEmailOccurrences(self):
-#        '''
-#        @return: number of emails  in which this word occurred.
-#        @rtype: int
-#        '''
-#        return len(self.inEmail);
-#    
-#    def getNumOfSentenceOccurrences(self):
-#        '''
-#        @return: number of sentences  in which this word occurred.
-#        @rtype: int
-#        '''
-#        return len(self.inSentence);
-
-    def getRootWord(self):
-        return self.rootWord;
-    
-    def addFollowsWord(self, newFollowWordPosting):
-        '''
-        Given a posting that follows this word, and a sentence ID for context,
-        add the new posting into the wordPostingsDict. Also add the sentence ID
-        into the inSentence set.
-        @param newFollowWordPosting: WordPosting to be added as a follower.
-        @type newFollowWordPosting: WordPosting
-        '''
-        try:
-            # Does this follow-word already exist in this posting's follow-words?
-            myFollowPosting = self.wordPostingsDict[newFollowWordPosting.getRootWord()];
-            # The new word has followed this WordPosting index's root word before. Keep count:
-            myFollowPosting.followingCount += 1;
-        except KeyError:
-            self.wordPostingsDict[newFollowWordPosting.getRootWord()] = newFollowWordPosting;
-        
-    def __iter__(self):
-        self.rootWords = self.wordPostingsDict.keys();
-        return self;
-    
-    def next(self): #@ReservedAssignment
-        '''
-        Iterator over the successor postings of this posting.
-        @return: each call returns one posting that represents a follow-on word,
-                 until no more followers are left.
-        @rtype: WordPosting
-        '''
-        self.wordPostingsIndex += 1;
-        if self.wordPostingsIndex >= len(self.rootWords):
-            raise StopIteration;
-        # Get next root word from the keys of self.wordPostingsDict array,
-        # and return that word's posting in the WordIndex
-        nextFollowerWord = self.rootWords[self.wordPostingsIndex]; 
-        return self.wordPostingsDict[nextFollowerWord];
-        
 # -----------------------  Testing ------------------------
 
 if __name__ == '__main__':
@@ -782,6 +989,20 @@ if __name__ == '__main__':
     parser.add_argument("tokenChunkFileDir", help="directory with chunk files of tokenized emails.");
     parser.add_argument("-o", "--outputCSVPath", help="fully qualified path to ouput .csv file (gets overwritten). If omitted: tuples written to stdout.", dest='outputCSVPath');
     parser.add_argument("-l", "--logFile, help=fully qualified log file name. Default is stdout.", dest='logFile');
+    parser.add_argument("-p", "--processes", type=int, dest='numWorkers',
+                        help="count chunk files in parallel, using this many worker processes. Default: count serially.");
+    parser.add_argument("-s", "--spillDir", dest='spillDir',
+                        help="count out of core: spill sorted bigram runs to this directory when counts exceed the memory budget.");
+    parser.add_argument("-m", "--maxMemoryMB", type=int, dest='maxMemoryMB', default=DEFAULT_MAX_MEMORY_MB,
+                        help="memory budget in MB for in-memory bigram counts with --spillDir. Default: %d." % DEFAULT_MAX_MEMORY_MB);
+    parser.add_argument("-d", "--databasePath", dest='outDbPath',
+                        help="build the SQLite Bigrams/Trigrams database at this path (gets overwritten), instead of the .csv file.");
+    parser.add_argument("-u", "--update", action="store_true", dest='update',
+                        help="with --databasePath: add only chunk files that are not in the database yet, instead of rebuilding it.");
+    parser.add_argument("-b", "--binaryCorpus", dest='binaryCorpusDir',
+                        help="convert the chunk files into a binary corpus in this directory, and exit. Pass the directory in place of tokenChunkFileDir to count from it.");
+    parser.add_argument("-r", "--rawText", action="store_true", dest='rawText',
+                        help="the chunk files are untokenized text: tokenize them in process, instead of reading Stanford tokenizer output.");
     parser.add_argument("-t", "--testing", action="store_true", dest="testing",
                         help="flag to just run tests.");
     
@@ -801,7 +1022,12 @@ if __name__ == '__main__':
         except AttributeError:
             outputCSVPath = None;
 # Uncomment here...            
-        DBCreator(args.tokenChunkFileDir, outputCSVPath, logFile=logFile);
+        if args.binaryCorpusDir is not None:
+            writeBinaryCorpus(SentenceFeeder.sortedChunkFiles(args.tokenChunkFileDir), args.binaryCorpusDir, rawText=args.rawText);
+            print "Done.";
+            sys.exit();
+        DBCreator(args.tokenChunkFileDir, outputCSVPath, logFile=logFile, numWorkers=args.numWorkers,
+                  spillDir=args.spillDir, maxMemoryMB=args.maxMemoryMB, outDbPath=args.outDbPath, update=args.update, rawText=args.rawText);
         sys.exit();
 # ... to here...
         
@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+
+'''
+Compact counting structures for building n-gram tables from large
+collections. Words are interned into consecutive integer IDs by a
+Vocabulary. NgramCounts keeps one slot per distinct n-gram: the word
+IDs and the count of each slot live in typed arrays, and a dict maps
+the n-gram's word IDs, packed into a single integer, to its slot.
+This costs on the order of a hundred bytes per distinct bigram,
+instead of a WordPosting object with its own OrderedDict.
+
+Slots are allocated in order of first appearance. Together with the
+first-appearance order of the vocabulary, this reproduces the order
+in which the OrderedDict based index used to list words and followers.
+
+For collections whose bigram table does not fit into memory,
+SpillingBigramCounts bounds the number of bigrams held in memory,
+writes sorted runs to disk, and k-way merges them at the end.
+'''
+
+import os;
+import time;
+import heapq;
+import tempfile;
+from array import array;
+
+# Bits per word ID in a packed n-gram key. Trigram keys of three 21 bit
+# IDs still fit into one machine integer. Larger vocabularies fall back
+# to tuple keys:
+ID_BITS = 21;
+MAX_PACKED_ID = (1 << ID_BITS) - 1;
+
+# Rough memory cost of one distinct bigram held by SpillingBigramCounts,
+# including the transient cost of sorting a run before it is written:
+BYTES_PER_RUN_RECORD = 200;
+
+# Records read from a run file per disk read during the merge:
+RUN_READ_BLOCK_RECORDS = 8192;
+
+# Maximum number of run files merged at once:
+MAX_MERGE_FAN_IN = 256;
+
+# Log merge progress every this many merged bigrams:
+MERGE_LOG_INTERVAL = 1000000;
+
+# ------------------------------- class Vocabulary ---------------------
+
+class Vocabulary(object):
+    '''
+    Maps words to consecutive integer IDs, in order of first appearance,
+    and keeps a per-word occurrence count.
+    '''
+
+    def __init__(self):
+        self.wordIDs = {};
+        self.words = [];
+        self.occurrences = array('l');
+
+    def __len__(self):
+        return len(self.words);
+
+    def intern(self, word):
+        '''
+        Return the ID of the given word, assigning the next free ID
+        if the word is new.
+        @param word: word to look up
+        @type word: string
+        @rtype: int
+        '''
+        try:
+            return self.wordIDs[word];
+        except KeyError:
+            wordID = len(self.words);
+            self.wordIDs[word] = wordID;
+            self.words.append(word);
+            self.occurrences.append(0);
+            return wordID;
+
+    def addOccurrence(self, word, count=1):
+        '''
+        Intern the word, and add to its occurrence count.
+        @return: the word's ID
+        @rtype: int
+        '''
+        wordID = self.intern(word);
+        self.occurrences[wordID] += count;
+        return wordID;
+
+    def getID(self, word):
+        '''
+        @return: ID of the given word, or None if the word was never interned.
+        @rtype: int
+        '''
+        return self.wordIDs.get(word);
+
+    def getWord(self, wordID):
+        return self.words[wordID];
+
+    def getOccurrences(self, wordID):
+        return self.occurrences[wordID];
+
+# ------------------------------- class NgramCounts ---------------------
+
+class NgramCounts(object):
+    '''
+    Counts of word ID n-grams. Usage:
+        bigrams = NgramCounts(2);
+        bigrams.add((wordID1, wordID2));
+        for (w1, followers) in bigrams.groupedByFirst(len(vocab)):
+            for (w2, count) in followers: ...
+    '''
+
+    def __init__(self, arity):
+        '''
+        @param arity: number of words per n-gram: 2 for bigrams, 3 for trigrams.
+        @type arity: int
+        '''
+        if arity < 2:
+            raise ValueError("N-grams must have at least two words. Got arity %d." % arity);
+        self.arity = arity;
+        # One array per word position; slot i holds the i-th distinct n-gram:
+        self.wordIDColumns = [array('l') for position in range(arity)];
+        self.counts = array('l');
+        # Packed n-gram key --> slot:
+        self.slots = {};
+
+    def __len__(self):
+        return len(self.counts);
+
+    def makeKey(self, wordIDs):
+        '''
+        Pack the given word IDs into one dict key.
+        @param wordIDs: one word ID per n-gram position
+        @type wordIDs: (int)
+        @rtype: {int | tuple}
+        '''
+        key = 0;
+        for wordID in wordIDs:
+            if wordID > MAX_PACKED_ID:
+                return tuple(wordIDs);
+            key = (key << ID_BITS) | wordID;
+        return key;
+
+    def add(self, wordIDs, count=1):
+        '''
+        Add to the count of one n-gram.
+        @param wordIDs: one word ID per n-gram position
+        @type wordIDs: (int)
+        @param count: amount to add.
+        @type count: int
+        @return: the n-gram's slot
+        @rtype: int
+        '''
+        key = self.makeKey(wordIDs);
+        try:
+            slot = self.slots[key];
+            self.counts[slot] += count;
+        except KeyError:
+            slot = len(self.counts);
+            self.slots[key] = slot;
+            for position, wordID in enumerate(wordIDs):
+                self.wordIDColumns[position].append(wordID);
+            self.counts.append(count);
+        return slot;
+
+    def getCount(self, wordIDs):
+        '''
+        @return: count of the given n-gram; 0 if it was never added.
+        @rtype: int
+        '''
+        slot = self.slots.get(self.makeKey(wordIDs));
+        return 0 if slot is None else self.counts[slot];
+
+    def slotWordIDs(self, slot):
+        return tuple(column[slot] for column in self.wordIDColumns);
+
+    def __iter__(self):
+        '''
+        Iterate over (wordIDs, count) in slot order.
+        '''
+        for slot in xrange(len(self.counts)):
+            yield (self.slotWordIDs(slot), self.counts[slot]);
+
+    def groupedByFirst(self, vocabSize):
+        '''
+        Iterate over the n-grams grouped by their first word. Groups
+        come in word ID order, and cover every ID below vocabSize,
+        including IDs that start no n-gram. Within a group, n-grams
+        come in slot (first appearance) order. Grouping is a counting
+        sort over the slots, so no per-word containers are built.
+        @param vocabSize: number of word IDs
+        @type vocabSize: int
+        @return: iterator over (firstWordID, [(remainingWordIDs, count)]). For
+                 bigrams, remainingWordIDs is the follower's ID itself.
+        @rtype: iterator
+        '''
+        firstIDs = self.wordIDColumns[0];
+        # groupStarts[w] ends up as the offset of w's first slot in sortedSlots:
+        groupStarts = array('l', [0]) * (vocabSize + 1);
+        for firstID in firstIDs:
+            groupStarts[firstID + 1] += 1;
+        for wordID in xrange(vocabSize):
+            groupStarts[wordID + 1] += groupStarts[wordID];
+        fillPositions = array('l', groupStarts);
+        sortedSlots = array('l', [0]) * len(firstIDs);
+        for slot, firstID in enumerate(firstIDs):
+            sortedSlots[fillPositions[firstID]] = slot;
+            fillPositions[firstID] += 1;
+        restColumns = self.wordIDColumns[1:];
+        for wordID in xrange(vocabSize):
+            group = [];
+            for slot in sortedSlots[groupStarts[wordID]:groupStarts[wordID + 1]]:
+                if self.arity == 2:
+                    rest = restColumns[0][slot];
+                else:
+                    rest = tuple(column[slot] for column in restColumns);
+                group.append((rest, self.counts[slot]));
+            yield (wordID, group);
+
+    def close(self):
+        '''
+        Nothing to release. Lets callers treat NgramCounts
+        and SpillingBigramCounts alike.
+        '''
+        pass;
+
+# ------------------------------- class SpillingBigramCounts ---------------------
+
+class SpillingBigramCounts(object):
+    '''
+    Bigram counts for collections whose bigram table exceeds memory.
+    Bigrams are aggregated in an in-memory NgramCounts until it holds
+    maxRecordsInMemory distinct bigrams. The run is then sorted by
+    (firstWordID, followerID), and written to a run file as records
+    of four machine integers: firstWordID, followerID, count, and the
+    bigram's first position. The position is the number of bigrams
+    added before the bigram's first appearance. mergedGroups() merges
+    all runs, adds up the counts of equal bigrams, and orders each word's
+    followers by first position, so the result matches NgramCounts.
+    Usage:
+        bigrams = SpillingBigramCounts(spillDir, maxRecordsInMemory);
+        bigrams.add((wordID1, wordID2));
+        ...
+        for (w1, followers) in bigrams.groupedByFirst(len(vocab)):
+            ...
+        bigrams.close();
+    '''
+    
+    RECORD_LEN = 4;
+
+    def __init__(self, spillDir, maxRecordsInMemory, progressLogger=None):
+        '''
+        @param spillDir: directory for the run files.
+        @type spillDir: string
+        @param maxRecordsInMemory: number of distinct bigrams after which a run is spilled.
+        @type maxRecordsInMemory: int
+        @param progressLogger: if provided, called with progress messages.
+        @type progressLogger: callable
+        '''
+        if not os.path.isdir(spillDir):
+            raise IOError("Spill directory '%s' does not exist." % spillDir);
+        if maxRecordsInMemory <= 0:
+            raise ValueError("Maximum number of in-memory bigrams must be a positive integer.");
+        self.spillDir = spillDir;
+        self.maxRecordsInMemory = maxRecordsInMemory;
+        self.progressLogger = progressLogger;
+        self.runPaths = [];
+        self.numAdded = 0;
+        self.startRun();
+
+    @staticmethod
+    def recordsForMemory(maxMemoryMB):
+        '''
+        Number of in-memory bigrams that roughly correspond to the given memory budget.
+        @param maxMemoryMB: memory budget for the in-memory run, in megabytes.
+        @type maxMemoryMB: int
+        @rtype: int
+        '''
+        return max(1, int(maxMemoryMB * 1024 * 1024 / BYTES_PER_RUN_RECORD));
+
+    def startRun(self):
+        self.runCounts = NgramCounts(2);
+        self.runFirstPositions = array('l');
+
+    def add(self, wordIDs, count=1):
+        '''
+        Add to the count of one bigram. Spills the current run
+        if it reached its maximum size.
+        @param wordIDs: (firstWordID, followerID)
+        @type wordIDs: (int, int)
+        @param count: amount to add.
+        @type count: int
+        '''
+        slot = self.runCounts.add(wordIDs, count);
+        if slot == len(self.runFirstPositions):
+            self.runFirstPositions.append(self.numAdded);
+        self.numAdded += 1;
+        if len(self.runCounts) >= self.maxRecordsInMemory:
+            self.spill();
+
+    def spill(self):
+        '''
+        Write the current run to a new run file, sorted by
+        (firstWordID, followerID), and start a new run.
+        '''
+        numRecords = len(self.runCounts);
+        if numRecords == 0:
+            return;
+        (firstIDs, followerIDs) = self.runCounts.wordIDColumns;
+        counts = self.runCounts.counts;
+        firstPositions = self.runFirstPositions;
+        sortedSlots = sorted(xrange(numRecords), key=lambda slot: (firstIDs[slot], followerIDs[slot]));
+        records = array('l');
+        for slot in sortedSlots:
+            records.extend((firstIDs[slot], followerIDs[slot], counts[slot], firstPositions[slot]));
+        (fd, runPath) = tempfile.mkstemp(suffix='.run', prefix='bigrams', dir=self.spillDir);
+        with os.fdopen(fd, 'wb') as runFD:
+            records.tofile(runFD);
+        self.runPaths.append(runPath);
+        if self.progressLogger is not None:
+            self.progressLogger("Spilled run %d: %d distinct bigrams." % (len(self.runPaths), numRecords));
+        self.startRun();
+
+    def readRun(self, runPath):
+        '''
+        Iterate over the records of one run file.
+        @return: iterator over (firstWordID, followerID, count, firstPosition)
+        @rtype: iterator
+        '''
+        recordLen = SpillingBigramCounts.RECORD_LEN;
+        with open(runPath, 'rb') as runFD:
+            while True:
+                block = array('l');
+                try:
+                    block.fromfile(runFD, RUN_READ_BLOCK_RECORDS * recordLen);
+                except EOFError:
+                    # Last, partial block. fromfile() still read what was there:
+                    pass;
+                if len(block) == 0:
+                    return;
+                for offset in xrange(0, len(block), recordLen):
+                    yield (block[offset], block[offset + 1], block[offset + 2], block[offset + 3]);
+
+    def mergeRuns(self, runPaths):
+        '''
+        K-way merge the given runs, adding up the counts of equal bigrams.
+        A merged bigram keeps the smallest of its first positions.
+        @param runPaths: run files to merge.
+        @type runPaths: [string]
+        @return: iterator over (firstWordID, followerID, count, firstPosition),
+                 sorted by (firstWordID, followerID), one record per bigram.
+        @rtype: iterator
+        '''
+        currRecord = None;
+        for (firstID, followerID, count, firstPosition) in heapq.merge(*[self.readRun(runPath) for runPath in runPaths]):
+            if currRecord is not None and currRecord[0] == firstID and currRecord[1] == followerID:
+                currRecord[2] += count;
+                currRecord[3] = min(currRecord[3], firstPosition);
+                continue;
+            if currRecord is not None:
+                yield tuple(currRecord);
+            currRecord = [firstID, followerID, count, firstPosition];
+        if currRecord is not None:
+            yield tuple(currRecord);
+
+    def reduceRuns(self):
+        '''
+        While there are more than MAX_MERGE_FAN_IN runs, merge batches of
+        MAX_MERGE_FAN_IN runs into single runs. Keeps the number of files
+        open during one merge within the process' file descriptor limit.
+        '''
+        while len(self.runPaths) > MAX_MERGE_FAN_IN:
+            mergedRunPaths = [];
+            for batchStart in xrange(0, len(self.runPaths), MAX_MERGE_FAN_IN):
+                batch = self.runPaths[batchStart:batchStart + MAX_MERGE_FAN_IN];
+                (fd, runPath) = tempfile.mkstemp(suffix='.run', prefix='bigrams', dir=self.spillDir);
+                with os.fdopen(fd, 'wb') as runFD:
+                    records = array('l');
+                    for record in self.mergeRuns(batch):
+                        records.extend(record);
+                        if len(records) >= RUN_READ_BLOCK_RECORDS * SpillingBigramCounts.RECORD_LEN:
+                            records.tofile(runFD);
+                            records = array('l');
+                    records.tofile(runFD);
+                for oldRunPath in batch:
+                    os.remove(oldRunPath);
+                mergedRunPaths.append(runPath);
+            if self.progressLogger is not None:
+                self.progressLogger("Merged %d runs into %d." % (len(self.runPaths), len(mergedRunPaths)));
+            self.runPaths = mergedRunPaths;
+
+    def mergedGroups(self):
+        '''
+        Spill what is left in memory, and k-way merge all runs. 
+        @return: iterator over (firstWordID, [(followerID, count)]), in
+                 firstWordID order. Words that start no bigram are
+                 skipped. Followers are in order of first appearance.
+        @rtype: iterator
+        '''
+        self.spill();
+        self.reduceRuns();
+        numMerged = 0;
+        startTime = time.time();
+        currFirstID = None;
+        # (firstPosition, followerID, count) for the current first word:
+        followers = [];
+        for (firstID, followerID, count, firstPosition) in self.mergeRuns(self.runPaths):
+            numMerged += 1;
+            if self.progressLogger is not None and numMerged % MERGE_LOG_INTERVAL == 0:
+                self.progressLogger("Merged %d bigrams (%.0f bigrams/sec)..." % (numMerged, numMerged / max(time.time() - startTime, 1e-6)));
+            if firstID != currFirstID:
+                if currFirstID is not None:
+                    yield (currFirstID, SpillingBigramCounts.inFirstAppearanceOrder(followers));
+                currFirstID = firstID;
+                followers = [];
+            followers.append((firstPosition, followerID, count));
+        if currFirstID is not None:
+            yield (currFirstID, SpillingBigramCounts.inFirstAppearanceOrder(followers));
+        if self.progressLogger is not None:
+            self.progressLogger("Merged %d distinct bigrams in %.1f sec." % (numMerged, time.time() - startTime));
+
+    def groupedByFirst(self, vocabSize):
+        '''
+        Same as NgramCounts.groupedByFirst(): merged groups for every
+        word ID below vocabSize, with empty groups for words that
+        start no bigram.
+        @param vocabSize: number of word IDs
+        @type vocabSize: int
+        @return: iterator over (firstWordID, [(followerID, count)])
+        @rtype: iterator
+        '''
+        nextWordID = 0;
+        for (firstID, followers) in self.mergedGroups():
+            for wordID in xrange(nextWordID, firstID):
+                yield (wordID, []);
+            yield (firstID, followers);
+            nextWordID = firstID + 1;
+        for wordID in xrange(nextWordID, vocabSize):
+            yield (wordID, []);
+
+    @staticmethod
+    def inFirstAppearanceOrder(followers):
+        followers.sort();
+        return [(followerID, count) for (firstPosition, followerID, count) in followers];
+
+    def close(self):
+        '''
+        Delete the run files.
+        '''
+        for runPath in self.runPaths:
+            try:
+                os.remove(runPath);
+            except OSError:
+                pass;
+        self.runPaths = [];
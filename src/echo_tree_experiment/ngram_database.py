@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+
+'''
+Bulk loader for the SQLite n-gram databases opened by WordDatabase.
+The schema is the one the serving code queries:
+
+    Bigrams(probability real, word1 varchar(25), word2 varchar(25))
+    Trigrams(probability real, word1 varchar(25), word2 varchar(25), word3 varchar(25))
+
+Next to these tables, the raw counts are kept, together with the names
+of the chunk files that were counted:
+
+    BigramCounts(word1, word2, ngramCount integer)
+    TrigramCounts(word1, word2, word3, ngramCount integer)
+    IngestedChunks(chunkFile, ingestTime real)
+
+NgramDatabaseUpdater uses these to add chunk files to an existing
+database without recounting the collection. The database's model
+version, held in SQLite's user_version, is 1 after a full build, and
+is incremented by every update. Servers and caches compare it to
+notice that the model changed.
+
+Rows are inserted with executemany() in large batches, inside large
+transactions, with journaling and syncing turned off. The indexes are
+created after all rows are loaded, followed by ANALYZE. The database
+is built under a temporary name, and only renamed to its final name
+once it is complete, so a failed build never leaves a half-loaded
+database where the server would pick it up.
+
+A probability is computed for each n-gram from its count by an
+estimator function. The estimator receives the n-gram table's
+frequencies of frequencies, and returns a dict mapping each count
+to the probability of an n-gram with that count. The default is Simple
+Good-Turing, as computed by goodTuringSmoothing.c for the existing
+databases.
+'''
+
+import os;
+import time;
+import sqlite3;
+
+# The estimators that NgramDatabaseWriter and NgramDatabaseUpdater accept:
+from good_turing import goodTuringProbabilities, relativeFrequencies;
+
+# Rows per executemany() call:
+INSERT_BATCH_ROWS = 50000;
+# Rows per transaction:
+ROWS_PER_TRANSACTION = 1000000;
+
+# Pragmas for loading into a fresh database file. Nobody else
+# sees the file while it is built, and a crash just means
+# building again, so journal and fsync are not needed:
+BULK_LOAD_PRAGMAS = ['PRAGMA journal_mode=OFF',
+                     'PRAGMA synchronous=OFF',
+                     'PRAGMA locking_mode=EXCLUSIVE',
+                     'PRAGMA temp_store=MEMORY',
+                     # Negative: size in KiB, i.e. 256MB:
+                     'PRAGMA cache_size=-262144',
+                     ];
+
+# Arity --> (table name, count table name, word column names, statements that create the indexes).
+# Updates rely on the count tables' unique indexes:
+NGRAM_TABLES = {
+                2 : ('Bigrams', 'BigramCounts', ['word1', 'word2'],
+                     ['CREATE INDEX wordFollCountIndx ON Bigrams (word1, word2, probability)',
+                      'CREATE UNIQUE INDEX bigramCountsIndx ON BigramCounts (word1, word2)']),
+                3 : ('Trigrams', 'TrigramCounts', ['word1', 'word2', 'word3'],
+                     ['CREATE INDEX trigramFollCountIndx ON Trigrams (word1, word2, word3, probability)',
+                      'CREATE UNIQUE INDEX trigramCountsIndx ON TrigramCounts (word1, word2, word3)']),
+                };
+
+# Model version of a freshly built database:
+INITIAL_MODEL_VERSION = 1;
+
+# ------------------------------- class NgramDatabaseWriter ---------------------
+
+class NgramDatabaseWriter(object):
+    '''
+    Builds one n-gram database. Usage:
+        writer = NgramDatabaseWriter('/tmp/myCollection.db');
+        try:
+            writer.loadNgrams(2, lambda: iter([(('my', 'word'), 3), ...]));
+            writer.loadNgrams(3, ...);
+            writer.finish();
+        except:
+            writer.abort();
+            raise;
+    '''
+
+    def __init__(self, dbPath, estimator=goodTuringProbabilities, progressLogger=None):
+        '''
+        Create the tables in a fresh database file under a temporary name.
+        @param dbPath: path of the database to build. Replaced by finish() if it exists.
+        @type dbPath: string
+        @param estimator: function mapping frequencies of frequencies to per-count probabilities.
+        @type estimator: callable
+        @param progressLogger: if provided, called with progress messages.
+        @type progressLogger: callable
+        '''
+        self.dbPath = dbPath;
+        self.tmpPath = dbPath + '.tmp';
+        self.estimator = estimator;
+        self.progressLogger = progressLogger;
+        if os.path.exists(self.tmpPath):
+            os.remove(self.tmpPath);
+        try:
+            self.conn = sqlite3.connect(self.tmpPath);
+        except Exception as e:
+            raise IOError(`e` + ": %s" % self.tmpPath);
+        # Words are byte strings from the token files:
+        self.conn.text_factory = str;
+        for pragma in BULK_LOAD_PRAGMAS:
+            self.conn.execute(pragma);
+        for (tableName, countTableName, wordColumns, indexStatements) in NGRAM_TABLES.values():
+            wordColumnDefs = ', '.join(['%s varchar(25)' % column for column in wordColumns]);
+            self.conn.execute('CREATE TABLE %s(probability real, %s)' % (tableName, wordColumnDefs));
+            self.conn.execute('CREATE TABLE %s(%s, ngramCount integer)' % (countTableName, wordColumnDefs));
+        self.conn.execute('CREATE TABLE IngestedChunks(chunkFile varchar(255) PRIMARY KEY, ingestTime real)');
+        self.conn.commit();
+
+    def loadNgrams(self, arity, ngramsFactory):
+        '''
+        Load the n-grams of one arity, and their counts. Makes two passes over 
+        the n-grams: the first collects the frequencies of frequencies for the
+        estimator, the second inserts the rows.
+        @param arity: 2 for bigrams, 3 for trigrams.
+        @type arity: int
+        @param ngramsFactory: function that returns a new iterator over
+                              ((word1, word2[, word3]), count) on each call.
+        @type ngramsFactory: callable
+        @return: number of rows loaded.
+        @rtype: int
+        '''
+        try:
+            (tableName, countTableName, wordColumns, indexStatements) = NGRAM_TABLES[arity];
+        except KeyError:
+            raise ValueError("No n-gram table for arity %d." % arity);
+        freqOfFreqs = {};
+        for (words, count) in ngramsFactory():
+            freqOfFreqs[count] = freqOfFreqs.get(count, 0) + 1;
+        probabilities = self.estimator(freqOfFreqs);
+
+        insertStatement = 'INSERT INTO %s VALUES (%s)' % (tableName, ','.join(['?'] * (arity + 1)));
+        insertCountStatement = 'INSERT INTO %s VALUES (%s)' % (countTableName, ','.join(['?'] * (arity + 1)));
+        numRows = 0;
+        rowsInTransaction = 0;
+        startTime = time.time();
+        batch = [];
+        countBatch = [];
+        for (words, count) in ngramsFactory():
+            batch.append((probabilities[count],) + tuple(words));
+            countBatch.append(tuple(words) + (count,));
+            if len(batch) >= INSERT_BATCH_ROWS:
+                self.conn.executemany(insertStatement, batch);
+                self.conn.executemany(insertCountStatement, countBatch);
+                countBatch = [];
+                numRows += len(batch);
+                rowsInTransaction += len(batch);
+                batch = [];
+                if rowsInTransaction >= ROWS_PER_TRANSACTION:
+                    self.conn.commit();
+                    rowsInTransaction = 0;
+                    self.log("Loaded %d rows into %s (%.0f rows/sec)..." %
+                             (numRows, tableName, numRows / max(time.time() - startTime, 1e-6)));
+        if len(batch) > 0:
+            self.conn.executemany(insertStatement, batch);
+            self.conn.executemany(insertCountStatement, countBatch);
+            numRows += len(batch);
+        self.conn.commit();
+        self.log("Loaded %d rows into %s in %.1f sec." % (numRows, tableName, time.time() - startTime));
+        return numRows;
+
+    def finish(self, chunkFiles=[]):
+        '''
+        Create the indexes, update the query planner's statistics, and
+        move the finished database to its final path.
+        @param chunkFiles: token chunk files whose n-grams were loaded.
+        @type chunkFiles: [string]
+        '''
+        startTime = time.time();
+        for (tableName, countTableName, wordColumns, indexStatements) in NGRAM_TABLES.values():
+            for indexStatement in indexStatements:
+                self.conn.execute(indexStatement);
+        recordIngestedChunks(self.conn, chunkFiles);
+        self.conn.execute('PRAGMA user_version=%d' % INITIAL_MODEL_VERSION);
+        self.conn.execute('ANALYZE');
+        self.conn.commit();
+        self.conn.close();
+        self.conn = None;
+        os.rename(self.tmpPath, self.dbPath);
+        self.log("Indexed and analyzed %s in %.1f sec." % (self.dbPath, time.time() - startTime));
+
+    def abort(self):
+        '''
+        Discard the partly built database.
+        '''
+        if self.conn is not None:
+            self.conn.close();
+            self.conn = None;
+        if os.path.exists(self.tmpPath):
+            os.remove(self.tmpPath);
+
+    def log(self, msg):
+        if self.progressLogger is not None:
+            self.progressLogger(msg);
+
+# ------------------------------- class NgramDatabaseUpdater ---------------------
+
+class NgramDatabaseUpdater(object):
+    '''
+    Adds the n-grams of new chunk files to a database built by
+    NgramDatabaseWriter. The new counts are added to the count tables.
+    Then the probabilities are recomputed from the new frequencies of
+    frequencies. Only the rows of words that start a new or changed
+    n-gram are rewritten. All other rows keep their probabilities. For
+    those rows, the order of a word's followers, which is all the
+    servers use, stays the same. The whole update is one transaction, so
+    readers see either the old or the new model. Usage:
+        updater = NgramDatabaseUpdater('/tmp/myCollection.db');
+        try:
+            newChunkFiles = [path for path in allChunkFiles if not updater.isIngested(path)];
+            ...count newChunkFiles...
+            updater.mergeNgrams(2, bigramsIterator);
+            updater.mergeNgrams(3, trigramsIterator);
+            updater.finish(newChunkFiles);
+        except:
+            updater.abort();
+            raise;
+    '''
+
+    def __init__(self, dbPath, estimator=goodTuringProbabilities, progressLogger=None):
+        '''
+        @param dbPath: path of an existing database built by NgramDatabaseWriter.
+        @type dbPath: string
+        @param estimator: function mapping frequencies of frequencies to per-count probabilities.
+        @type estimator: callable
+        @param progressLogger: if provided, called with progress messages.
+        @type progressLogger: callable
+        @raise IOError: if the database does not exist.
+        @raise ValueError: if the database has no count tables.
+        '''
+        if not os.path.exists(dbPath):
+            raise IOError("Database %s does not exist." % dbPath);
+        self.dbPath = dbPath;
+        self.estimator = estimator;
+        self.progressLogger = progressLogger;
+        self.conn = sqlite3.connect(dbPath);
+        self.conn.text_factory = str;
+        # Transactions are started and committed explicitly below. The sqlite3
+        # module would otherwise commit before each CREATE TEMP TABLE:
+        self.conn.isolation_level = None;
+        self.conn.execute('PRAGMA temp_store=MEMORY');
+        tableNames = set([row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]);
+        requiredTables = set(['IngestedChunks'] + [countTableName for (tableName, countTableName, wordColumns, indexStatements) in NGRAM_TABLES.values()]);
+        if not requiredTables.issubset(tableNames):
+            self.conn.close();
+            raise ValueError("Database %s has no raw count tables, so it cannot be updated. Rebuild it from all chunk files." % dbPath);
+        self.ingestedChunks = set([row[0] for row in self.conn.execute('SELECT chunkFile FROM IngestedChunks')]);
+        # The transaction starts with the first change, so that counting
+        # the new chunk files does not hold the database's write lock:
+        self.inTransaction = False;
+
+    def isIngested(self, chunkFile):
+        '''
+        @param chunkFile: path of a token chunk file
+        @type chunkFile: string
+        @return: True if the chunk file's n-grams are already in the database.
+        @rtype: boolean
+        '''
+        return os.path.basename(chunkFile) in self.ingestedChunks;
+
+    def getModelVersion(self):
+        return self.conn.execute('PRAGMA user_version').fetchone()[0];
+
+    def mergeNgrams(self, arity, ngrams):
+        '''
+        Add the counts of new n-grams of one arity, and rewrite the
+        rows of the words whose followers changed.
+        @param arity: 2 for bigrams, 3 for trigrams.
+        @type arity: int
+        @param ngrams: iterator over ((word1, word2[, word3]), count). Each n-gram at most once.
+        @type ngrams: iterator
+        @return: number of words whose rows were rewritten.
+        @rtype: int
+        '''
+        try:
+            (tableName, countTableName, wordColumns, indexStatements) = NGRAM_TABLES[arity];
+        except KeyError:
+            raise ValueError("No n-gram table for arity %d." % arity);
+        startTime = time.time();
+        self.beginTransaction();
+        columnList = ', '.join(wordColumns);
+        self.conn.execute('CREATE TEMP TABLE NewCounts(%s, ngramCount integer)' % columnList);
+        insertStatement = 'INSERT INTO NewCounts VALUES (%s)' % ','.join(['?'] * (arity + 1));
+        numNew = 0;
+        batch = [];
+        for (words, count) in ngrams:
+            batch.append(tuple(words) + (count,));
+            if len(batch) >= INSERT_BATCH_ROWS:
+                self.conn.executemany(insertStatement, batch);
+                numNew += len(batch);
+                batch = [];
+        if len(batch) > 0:
+            self.conn.executemany(insertStatement, batch);
+            numNew += len(batch);
+
+        # Add to the counts; the WHERE keeps the parser from taking ON for a join:
+        self.conn.execute('INSERT INTO %s (%s, ngramCount) SELECT %s, ngramCount FROM NewCounts WHERE 1 '
+                          'ON CONFLICT (%s) DO UPDATE SET ngramCount = ngramCount + excluded.ngramCount' %
+                          (countTableName, columnList, columnList, columnList));
+
+        freqOfFreqs = dict(self.conn.execute('SELECT ngramCount, COUNT(*) FROM %s GROUP BY ngramCount' % countTableName).fetchall());
+        self.conn.execute('CREATE TEMP TABLE Probabilities(ngramCount integer PRIMARY KEY, probability real)');
+        self.conn.executemany('INSERT INTO Probabilities VALUES (?,?)', self.estimator(freqOfFreqs).items());
+        self.conn.execute('CREATE TEMP TABLE AffectedWords(word1 PRIMARY KEY)');
+        self.conn.execute('INSERT OR IGNORE INTO AffectedWords SELECT word1 FROM NewCounts');
+        numAffected = self.conn.execute('SELECT COUNT(*) FROM AffectedWords').fetchone()[0];
+
+        self.conn.execute('DELETE FROM %s WHERE word1 IN (SELECT word1 FROM AffectedWords)' % tableName);
+        self.conn.execute('INSERT INTO %s SELECT Probabilities.probability, %s FROM %s JOIN Probabilities USING (ngramCount) '
+                          'WHERE word1 IN (SELECT word1 FROM AffectedWords)' %
+                          (tableName, ', '.join([countTableName + '.' + column for column in wordColumns]), countTableName));
+        for tempTable in ['NewCounts', 'Probabilities', 'AffectedWords']:
+            self.conn.execute('DROP TABLE temp.%s' % tempTable);
+        self.log("Merged %d new %s; rewrote the rows of %d words in %.1f sec." %
+                 (numNew, countTableName, numAffected, time.time() - startTime));
+        return numAffected;
+
+    def finish(self, chunkFiles):
+        '''
+        Record the new chunk files, increment the model version, and commit.
+        @param chunkFiles: token chunk files whose n-grams were merged.
+        @type chunkFiles: [string]
+        @return: the new model version
+        @rtype: int
+        @raise sqlite3.IntegrityError: if a chunk file was already ingested, 
+                                       e.g. by a concurrent update.
+        '''
+        self.beginTransaction();
+        # A chunk file ingested twice violates IngestedChunks' primary key:
+        recordIngestedChunks(self.conn, chunkFiles);
+        modelVersion = self.getModelVersion() + 1;
+        self.conn.execute('PRAGMA user_version=%d' % modelVersion);
+        self.conn.execute('ANALYZE');
+        self.conn.execute('COMMIT');
+        self.conn.close();
+        self.conn = None;
+        self.log("Updated %s to model version %d." % (self.dbPath, modelVersion));
+        return modelVersion;
+
+    def abort(self):
+        '''
+        Roll back the update.
+        '''
+        if self.conn is not None:
+            if self.inTransaction:
+                self.conn.execute('ROLLBACK');
+            self.conn.close();
+            self.conn = None;
+
+    def beginTransaction(self):
+        if not self.inTransaction:
+            self.conn.execute('BEGIN IMMEDIATE');
+            self.inTransaction = True;
+
+    def log(self, msg):
+        if self.progressLogger is not None:
+            self.progressLogger(msg);
+
+def recordIngestedChunks(conn, chunkFiles):
+    '''
+    Remember which chunk files are in a database. Files are
+    recorded by name, without their directory.
+    @param conn: connection to the database
+    @type conn: sqlite3.Connection
+    @param chunkFiles: paths of token chunk files
+    @type chunkFiles: [string]
+    '''
+    ingestTime = time.time();
+    conn.executemany('INSERT INTO IngestedChunks VALUES (?,?)',
+                     [(os.path.basename(chunkFile), ingestTime) for chunkFile in chunkFiles]);
+
+def selectTopFollowers(conn, tableName, wordColumns, topK, isKept=None):
+    '''
+    Collect, for each word1 of an n-gram table, the first topK rows in
+    WordFollower's order that isKept accepts. Words with non-ASCII
+    characters are skipped, since WordFollower strips them from the
+    words it looks up.
+    @param conn: connection to the database
+    @type conn: sqlite3.Connection
+    @param tableName: the n-gram table
+    @type tableName: string
+    @param wordColumns: the table's word columns, as in NGRAM_TABLES
+    @type wordColumns: [string]
+    @param topK: number of rows kept per word1.
+    @type topK: int
+    @param isKept: if provided, called with word1 and the follower words of
+                   a row, (word2,) or (word2, word3); returns True to keep the row.
+    @type isKept: callable
+    @return: the rows, each (probability, word1, word2[, word3]).
+    @rtype: [tuple]
+    '''
+    # WordFollower's query, with the probability:
+    followersQuery = 'SELECT probability, %s FROM %s WHERE word1=? ORDER BY probability*1 desc' % (', '.join(wordColumns[1:]), tableName);
+    rows = [];
+    for (word1,) in conn.execute('SELECT DISTINCT word1 FROM %s' % tableName).fetchall():
+        if any(not 0 < ord(char) < 127 for char in word1):
+            # Never looked up:
+            continue;
+        numKept = 0;
+        for row in conn.execute(followersQuery, (word1,)).fetchall():
+            followers = tuple(row[1:]);
+            if isKept is not None and not isKept(word1, followers):
+                continue;
+            rows.append((row[0], word1) + followers);
+            numKept += 1;
+            if numKept >= topK:
+                break;
+    return rows;
+
+def copyIndexes(srcConn, dstConn, tableName, dstTableName=None):
+    '''
+    Give a table the indexes that a table of the same schema has. The
+    indexes decide the order in which SQLite reads a word's followers,
+    and so the order of followers with equal probabilities. A table
+    without indexes gets none.
+    @param srcConn: connection to the database with the indexed table
+    @type srcConn: sqlite3.Connection
+    @param dstConn: connection to the database with the table to index; may be srcConn.
+    @type dstConn: sqlite3.Connection
+    @param tableName: the indexed table
+    @type tableName: string
+    @param dstTableName: the table to index, if its name differs from tableName.
+                         Its indexes are named after it, since index names are
+                         unique within a database.
+    @type dstTableName: string
+    '''
+    for (indexName, indexStatement) in srcConn.execute("SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL",
+                                                       (tableName,)).fetchall():
+        if dstTableName is not None and dstTableName != tableName:
+            isUnique = indexStatement.upper().startswith('CREATE UNIQUE');
+            indexStatement = 'CREATE %sINDEX %s%s ON %s %s' % ('UNIQUE ' if isUnique else '',
+                                                              dstTableName, indexName[0].upper() + indexName[1:],
+                                                              dstTableName, indexStatement[indexStatement.index('('):]);
+        dstConn.execute(indexStatement);
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import sys
+import argparse
+import echo_tree_experiment_server
+from echo_tree_experiment_server import SessionSchedule
+from echo_tree_experiment_server import NUM_OF_ROUNDS_PER_DYAD
+
+def readRoster(rosterPath):
+    '''
+    Read a roster file with one pair of player IDs per line.
+    The two IDs are separated by white space or a comma. Empty
+    lines, and lines starting with '#' are ignored.
+    @param rosterPath: path to the roster file
+    @type rosterPath: string
+    @return: list of (playerID1, playerID2)
+    @rtype: [(string,string)]
+    '''
+    roster = [];
+    with open(rosterPath, 'r') as fd:
+        for lineNum, line in enumerate(fd):
+            line = line.strip();
+            if len(line) == 0 or line.startswith('#'):
+                continue;
+            playerIDs = line.replace(',', ' ').split();
+            if len(playerIDs) != 2 or playerIDs[0] == playerIDs[1]:
+                print("Line %d of %s does not contain two different player IDs: '%s'" % (lineNum + 1, rosterPath, line));
+                sys.exit(1);
+            roster.append((playerIDs[0], playerIDs[1]));
+    return roster;
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(prog='scheduleSession')
+    parser.add_argument("-r", "--rounds", 
+                        help="number of rounds each pair plays (default %d)." % NUM_OF_ROUNDS_PER_DYAD,
+                        dest='rounds',
+                        type=int,
+                        default=NUM_OF_ROUNDS_PER_DYAD);
+    parser.add_argument("-n", "--dryRun",
+                        help="print the assignments without saving them.",
+                        dest='dryRun',
+                        action='store_true');
+    parser.add_argument("rosterFile",
+                        help="file with one pair of player IDs per line.");
+    
+    args = parser.parse_args();
+    roster = readRoster(args.rosterFile);
+    
+    if args.dryRun:
+        with echo_tree_experiment_server.LoadedParticipants():
+            schedule = SessionSchedule.computeSchedule(roster, 
+                                                       echo_tree_experiment_server.EchoTreeLogService.participantDict,
+                                                       args.rounds);
+    else:
+        schedule = SessionSchedule.scheduleSession(roster, args.rounds);
+    
+    for (playerID1, playerID2) in roster:
+        for roundNum, ((role1, condition), (role2, condition)) in enumerate(zip(schedule[(playerID1, playerID2)],
+                                                                               schedule[(playerID2, playerID1)])):
+            print("Round %d: %s (%s) with %s (%s); condition %s" % (roundNum + 1, playerID1, role1, playerID2, role2, condition));
+    if not args.dryRun:
+        print("Scheduled %d pairs." % len(roster));
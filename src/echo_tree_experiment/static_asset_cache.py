@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+
+'''
+In-memory cache of the files under browser_scripts that the
+experiment and EchoTree servers hand out to browsers. Each file is
+read once. Its complete HTTP response headers, an ETag, and a
+gzip-compressed variant are precomputed, so that serving a request
+is a dictionary lookup followed by a single write to the connection.
+Entries are re-read when the file's modification time changes.
+
+Usage:
+    cache = StaticAssetCache(rootDir);
+    ...
+    cache.serve(request, 'disabled.html');
+'''
+
+import os;
+import time;
+import gzip;
+import hashlib;
+import mimetypes;
+import cStringIO;
+from email.utils import formatdate, parsedate_tz, mktime_tz;
+from threading import Lock;
+
+# Files smaller than this are not worth compressing:
+GZIP_MIN_SIZE = 512;
+
+# Never check a file's modification time more than once
+# per this many seconds:
+DEFAULT_CHECK_INTERVAL = 1.0;
+
+# Editor backup files and the like that are never served:
+IGNORED_SUFFIXES = ('~', '.swp', '.orig');
+
+# MIME types the browser_scripts directory needs. Anything else
+# is looked up with the mimetypes module, falling back to HTML:
+MIME_TYPES = {
+              '.html' : 'text/html',
+              '.htm'  : 'text/html',
+              '.css'  : 'text/css',
+              '.js'   : 'application/javascript',
+              '.ico'  : 'image/x-icon',
+              };
+DEFAULT_MIME = 'text/html';
+
+# ------------------------------- class StaticAsset ---------------------
+
+class StaticAsset(object):
+    '''
+    One cached file: the bytes, an optional gzipped copy, and the
+    precomputed response headers for each of the two.
+    '''
+
+    def __init__(self, filePath, mimeType):
+        '''
+        Read the file and precompute everything needed to serve it.
+        @param filePath: absolute path to the file.
+        @type filePath: string
+        @param mimeType: Content-Type value to send with the file.
+        @type mimeType: string
+        @raise IOError: if the file cannot be read.
+        '''
+        self.filePath = filePath;
+        self.mimeType = mimeType;
+        self.load();
+
+    def load(self):
+        '''
+        (Re)read the file from disk. Computes ETag, the gzip variant,
+        and the header blocks for both variants.
+        '''
+        # Take mtime before reading so that an edit during the
+        # read causes a reload on the next check:
+        self.mtime = os.path.getmtime(self.filePath);
+        with open(self.filePath, 'rb') as fileFD:
+            self.body = fileFD.read();
+        self.etag = '"%s"' % hashlib.md5(self.body).hexdigest();
+        self.lastModified = formatdate(self.mtime, usegmt=True);
+        self.lastChecked = time.time();
+
+        self.gzipBody = None;
+        if len(self.body) >= GZIP_MIN_SIZE:
+            buf = cStringIO.StringIO();
+            gzipFD = gzip.GzipFile(fileobj=buf, mode='wb', mtime=self.mtime);
+            gzipFD.write(self.body);
+            gzipFD.close();
+            compressed = buf.getvalue();
+            # Only keep the compressed variant if it actually helps:
+            if len(compressed) < len(self.body):
+                self.gzipBody = compressed;
+
+        self.plainReply = self.makeHeaders(len(self.body)) + "\r\n" + self.body;
+        if self.gzipBody is not None:
+            self.gzipReply = self.makeHeaders(len(self.gzipBody), contentEncoding='gzip') + "\r\n" + self.gzipBody;
+        else:
+            self.gzipReply = None;
+        self.notModifiedReply = "HTTP/1.1 304 Not Modified\r\n" +\
+                                "ETag: %s\r\n" % self.etag +\
+                                "Last-Modified: %s\r\n" % self.lastModified +\
+                                "\r\n";
+
+    def makeHeaders(self, contentLen, contentEncoding=None):
+        '''
+        Build the status line and headers for a 200 reply, without
+        the blank line that separates headers from body.
+        @param contentLen: number of body bytes that will follow.
+        @type contentLen: int
+        @param contentEncoding: value for Content-Encoding, or None.
+        @type contentEncoding: string
+        @return: header block
+        @rtype: string
+        '''
+        headers = "HTTP/1.1 200 OK\r\n" +\
+                  "Content-Type: %s\r\n" % self.mimeType +\
+                  "Content-Length: %d\r\n" % contentLen +\
+                  "Last-Modified: %s\r\n" % self.lastModified +\
+                  "ETag: %s\r\n" % self.etag +\
+                  "Cache-Control: no-cache\r\n";
+        if self.gzipBody is not None:
+            headers += "Vary: Accept-Encoding\r\n";
+        if contentEncoding is not None:
+            headers += "Content-Encoding: %s\r\n" % contentEncoding;
+        return headers;
+
+    def refreshIfStale(self, checkInterval):
+        '''
+        Reload the file if its modification time changed since it
+        was loaded. The file system is consulted at most once
+        every checkInterval seconds.
+        @param checkInterval: minimum seconds between mtime checks.
+        @type checkInterval: float
+        @return: False if the file disappeared, else True.
+        @rtype: boolean
+        '''
+        now = time.time();
+        if now - self.lastChecked < checkInterval:
+            return True;
+        self.lastChecked = now;
+        try:
+            if os.path.getmtime(self.filePath) != self.mtime:
+                self.load();
+        except (OSError, IOError):
+            return False;
+        return True;
+
+    def isNotModified(self, request):
+        '''
+        Decide whether a conditional GET can be answered with 304.
+        If-None-Match takes precedence over If-Modified-Since.
+        @param request: incoming request
+        @type request: tornado.httpserver.HTTPRequest
+        @rtype: boolean
+        '''
+        ifNoneMatch = request.headers.get('If-None-Match');
+        if ifNoneMatch is not None:
+            etags = [tag.strip() for tag in ifNoneMatch.split(',')];
+            return ('*' in etags) or (self.etag in etags);
+        ifModifiedSince = request.headers.get('If-Modified-Since');
+        if ifModifiedSince is not None:
+            parsedDate = parsedate_tz(ifModifiedSince);
+            if parsedDate is None:
+                return False;
+            # HTTP dates have one-second resolution:
+            return int(self.mtime) <= mktime_tz(parsedDate);
+        return False;
+
+    def replyFor(self, request):
+        '''
+        Return the complete response (headers plus body) that
+        answers the given request.
+        @param request: incoming request
+        @type request: tornado.httpserver.HTTPRequest
+        @return: bytes to write to the connection
+        @rtype: string
+        '''
+        if self.isNotModified(request):
+            return self.notModifiedReply;
+        if self.gzipReply is not None and 'gzip' in request.headers.get('Accept-Encoding', ''):
+            return self.gzipReply;
+        return self.plainReply;
+
+# ------------------------------- class StaticAssetCache ---------------------
+
+class StaticAssetCache(object):
+    '''
+    Holds a StaticAsset for each file below a root directory.
+    The whole directory is loaded at creation time. Files
+    that are added later are picked up on first request.
+    Thread safe: the experiment server serves pages from
+    its own thread.
+    '''
+
+    NOT_FOUND_REPLY = "HTTP/1.1 404 Not Found\r\n" +\
+                      "Content-Type: text/plain\r\n" +\
+                      "Content-Length: 9\r\n" +\
+                      "\r\n" +\
+                      "Not found";
+
+    def __init__(self, rootDir, checkInterval=DEFAULT_CHECK_INTERVAL):
+        '''
+        Create the cache, and preload every file below rootDir.
+        @param rootDir: directory whose files are to be served.
+        @type rootDir: string
+        @param checkInterval: minimum number of seconds between checks
+                              of a file's modification time.
+        @type checkInterval: float
+        '''
+        self.rootDir = os.path.realpath(rootDir);
+        self.checkInterval = checkInterval;
+        self.assets = {};
+        self.assetsLock = Lock();
+        self.preload();
+
+    def preload(self):
+        '''
+        Walk the root directory, and load each servable file.
+        '''
+        for dirPath, dirNames, fileNames in os.walk(self.rootDir):
+            for fileName in fileNames:
+                if fileName.startswith('.') or fileName.endswith(IGNORED_SUFFIXES):
+                    continue;
+                relPath = os.path.relpath(os.path.join(dirPath, fileName), self.rootDir);
+                self.loadAsset(relPath);
+
+    def mimeTypeFor(self, relPath):
+        extension = os.path.splitext(relPath)[1].lower();
+        try:
+            return MIME_TYPES[extension];
+        except KeyError:
+            guessedType = mimetypes.guess_type(relPath)[0];
+            return guessedType if guessedType is not None else DEFAULT_MIME;
+
+    def loadAsset(self, relPath):
+        '''
+        Read one file into the cache. Refuses paths that
+        resolve to outside the root directory.
+        @param relPath: file path relative to the root directory.
+        @type relPath: string
+        @return: the new asset, or None if the file is not servable.
+        @rtype: {StaticAsset | None}
+        '''
+        absPath = os.path.realpath(os.path.join(self.rootDir, relPath));
+        if not absPath.startswith(self.rootDir + os.sep) or not os.path.isfile(absPath):
+            return None;
+        try:
+            asset = StaticAsset(absPath, self.mimeTypeFor(absPath));
+        except (OSError, IOError):
+            return None;
+        with self.assetsLock:
+            self.assets[os.path.normpath(relPath)] = asset;
+        return asset;
+
+    def get(self, relPath):
+        '''
+        Return the up to date asset for the given path, or None
+        if no such file exists below the root directory.
+        @param relPath: file path relative to the root directory.
+        @type relPath: string
+        @rtype: {StaticAsset | None}
+        '''
+        relPath = os.path.normpath(relPath);
+        try:
+            asset = self.assets[relPath];
+        except KeyError:
+            return self.loadAsset(relPath);
+        if not asset.refreshIfStale(self.checkInterval):
+            # File was deleted:
+            with self.assetsLock:
+                self.assets.pop(relPath, None);
+            return None;
+        return asset;
+
+    def serve(self, request, relPath):
+        '''
+        Answer a request for one file with a single write:
+        200 (plain or gzipped), 304 for a matching conditional
+        GET, or 404 if the file does not exist.
+        @param request: incoming request
+        @type request: tornado.httpserver.HTTPRequest
+        @param relPath: requested file path relative to the root directory.
+        @type relPath: string
+        @return: True if the file was found, else False.
+        @rtype: boolean
+        '''
+        asset = self.get(relPath);
+        if asset is None:
+            request.write(StaticAssetCache.NOT_FOUND_REPLY);
+            request.finish();
+            return False;
+        request.write(asset.replyFor(request));
+        request.finish();
+        return True;
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+'''
+Precomputes the followers that WordExplorer uses when it skips
+stopwords. For each word1 of each n-gram table, the first topK
+followers that hold no stopwords, in the order in which WordFollower
+reads them, are written to a table with the same schema and indexes:
+
+    BigramsNoStopwords(probability real, word1 varchar(25), word2 varchar(25))
+    TrigramsNoStopwords(probability real, word1 varchar(25), word2 varchar(25), word3 varchar(25))
+
+A trigram follower is left out if either of its words is a stopword.
+Words with non-ASCII characters are skipped, since WordFollower strips
+them from the words it looks up. A third table records the model
+version the followers were computed for, topK, and the stopwords:
+
+    StopwordFreeFollowers(modelVersion integer, topK integer, stopwords text)
+
+Writing the tables increments the model version, so that servers drop
+their caches. WordExplorer ignores the tables once an update changes
+the model version again, or if its stopwords differ, and falls back to
+dropping stopword followers itself; run this module again after each
+update. compact_model.py does not copy the tables; run this module on
+the compacted database instead.
+
+Run as a script, the module adds the tables to a database, and reports
+the rows kept, and the sizes of the database before and after:
+
+    stopword_free_followers.py dbPath [-k topK]
+'''
+
+import os;
+import sys;
+import json;
+import time;
+import sqlite3;
+import argparse;
+
+from ngram_database import NGRAM_TABLES, INSERT_BATCH_ROWS, selectTopFollowers, copyIndexes;
+from echo_tree import STOPWORDS, STOPWORD_FREE_TABLES, STOPWORD_FREE_INFO_TABLE, TokenCleaner;
+
+# Default number of followers kept per word; the
+# widest stopword-free trees that can be built:
+DEFAULT_TOP_K = 10;
+
+def writeStopwordFreeFollowers(dbPath, topK=DEFAULT_TOP_K, stopwords=STOPWORDS, progressLogger=None):
+    '''
+    Add, or replace, the stopword-free follower tables of a database.
+    All changes are one transaction, so readers see either the old or
+    the new tables.
+    @param dbPath: the n-gram database
+    @type dbPath: string
+    @param topK: number of followers kept per word1.
+    @type topK: int
+    @param stopwords: words that followers may not contain, in lower case.
+    @type stopwords: iterable(string)
+    @param progressLogger: if provided, called with progress messages.
+    @type progressLogger: callable
+    @return: maps each n-gram table name to (rows in the table, rows kept).
+    @rtype: {string : (int, int)}
+    @raise ValueError: for a topK below 1.
+    '''
+    if topK < 1:
+        raise ValueError("Must keep at least one follower per word; got %d." % topK);
+    if not os.path.exists(dbPath):
+        raise IOError("Database %s does not exist." % dbPath);
+    log = progressLogger if progressLogger is not None else lambda msg: None;
+    cleaner = TokenCleaner(removeStopwords=True, stopwords=stopwords);
+    conn = sqlite3.connect(dbPath);
+    conn.text_factory = str;
+    # Transactions are started and committed explicitly. The sqlite3
+    # module would otherwise commit before each CREATE and DROP:
+    conn.isolation_level = None;
+    try:
+        conn.execute('BEGIN IMMEDIATE');
+        try:
+            schema = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type='table'").fetchall());
+            rowCounts = {};
+            for arity in sorted(NGRAM_TABLES.keys()):
+                (tableName, countTableName, wordColumns, indexStatements) = NGRAM_TABLES[arity];
+                filteredTableName = STOPWORD_FREE_TABLES[arity];
+                conn.execute('DROP TABLE IF EXISTS %s' % filteredTableName);
+                if tableName not in schema:
+                    continue;
+                startTime = time.time();
+                rows = selectTopFollowers(conn, tableName, wordColumns, topK,
+                                          lambda word1, followers: all(cleaner.isKept(followerWord) for followerWord in followers));
+                # Same schema as the source, which may hold quantized probabilities:
+                conn.execute(schema[tableName].replace(tableName, filteredTableName, 1));
+                insertStatement = 'INSERT INTO %s (probability, %s) VALUES (%s)' % (filteredTableName, ', '.join(wordColumns), ','.join(['?'] * (arity + 1)));
+                for batchStart in xrange(0, len(rows), INSERT_BATCH_ROWS):
+                    conn.executemany(insertStatement, rows[batchStart:batchStart + INSERT_BATCH_ROWS]);
+                # Indexed like the source, so that followers with equal
+                # probabilities come back in the same order. The source
+                # may have no index; then neither has the copy:
+                copyIndexes(conn, conn, tableName, filteredTableName);
+                rowCounts[tableName] = (conn.execute('SELECT COUNT(*) FROM %s' % tableName).fetchone()[0], len(rows));
+                log("Kept %d of %d rows of %s in %.1f sec." % (rowCounts[tableName][1], rowCounts[tableName][0], tableName, time.time() - startTime));
+            modelVersion = conn.execute('PRAGMA user_version').fetchone()[0] + 1;
+            conn.execute('DROP TABLE IF EXISTS %s' % STOPWORD_FREE_INFO_TABLE);
+            conn.execute('CREATE TABLE %s(modelVersion integer, topK integer, stopwords text)' % STOPWORD_FREE_INFO_TABLE);
+            conn.execute('INSERT INTO %s VALUES (?,?,?)' % STOPWORD_FREE_INFO_TABLE,
+                         (modelVersion, topK, json.dumps(sorted(cleaner.stopwords))));
+            conn.execute('PRAGMA user_version=%d' % modelVersion);
+            conn.execute('ANALYZE');
+            conn.execute('COMMIT');
+        except:
+            conn.execute('ROLLBACK');
+            raise;
+    finally:
+        conn.close();
+    return rowCounts;
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog='stopword_free_followers');
+    parser.add_argument("dbPath", help="n-gram database to which the stopword-free follower tables are added.");
+    parser.add_argument("-k", "--topK", type=int, dest='topK', default=DEFAULT_TOP_K,
+                        help="followers to keep per word; the widest trees that can be built. Default: %d." % DEFAULT_TOP_K);
+    args = parser.parse_args();
+
+    def printMsg(msg):
+        print msg;
+
+    dbSize = os.path.getsize(args.dbPath) if os.path.exists(args.dbPath) else 0;
+    try:
+        writeStopwordFreeFollowers(args.dbPath, topK=args.topK, progressLogger=printMsg);
+    except (ValueError, IOError) as e:
+        print("Error: %s" % e);
+        sys.exit(1);
+    newDbSize = os.path.getsize(args.dbPath);
+    print("Database size: %.1f MB --> %.1f MB." % (dbSize / 1048576.0, newDbSize / 1048576.0));
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+'''
+Shared reader for tokenized corpus files, as written by the Stanford
+NLP tokenizer/sentence segmenter: one bracketed, comma separated list
+of tokens per sentence, e.g. "[see, there, :, he, 'll, jump]".
+
+Files are memory-mapped rather than read into one string, and all
+sentences of a file are found by a single compiled pattern that scans
+the mapped buffer. Only the sentences themselves are copied out.
+
+Two views of a file are provided, matching the two consumers:
+
+    iterChunkSentences()     The DB builder's view (SentenceFeeder): the
+                             text from just after one ']' up to the next
+                             ']', opening bracket included. Text after
+                             the last ']' is ignored.
+    iterBracketedSentences() The evaluator's view: the text between a '['
+                             and the following ']', optionally with some
+                             characters deleted. An unfinished last
+                             sentence is ignored with a warning.
+                             iterBracketedSentencePositions() also hands
+                             out byte offsets, from which reading can
+                             resume.
+'''
+
+import mmap;
+import re;
+
+# Sentences per batch in iterSentenceBatches():
+DEFAULT_BATCH_SIZE = 1000;
+
+# Everything up to and excluding the next closing bracket:
+CHUNK_SENTENCE_PATTERN = re.compile(r'([^\]]*)\]');
+# Everything between an opening bracket and the next closing bracket:
+BRACKETED_SENTENCE_PATTERN = re.compile(r'\[([^\]]*)\]');
+
+def mapFile(filePath):
+    '''
+    Map the given file into memory, read-only. The result supports
+    slicing, find(), and regular expression matching like a string.
+    Empty files cannot be mapped, and are returned as ''.
+    @param filePath: file to map
+    @type filePath: string
+    @return: the mapped file. Call closeMapping() when done.
+    @rtype: {mmap.mmap | string}
+    '''
+    with open(filePath, 'rb') as fd:
+        try:
+            return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ);
+        except ValueError:
+            # Empty file:
+            return '';
+
+def closeMapping(buf):
+    if isinstance(buf, mmap.mmap):
+        buf.close();
+
+def iterBufferChunkSentences(buf):
+    '''
+    Iterate over the sentences of a mapped chunk file in SentenceFeeder's
+    view. Scanning stops at the last closing bracket, so an unterminated
+    tail costs no backtracking.
+    @param buf: mapped file, or string
+    @type buf: {mmap.mmap | string}
+    @return: iterator over sentence strings
+    @rtype: iterator
+    '''
+    endPos = buf.rfind(']') + 1;
+    for matchObj in CHUNK_SENTENCE_PATTERN.finditer(buf, 0, endPos):
+        yield matchObj.group(1);
+
+def iterChunkSentences(tokenFilePaths):
+    '''
+    Iterate over the sentences of the given chunk files, in order,
+    in SentenceFeeder's view.
+    @param tokenFilePaths: paths of the chunk files
+    @type tokenFilePaths: [string]
+    @return: iterator over sentence strings
+    @rtype: iterator
+    '''
+    for tokenFilePath in tokenFilePaths:
+        buf = mapFile(tokenFilePath);
+        try:
+            for sentence in iterBufferChunkSentences(buf):
+                yield sentence;
+        finally:
+            closeMapping(buf);
+
+def iterSentenceBatches(tokenFilePaths, batchSize=DEFAULT_BATCH_SIZE):
+    '''
+    Like iterChunkSentences(), but hands out lists of up to batchSize
+    sentences, which saves a generator round trip per sentence.
+    @param tokenFilePaths: paths of the chunk files
+    @type tokenFilePaths: [string]
+    @param batchSize: maximum number of sentences per batch
+    @type batchSize: int
+    @return: iterator over lists of sentence strings
+    @rtype: iterator
+    '''
+    batch = [];
+    for sentence in iterChunkSentences(tokenFilePaths):
+        batch.append(sentence);
+        if len(batch) >= batchSize:
+            yield batch;
+            batch = [];
+    if len(batch) > 0:
+        yield batch;
+
+def iterBracketedSentences(tokenFilePath, deleteChars=None):
+    '''
+    Iterate over the bracketed sentences of one token file, in the
+    evaluator's view.
+    @param tokenFilePath: path of the token file
+    @type tokenFilePath: string
+    @param deleteChars: if provided, these characters are removed from each sentence.
+    @type deleteChars: string
+    @return: iterator over sentence strings, brackets excluded.
+    @rtype: iterator
+    '''
+    for (sentenceEnd, sentence) in iterBracketedSentencePositions(tokenFilePath, deleteChars):
+        yield sentence;
+
+def iterBracketedSentencePositions(tokenFilePath, deleteChars=None, startPos=0):
+    '''
+    Like iterBracketedSentences(), but reading starts at the given byte
+    offset, and each sentence comes with the offset just past its closing
+    bracket. Passing that offset as startPos continues with the next sentence.
+    @param tokenFilePath: path of the token file
+    @type tokenFilePath: string
+    @param deleteChars: if provided, these characters are removed from each sentence.
+    @type deleteChars: string
+    @param startPos: byte offset at which to start reading
+    @type startPos: int
+    @return: iterator over (byte offset past the sentence, sentence string)
+    @rtype: iterator
+    '''
+    buf = mapFile(tokenFilePath);
+    try:
+        endPos = buf.rfind(']') + 1;
+        for matchObj in BRACKETED_SENTENCE_PATTERN.finditer(buf, min(startPos, endPos), endPos):
+            sentence = matchObj.group(1);
+            if deleteChars is not None:
+                sentence = sentence.translate(None, deleteChars);
+            yield (matchObj.end(), sentence);
+        unfinishedStart = buf.find('[', max(startPos, endPos));
+        if unfinishedStart > -1:
+            unfinished = buf[unfinishedStart + 1:];
+            if deleteChars is not None:
+                unfinished = unfinished.translate(None, deleteChars);
+            print "Warning: ignoring unfinished sentence: %s." % unfinished;
+    finally:
+        closeMapping(buf);